@@ -0,0 +1,4 @@
+"""
+Benchmarks of the screamshot server, run them from the repository root with \
+``python -m benchmarks.<name>``.
+"""
@@ -0,0 +1,341 @@
+"""
+Load test of the screamshot server against the test server in ``tests/server``.
+
+It starts the test server and the screamshot server, sends a mix of requests at several
+concurrency levels and reports the throughput, the latency percentiles, the memory high-water
+mark of the screamshot server and its browsers, the number of browser processes and the share of
+the page resources served by the browser caches. The results are saved as json so that two
+commits can be compared:
+
+>>> python -m benchmarks.load --concurrency 1,4,16 --requests 200 --output before.json
+>>> python -m benchmarks.load --concurrency 1,4,16 --requests 200 --output after.json \
+    --compare before.json
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from json import dump, dumps, load
+from os import environ, getpid, listdir, sysconf
+from os.path import abspath, dirname, join
+from random import Random
+from subprocess import DEVNULL, Popen, check_output
+from sys import executable
+from threading import Event, Thread
+from time import perf_counter, sleep, time
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from src.admission import _children
+
+
+ROOT = dirname(dirname(abspath(__file__)))
+PAGE_SIZE = sysconf('SC_PAGE_SIZE')
+
+DEFAULT_MIX = [
+    {'name': 'get', 'method': 'GET', 'path': '/index', 'weight': 4},
+    {'name': 'post-selector', 'method': 'POST', 'path': '/index',
+     'data': {'selector': '#godot'}, 'weight': 2},
+    {'name': 'post-wait-for', 'method': 'POST', 'path': '/index',
+     'data': {'wait_for': '#godot', 'width': '1024', 'height': '768'}, 'weight': 2},
+    {'name': 'get-other', 'method': 'GET', 'path': '/other', 'weight': 1},
+    {'name': 'post-wait-until', 'method': 'POST', 'path': '/index',
+     'data': {'wait_until': 'networkidle0'}, 'weight': 1},
+    {'name': 'post-credentials', 'method': 'POST', 'path': '/protected_index',
+     'data': {'credentials': '{"username": "makina", "password": "makina"}'}, 'weight': 1},
+]
+
+
+def _rss(pid):
+    try:
+        with open(join('/proc', str(pid), 'statm')) as statm_file:
+            return int(statm_file.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def _is_browser(pid):
+    try:
+        with open(join('/proc', str(pid), 'cmdline'), 'rb') as cmdline_file:
+            return b'chrom' in cmdline_file.read().split(b'\0')[0].lower()
+    except OSError:
+        return False
+
+
+class ProcessSampler():
+    """
+    Samples the memory and the number of browsers of a process tree in a thread.
+    """
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.max_rss = 0
+        self.max_browsers = 0
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            tree = [self.pid] + _children(self.pid)
+            self.max_rss = max(self.max_rss, sum(_rss(pid) for pid in tree))
+            self.max_browsers = max(self.max_browsers, len([pid for pid in tree
+                                                            if _is_browser(pid)]))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+
+def _wait_server(url, timeout=30):
+    deadline = time() + timeout
+    while time() < deadline:
+        try:
+            urlopen(url, timeout=1).close()
+            return
+        except HTTPError:
+            return
+        except (URLError, OSError):
+            sleep(0.2)
+    raise RuntimeError('{0} did not start'.format(url))
+
+
+def start_servers(args):
+    """
+    :return: the started processes, the test server first
+    :retype: list(subprocess.Popen)
+    """
+    env = dict(environ, FLASK_APP='app.py')
+    fixture = Popen([executable, '-m', 'flask', 'run', '--port', str(args.fixture_port)],
+                    cwd=join(ROOT, 'tests', 'server'), env=env, stdout=DEVNULL, stderr=DEVNULL)
+    if args.server == 'gunicorn':
+        command = ['gunicorn', '-b', '127.0.0.1:{0}'.format(args.port), '-w', str(args.workers),
+                   '--threads', str(args.threads), 'src:app']
+    else:
+        command = [executable, '-m', 'flask', 'run', '--port', str(args.port),
+                   '--with-threads']
+    server = Popen(command, cwd=ROOT, env=dict(environ, FLASK_APP='src'), stdout=DEVNULL,
+                   stderr=DEVNULL)
+    try:
+        _wait_server('http://127.0.0.1:{0}/index'.format(args.fixture_port))
+        _wait_server('http://127.0.0.1:{0}/metrics'.format(args.port))
+    except RuntimeError:
+        stop_servers([fixture, server])
+        raise
+    return [fixture, server]
+
+
+def stop_servers(processes):
+    """
+    Stops the processes started by ``start_servers``
+    """
+    for process in processes:
+        process.terminate()
+        process.wait()
+
+
+def send(base_url, fixture_url, item, extra_data=None):
+    """
+    Sends the request described by a mix ``item``
+
+    :return: the status code, the latency in seconds and the response headers
+    :retype: tuple
+    """
+    query = urlencode({'url': fixture_url + item['path']})
+    data = None
+    if item.get('method', 'GET') == 'POST':
+        data = urlencode(dict(item.get('data', {}), **(extra_data or {}))).encode('utf-8')
+    request = Request('{0}/api/take-screenshot?{1}'.format(base_url, query), data=data,
+                      method=item.get('method', 'GET'))
+    start = perf_counter()
+    try:
+        with urlopen(request, timeout=120) as response:
+            response.read()
+            status, headers = response.status, dict(response.headers)
+    except HTTPError as exc:
+        exc.read()
+        status, headers = exc.code, dict(exc.headers)
+    except (URLError, OSError):
+        status, headers = 0, {}
+    return status, perf_counter() - start, headers
+
+
+def resource_cache_counts(headers):
+    """
+    :return: the hits and misses of the ``X-Resource-Cache`` header of a response
+    :retype: tuple
+    """
+    counts = dict(item.strip().split('=', 1) for item in
+                  headers.get('X-Resource-Cache', '').split(',') if '=' in item)
+    return int(counts.get('hits', 0)), int(counts.get('misses', 0))
+
+
+def percentile(values, rank):
+    """
+    :return: the nearest-rank percentile of ``values``
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, int(round(rank / 100 * len(values))) - 1)]
+
+
+def run_level(args, mix, concurrency, pid):
+    """
+    Sends ``args.requests`` requests with ``concurrency`` clients
+
+    :return: the results of the level
+    :retype: dict
+    """
+    random = Random(args.seed)
+    items = random.choices(mix, weights=[item.get('weight', 1) for item in mix],
+                           k=args.requests)
+    extra_data = {'cache': args.cache} if args.cache else None
+    base_url = 'http://127.0.0.1:{0}'.format(args.port)
+    fixture_url = 'http://127.0.0.1:{0}'.format(args.fixture_port)
+    with ProcessSampler(pid) as sampler, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = perf_counter()
+        responses = list(executor.map(lambda item: send(base_url, fixture_url, item, extra_data),
+                                      items))
+        duration = perf_counter() - start
+    latencies = [latency for status, latency, _ in responses if status == 200]
+    resource_counts = [resource_cache_counts(headers) for _, _, headers in responses]
+    resource_hits = sum(hits for hits, _ in resource_counts)
+    resource_total = resource_hits + sum(misses for _, misses in resource_counts)
+    by_item = {}
+    for item, (status, latency, headers) in zip(items, responses):
+        stats = by_item.setdefault(item['name'], {'requests': 0, 'errors': 0, 'latencies': []})
+        stats['requests'] += 1
+        if status == 200:
+            stats['latencies'].append(latency)
+        else:
+            stats['errors'] += 1
+    return {
+        'concurrency': concurrency,
+        'requests': len(responses),
+        'errors': len(responses) - len(latencies),
+        'requests_per_second': len(responses) / duration,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max_rss_bytes': sampler.max_rss,
+        'max_browser_processes': sampler.max_browsers,
+        'cache_hits': len([1 for _, _, headers in responses if headers.get('X-Cache') == 'HIT']),
+        'resource_cache_hit_rate': resource_hits / resource_total if resource_total else None,
+        'mix': {name: {'requests': stats['requests'], 'errors': stats['errors'],
+                       'p50': percentile(stats['latencies'], 50)}
+                for name, stats in sorted(by_item.items())},
+    }
+
+
+def _format_ms(value):
+    return '{0:.1f}'.format(value * 1000) if value is not None else '-'
+
+
+def _format_delta(value, old_value):
+    if not value or not old_value:
+        return '-'
+    return '{0:+.1%}'.format(value / old_value - 1)
+
+
+def _format_points(value, old_value):
+    if value is None or old_value is None:
+        return '-'
+    return '{0:+.1f} pt'.format((value - old_value) * 100)
+
+
+def report(levels, previous=None):
+    """
+    Prints the results, and their evolution if the ``previous`` results are given
+    """
+    previous_levels = {level['concurrency']: level for level in (previous or {}).get('levels', [])}
+    row = '{0:>11} {1:>8} {2:>8} {3:>8} {4:>8} {5:>7} {6:>12} {7:>9} {8:>11}'
+    print(row.format('concurrency', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors',
+                     'max RSS MiB', 'browsers', 'res. hits'))
+    for level in levels:
+        hit_rate = level.get('resource_cache_hit_rate')
+        print(row.format(
+            level['concurrency'], '{0:.2f}'.format(level['requests_per_second']),
+            *[_format_ms(level[key]) for key in ('p50', 'p95', 'p99')], level['errors'],
+            '{0:.1f}'.format(level['max_rss_bytes'] / 2 ** 20), level['max_browser_processes'],
+            '{0:.1%}'.format(hit_rate) if hit_rate is not None else '-'))
+        old = previous_levels.get(level['concurrency'])
+        if old:
+            print(row.format(
+                'vs before', _format_delta(level['requests_per_second'],
+                                           old['requests_per_second']),
+                *[_format_delta(level[key], old[key]) for key in ('p50', 'p95', 'p99')],
+                '{0:+d}'.format(level['errors'] - old['errors']),
+                _format_delta(level['max_rss_bytes'], old['max_rss_bytes']),
+                '{0:+d}'.format(level['max_browser_processes'] - old['max_browser_processes']),
+                _format_points(level.get('resource_cache_hit_rate'),
+                               old.get('resource_cache_hit_rate'))))
+
+
+def _git_commit():
+    try:
+        return check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT).decode('ascii').strip()
+    except (OSError, ValueError):
+        return None
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--concurrency', default='1,4,16',
+                        help='Comma separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per level')
+    parser.add_argument('--mix', help='Json file with the request mix, a list of objects with '
+                        'name, method, path, data and weight keys')
+    parser.add_argument('--cache', choices=['use', 'bypass', 'refresh'], default='bypass',
+                        help='The cache parameter of the POST requests, the GET requests '
+                        'are left out of the mix unless it is use')
+    parser.add_argument('--server', choices=['gunicorn', 'flask', 'none'], default='gunicorn',
+                        help='How to start the screamshot server, none to use a running one')
+    parser.add_argument('--pid', type=int, help='The pid of the running screamshot server')
+    parser.add_argument('--workers', type=int, default=2, help='Gunicorn workers')
+    parser.add_argument('--threads', type=int, default=4, help='Gunicorn threads per worker')
+    parser.add_argument('--port', type=int, default=8000, help='The screamshot server port')
+    parser.add_argument('--fixture-port', type=int, default=5000, help='The test server port')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the request mix')
+    parser.add_argument('--output', help='Json file the results are written to')
+    parser.add_argument('--compare', help='Json file of previous results')
+    args = parser.parse_args()
+
+    mix = DEFAULT_MIX
+    if args.mix:
+        with open(args.mix) as mix_file:
+            mix = load(mix_file)
+    if args.cache != 'use':
+        # The GET requests have no cache parameter, they would be served from the cache
+        mix = [item for item in mix if item.get('method', 'GET') == 'POST']
+        print('The GET requests are left out of the mix with --cache {0}'.format(args.cache))
+
+    processes = []
+    if args.server != 'none':
+        processes = start_servers(args)
+    pid = processes[1].pid if processes else (args.pid or getpid())
+    try:
+        levels = [run_level(args, mix, int(concurrency), pid)
+                  for concurrency in args.concurrency.split(',')]
+    finally:
+        stop_servers(processes)
+
+    results = {'commit': _git_commit(), 'date': time(), 'args': vars(args), 'mix': mix,
+               'levels': levels}
+    previous = None
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous = load(previous_file)
+    report(levels, previous)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            dump(results, output_file, indent=2)
+    else:
+        print(dumps(results['levels'], indent=2))
+
+
+if __name__ == '__main__':
+    main()
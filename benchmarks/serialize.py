@@ -0,0 +1,87 @@
+"""
+Micro-benchmark of ``ScreenshotSerializer.serialize``: compares the legacy decode/encode/temp-file
+path with the in-memory PNG path.
+
+>>> python -m benchmarks.serialize --number 200
+"""
+from argparse import ArgumentParser
+from io import BytesIO
+from tempfile import NamedTemporaryFile
+from timeit import timeit
+import tracemalloc
+
+from flask import send_file
+
+from PIL.Image import open as image_opener
+
+from src import app
+from src.serializers import ScreenshotSerializer
+
+
+DEFAULT_IMAGE = 'tests/server/static/images/600_800_index_page.png'
+
+
+def legacy_serializer(bytes_obj):
+    """
+    The serialization path used before the in-memory PNG response: decode with PIL, re-encode \
+        into a temporary file and send that file.
+    """
+    temp_file = NamedTemporaryFile(suffix='.png')
+    img = image_opener(BytesIO(bytes_obj))
+    img.save(temp_file)
+    temp_file.flush()
+    return send_file(temp_file.name, mimetype='image/png')
+
+
+def in_memory_serializer(bytes_obj):
+    """
+    The current serialization path.
+    """
+    return ScreenshotSerializer('http://bench').serialize(bytes_obj=bytes_obj)
+
+
+def _consume(response):
+    for _ in response.response:
+        pass
+    response.close()
+
+
+def measure(serializer, bytes_obj, number):
+    """
+    :return: the mean latency in milliseconds and the peak allocated memory in KiB of one call
+    """
+    def run():
+        _consume(serializer(bytes_obj))
+
+    with app.test_request_context():
+        run()
+        latency = timeit(run, number=number) / number * 1000
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return latency, peak / 1024
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--image', default=DEFAULT_IMAGE, help='The PNG image to serialize')
+    parser.add_argument('--number', type=int, default=100, help='Number of calls per path')
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as image_file:
+        bytes_obj = image_file.read()
+
+    print('image: {0} ({1} bytes), {2} calls'.format(args.image, len(bytes_obj), args.number))
+    results = {}
+    for name, serializer in (('legacy', legacy_serializer), ('in-memory', in_memory_serializer)):
+        results[name] = measure(serializer, bytes_obj, args.number)
+        print('{0:>10}: {1:8.3f} ms/request, peak {2:9.1f} KiB allocated'.format(
+            name, *results[name]))
+    print('   speedup: x{0:.1f}, allocations: -{1:.1f} KiB'.format(
+        results['legacy'][0] / results['in-memory'][0],
+        results['legacy'][1] - results['in-memory'][1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Benchmark of the image transforms: bytes on the wire and encoding time for each output format,
+quality and thumbnail size.
+
+>>> python -m benchmarks.transforms --number 5
+"""
+from argparse import ArgumentParser
+from timeit import timeit
+
+from src.transforms import transform_image
+
+
+DEFAULT_IMAGE = 'tests/server/static/images/600_800_index_page.png'
+CASES = [
+    ('png (as rendered)', None),
+    ('png compress_level=9', {'compress_level': 9}),
+    ('jpeg quality=85', {'image_format': 'jpeg', 'quality': 85}),
+    ('jpeg quality=60', {'image_format': 'jpeg', 'quality': 60}),
+    ('webp quality=80', {'image_format': 'webp', 'quality': 80}),
+    ('png thumbnail 200', {'width': 200}),
+    ('jpeg thumbnail 200', {'image_format': 'jpeg', 'quality': 80, 'width': 200}),
+    ('webp thumbnail 200', {'image_format': 'webp', 'quality': 80, 'width': 200}),
+]
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--image', default=DEFAULT_IMAGE, help='The PNG image to transform')
+    parser.add_argument('--number', type=int, default=3, help='Number of encodings per case')
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as image_file:
+        bytes_obj = image_file.read()
+
+    print('| Output | Bytes | Saving | Encoding |')
+    print('| --- | ---: | ---: | ---: |')
+    for name, options in CASES:
+        if options is None:
+            output, duration = bytes_obj, 0
+        else:
+            output = transform_image(bytes_obj, **options)
+            duration = timeit(lambda: transform_image(bytes_obj, **options),
+                              number=args.number) / args.number * 1000
+        print('| {0} | {1} | {2:.0%} | {3:.0f} ms |'.format(
+            name, len(output), 1 - len(output) / len(bytes_obj), duration))
+
+
+if __name__ == '__main__':
+    main()
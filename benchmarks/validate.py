@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of the validation of the screenshot parameters: ``ScreenshotSerializer.is_valid``
+and the cache key looked up by the cache, the coalescing and the pre-warming of a request.
+
+>>> python -m benchmarks.validate --number 20000
+"""
+from argparse import ArgumentParser
+from timeit import timeit
+
+from src.cache import cache_key
+from src.serializers import ScreenshotSerializer
+
+
+URL = 'https://www.example.com/pricing'
+CASES = [
+    ('GET, no parameter', {}),
+    ('POST, viewport and selector', {'width': '1280', 'height': '800', 'selector': '#main',
+                                     'wait_until': 'networkidle0'}),
+    ('POST, credentials', {'credentials': '{"username": "makina", "password": "makina"}',
+                           'wait_until': ['load', 'domcontentloaded']}),
+    ('POST, viewports and blocking', {'width': ['320', '1280'], 'height': '800',
+                                      'block_profile': 'fast', 'block_domains': 'ads.example.net'}),
+    ('POST, webp thumbnail', {'format': 'webp', 'quality': '80', 'thumbnail_width': '200'}),
+    ('POST, errors', {'width': 'wide', 'wait_until': 'soon', 'bad_param': '1'}),
+]
+# The cache key is looked up by the cache, the coalescing and the pre-warming
+KEY_LOOKUPS = 3
+
+
+def validate(raw_data):
+    """
+    Validates a request and looks its cache key up like a request does
+    """
+    serializer = ScreenshotSerializer(URL, raw_data=dict(raw_data))
+    if serializer.is_valid():
+        for _ in range(KEY_LOOKUPS):
+            serializer.cache_key()
+
+
+def validate_unshared(raw_data):
+    """
+    Validates a request and hashes its parameters at each lookup, like before the key was shared
+    """
+    serializer = ScreenshotSerializer(URL, raw_data=dict(raw_data))
+    if serializer.is_valid():
+        for _ in range(KEY_LOOKUPS):
+            cache_key(serializer.url, serializer.data)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20000, help='Number of requests per case')
+    parser.add_argument('--target', type=float, default=10000,
+                        help='The minimum number of requests per second')
+    args = parser.parse_args()
+
+    print('| Request | Requests/s | Unshared key | Speedup |')
+    print('| --- | ---: | ---: | ---: |')
+    slowest = None
+    for name, raw_data in CASES:
+        rate = args.number / timeit(lambda: validate(raw_data), number=args.number)
+        unshared_rate = args.number / timeit(lambda: validate_unshared(raw_data),
+                                             number=args.number)
+        slowest = rate if slowest is None else min(slowest, rate)
+        print('| {0} | {1:.0f} | {2:.0f} | x{3:.2f} |'.format(name, rate, unshared_rate,
+                                                              rate / unshared_rate))
+    print('slowest: {0:.0f} requests/s, target {1:.0f}: {2}'.format(
+        slowest, args.target, 'ok' if slowest >= args.target else 'missed'))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,54 @@
 """
 Initializes the application and the routes.
 """
-from flask import Flask
+from time import perf_counter
 
-from .views import take_screenshot_view
+from flask import Flask, g, request
+
+from .admission import AdmissionError
+from .metrics import REQUEST_DURATION, REQUESTS
+from .views import (take_screenshot_view, take_screenshots_view, compare_view, create_job_view,
+                    job_view, job_result_view, prewarm_view, prewarm_entry_view,
+                    browser_pool_view, metrics_view, admission_error_view)
 
 
 app = Flask('Screamshot')
 
 
+@app.before_request
+def _start_timer():
+    g.start = perf_counter()
+
+
+@app.after_request
+def _count_request(response):
+    endpoint = request.endpoint or 'unknown'
+    REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    REQUEST_DURATION.observe(perf_counter() - g.start, endpoint=endpoint)
+    return response
+
+
+app.register_error_handler(AdmissionError, admission_error_view)
+
+
 # Routes
 app.add_url_rule('/api/take-screenshot',
                  'take_screenshot', view_func=take_screenshot_view, methods=['GET', 'POST'])
+app.add_url_rule('/api/take-screenshots',
+                 'take_screenshots', view_func=take_screenshots_view, methods=['POST'])
+app.add_url_rule('/api/compare',
+                 'compare', view_func=compare_view, methods=['POST'])
+app.add_url_rule('/api/jobs',
+                 'create_job', view_func=create_job_view, methods=['POST'])
+app.add_url_rule('/api/jobs/<job_id>',
+                 'job', view_func=job_view, methods=['GET'])
+app.add_url_rule('/api/jobs/<job_id>/result',
+                 'job_result', view_func=job_result_view, methods=['GET'])
+app.add_url_rule('/api/prewarm',
+                 'prewarm', view_func=prewarm_view, methods=['GET', 'POST'])
+app.add_url_rule('/api/prewarm/<key>',
+                 'prewarm_entry', view_func=prewarm_entry_view, methods=['DELETE'])
+app.add_url_rule('/api/browser-pool',
+                 'browser_pool', view_func=browser_pool_view, methods=['GET'])
+app.add_url_rule('/metrics',
+                 'metrics', view_func=metrics_view, methods=['GET'])
@@ -0,0 +1,354 @@
+"""
+Contains the admission control: per-client rate limits, a cap on the number of screenshots taken
+at the same time with a bounded queue, and a memory threshold above which no new screenshot is
+started.
+
+.. warning:: The limits are kept per worker process
+"""
+from asyncio import Semaphore as AsyncSemaphore, TimeoutError as AsyncTimeoutError, wait_for
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from math import ceil
+from os import getpid, listdir, sysconf
+from threading import Lock, Semaphore
+from time import monotonic
+
+from . import settings
+from .metrics import ADMISSION_QUEUED, ADMISSION_REJECTED, RENDERS_QUEUED
+
+
+PAGE_SIZE = sysconf('SC_PAGE_SIZE')
+
+
+class AdmissionError(Exception):
+    """
+    Raised when a request is refused by the admission control
+
+    :attributes:
+    * status_code (**int**): ``429`` when the client is over its rate limit, ``503`` when the \
+        server is overloaded
+    * retry_after (**int**): the number of seconds after which the client should retry
+    """
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class TokenBucket():
+    """
+    A bucket of ``burst`` tokens refilled at ``rate`` tokens per second.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = monotonic()
+
+    def take(self, now=None):
+        """
+        Takes a token
+
+        :return: ``0`` if a token was taken, otherwise the number of seconds before one is \
+            available
+        :retype: float
+        """
+        now = monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter():
+    """
+    Rate limits the clients with a token bucket each.
+
+    :param rate: the number of requests per second allowed to each client
+    :type rate: float
+
+    :param burst: the number of requests a client can send at once
+    :type burst: int
+
+    :param max_clients: the number of buckets kept, the least recently seen clients are \
+        forgotten first
+    :type max_clients: int
+    """
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def check(self, client):
+        """
+        Takes a token from the bucket of ``client``
+
+        .. warning:: Raises ``AdmissionError`` with a 429 status code if the bucket is empty
+        """
+        with self._lock:
+            bucket = self._buckets.pop(client, None)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+            self._buckets[client] = bucket
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            wait = bucket.take()
+        if wait:
+            ADMISSION_REJECTED.inc(reason='rate_limit')
+            raise AdmissionError('Too many requests', 429, max(1, ceil(wait)))
+
+
+def client_key(api_key, address):
+    """
+    :return: the key of a client for the rate limit: its API key when it is one of ``API_KEYS``, \
+        its IP address otherwise, so that a client cannot escape its limit by changing its key
+    :retype: str
+    """
+    if api_key and api_key in settings.API_KEYS:
+        return api_key
+    return address
+
+
+def _children(pid):
+    # The children of the other threads (the browsers are launched from the event loop thread)
+    # are not listed by /proc/<pid>/task/<pid>/children, the tree is walked by parent pid
+    children = {}
+    try:
+        names = listdir('/proc')
+    except OSError as _:
+        return []
+    for name in names:
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/{0}/stat'.format(name)) as stat_file:
+                ppid = int(stat_file.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError) as _:
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    descendants, stack = [], list(children.get(pid, []))
+    while stack:
+        child = stack.pop()
+        descendants.append(child)
+        stack.extend(children.get(child, []))
+    return descendants
+
+
+def process_tree_rss(pid=None):
+    """
+    :return: the resident memory in bytes of the process and its children, the browsers \
+        included, or ``None`` if ``/proc`` is not available
+    :retype: int
+    """
+    pid = pid if pid else getpid()
+    total = None
+    for process in [pid] + _children(pid):
+        try:
+            with open('/proc/{0}/statm'.format(process)) as statm_file:
+                total = (total or 0) + int(statm_file.read().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError) as _:
+            pass
+    return total
+
+
+class RenderGate():
+    """
+    Caps the number of screenshots taken at the same time.
+
+    :param max_renders: the number of screenshots taken at the same time
+    :type max_renders: int
+
+    :param max_queued: the number of screenshots waiting for a slot, the next ones are refused
+    :type max_queued: int
+
+    :param queue_timeout: the maximum number of seconds a screenshot waits for a slot
+    :type queue_timeout: float
+
+    :param max_rss: optional, the resident memory in bytes of the worker and its browsers above \
+        which no new screenshot is started
+    :type max_rss: int
+
+    :param rss_interval: the number of seconds the memory measure is reused
+    :type rss_interval: float
+    """
+    def __init__(self, max_renders, max_queued, queue_timeout=30, max_rss=None, rss_interval=1):
+        self.max_renders = max_renders
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.max_rss = max_rss
+        self.rss_interval = rss_interval
+        self.queued = 0
+        self._semaphore = Semaphore(max_renders)
+        self._lock = Lock()
+        self._durations = []
+        self._rss = None
+        self._rss_measured_at = None
+
+    def retry_after(self):
+        """
+        :return: an estimation of the number of seconds before the queue is drained
+        :retype: int
+        """
+        durations = self._durations[-20:]
+        mean_duration = sum(durations) / len(durations) if durations else 1
+        return max(1, ceil(mean_duration * (self.queued + 1) / self.max_renders))
+
+    def rss(self):
+        """
+        :return: the resident memory of the worker and its browsers, measured at most every \
+            ``rss_interval`` seconds
+        :retype: int
+        """
+        now = monotonic()
+        if self._rss_measured_at is None or now - self._rss_measured_at >= self.rss_interval:
+            self._rss = process_tree_rss()
+            self._rss_measured_at = now
+        return self._rss
+
+    def _check_memory(self):
+        if self.max_rss:
+            rss = self.rss()
+            if rss is not None and rss > self.max_rss:
+                ADMISSION_REJECTED.inc(reason='memory')
+                raise AdmissionError('Server is low on memory', 503, self.retry_after())
+
+    def _wait(self):
+        with self._lock:
+            if self.queued >= self.max_queued:
+                ADMISSION_REJECTED.inc(reason='queue_full')
+                raise AdmissionError('Too many pending screenshots', 503, self.retry_after())
+            self.queued += 1
+        ADMISSION_QUEUED.inc()
+        try:
+            with RENDERS_QUEUED.track():
+                acquired = self._semaphore.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self.queued -= 1
+        if not acquired:
+            ADMISSION_REJECTED.inc(reason='queue_timeout')
+            raise AdmissionError('Too many pending screenshots', 503, self.retry_after())
+
+    @contextmanager
+    def slot(self):
+        """
+        Waits for a free slot while the context is running
+
+        .. warning:: Raises ``AdmissionError`` with a 503 status code if the memory is above \
+            ``max_rss``, if the queue is full or if no slot frees up in ``queue_timeout`` seconds
+        """
+        self._check_memory()
+        if not self._semaphore.acquire(blocking=False):
+            self._wait()
+        started_at = monotonic()
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+            self._durations = self._durations[-19:] + [monotonic() - started_at]
+
+
+class AsyncRenderGate(RenderGate):
+    """
+    Caps the number of screenshots taken at the same time in an event loop, the screenshots \
+        wait for a slot without blocking the loop.
+
+    It takes the parameters of ``RenderGate``.
+
+    .. warning:: The gate is bound to the event loop it is first used in
+    """
+    def __init__(self, max_renders, max_queued, queue_timeout=30, max_rss=None, rss_interval=1):
+        super().__init__(max_renders, max_queued, queue_timeout=queue_timeout, max_rss=max_rss,
+                         rss_interval=rss_interval)
+        self._semaphore = None
+
+    def _get_semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = AsyncSemaphore(self.max_renders)
+        return self._semaphore
+
+    async def _wait(self):  # pylint: disable=invalid-overridden-method
+        if self.queued >= self.max_queued:
+            ADMISSION_REJECTED.inc(reason='queue_full')
+            raise AdmissionError('Too many pending screenshots', 503, self.retry_after())
+        self.queued += 1
+        ADMISSION_QUEUED.inc()
+        try:
+            with RENDERS_QUEUED.track():
+                await wait_for(self._get_semaphore().acquire(), self.queue_timeout)
+        except AsyncTimeoutError:
+            ADMISSION_REJECTED.inc(reason='queue_timeout')
+            raise AdmissionError('Too many pending screenshots', 503,
+                                 self.retry_after()) from None
+        finally:
+            self.queued -= 1
+
+    @asynccontextmanager
+    async def slot(self):  # pylint: disable=invalid-overridden-method
+        """
+        Waits for a free slot while the context is running
+
+        .. warning:: Raises ``AdmissionError`` like ``RenderGate.slot``
+        """
+        self._check_memory()
+        semaphore = self._get_semaphore()
+        if semaphore.locked():
+            await self._wait()
+        else:
+            await semaphore.acquire()
+        started_at = monotonic()
+        try:
+            yield
+        finally:
+            semaphore.release()
+            self._durations = self._durations[-19:] + [monotonic() - started_at]
+
+
+_RATE_LIMITER = None
+_RENDER_GATE = None
+_ADMISSION_LOCK = Lock()
+
+
+def get_rate_limiter():
+    """
+    :return: the rate limiter of the current worker, built from the settings on first call, or \
+        ``None`` if ``RATE_LIMIT`` is ``0``
+    :retype: RateLimiter
+    """
+    global _RATE_LIMITER  # pylint: disable=global-statement
+    with _ADMISSION_LOCK:
+        if _RATE_LIMITER is None and settings.RATE_LIMIT > 0:
+            _RATE_LIMITER = RateLimiter(settings.RATE_LIMIT, settings.RATE_LIMIT_BURST)
+    return _RATE_LIMITER
+
+
+def get_render_gate():
+    """
+    :return: the render gate of the current worker, built from the settings on first call, or \
+        ``None`` if ``MAX_RENDERS`` is ``0``
+    :retype: RenderGate
+    """
+    global _RENDER_GATE  # pylint: disable=global-statement
+    with _ADMISSION_LOCK:
+        if _RENDER_GATE is None and settings.MAX_RENDERS > 0:
+            _RENDER_GATE = RenderGate(settings.MAX_RENDERS, settings.MAX_QUEUED_RENDERS,
+                                      queue_timeout=settings.RENDER_QUEUE_TIMEOUT,
+                                      max_rss=settings.MAX_RSS)
+    return _RENDER_GATE
+
+
+@contextmanager
+def render_slot():
+    """
+    Runs the context in a slot of the render gate of the worker, if there is one
+    """
+    gate = get_render_gate()
+    if gate is None:
+        yield
+        return
+    with gate.slot():
+        yield
@@ -0,0 +1,103 @@
+"""
+Contains the helpers that build archives of screenshots.
+"""
+from base64 import b64encode
+from io import BytesIO
+from json import dumps, loads
+from time import localtime
+from zipfile import ZIP_STORED, ZipFile, ZipInfo
+
+from . import settings
+from .streaming import SpooledBody
+
+
+class _StreamBuffer():
+    """
+    Write-only file object, it cannot seek so ``ZipFile`` writes the archive sequentially.
+    """
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries):
+    """
+    This generator builds a zip archive and yields it chunk by chunk, as soon as each entry is \
+        written
+
+    :param entries: mandatory, the ``(name, bytes)`` entries of the archive, the data can also \
+        be a ``SpooledBody``, written by chunks
+    :type entries: iterable
+
+    .. info:: The entries are stored without compression, png images are already compressed
+    """
+    buffer = _StreamBuffer()
+    with ZipFile(buffer, 'w', ZIP_STORED) as archive:
+        for name, data in entries:
+            if isinstance(data, SpooledBody):
+                info = ZipInfo(name, date_time=localtime()[:6])
+                info.file_size = len(data)
+                with archive.open(info, 'w') as entry_file:
+                    for chunk in data.chunks(settings.STREAM_CHUNK_SIZE):
+                        entry_file.write(chunk)
+                        yield buffer.pop()
+            else:
+                archive.writestr(name, data)
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def _archive_entries(archive):
+    names = archive.namelist()
+    if 'manifest.json' in names:
+        entries = loads(archive.read('manifest.json').decode('utf-8'))
+    else:
+        entries = [{'file': name} for name in names]
+    for entry in entries:
+        if entry.get('file'):
+            entry['image'] = b64encode(archive.read(entry['file'])).decode('ascii')
+        yield entry
+
+
+def archive_to_json(bytes_obj):
+    """
+    This function converts an archive of screenshots into a json-serializable list
+
+    :param bytes_obj: mandatory, the zip archive
+    :type bytes_obj: bytes
+
+    :return: the entries of the ``manifest.json`` file of the archive, or a ``{'file': ...}`` \
+        entry per file without manifest, each with the base64 encoded ``image`` of its file
+    :retype: list(dict)
+    """
+    with ZipFile(BytesIO(bytes_obj)) as archive:
+        return list(_archive_entries(archive))
+
+
+def iter_archive_json(bytes_obj):
+    """
+    This generator yields the json list of ``archive_to_json`` chunk by chunk, one entry at a \
+        time, so only one base64 encoded image is held in memory
+    """
+    with ZipFile(BytesIO(bytes_obj)) as archive:
+        separator = b'['
+        for entry in _archive_entries(archive):
+            yield separator + dumps(entry).encode('utf-8')
+            separator = b', '
+        yield b'[]' if separator == b'[' else b']'
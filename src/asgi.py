@@ -0,0 +1,295 @@
+"""
+Initializes the ASGI application.
+
+It serves ``/api/take-screenshot`` with the same parameters as the WSGI application, but the
+screenshots are awaited in the event loop of the server, so many of them share one loop and one
+browser pool per worker:
+
+>>> gunicorn -k uvicorn.workers.UvicornWorker src.asgi:application
+"""
+from asyncio import FIRST_COMPLETED, CancelledError, TimeoutError as AsyncTimeoutError, \
+    current_task, ensure_future, get_event_loop, run_coroutine_threadsafe, wait, wait_for
+from contextlib import asynccontextmanager
+from functools import partial
+from io import BytesIO
+from json import dumps
+from time import perf_counter
+from urllib.parse import parse_qsl
+
+from werkzeug.formparser import parse_form_data
+
+from screamshot.errors import BadUrl, BadSelector
+
+from . import settings
+from .admission import AdmissionError, AsyncRenderGate, client_key, get_rate_limiter
+from .browser_pool import BrowserPool
+from .coalescing import get_coalescer
+from .metrics import ERRORS, RENDERS_IN_FLIGHT, REQUEST_DURATION, REQUESTS, time_stage
+from .prewarm import get_prewarmer
+from .serializers import ScreenshotSerializer, collapse_values
+from .streaming import SpooledBody
+
+
+class ScreenshotApplication():
+    """
+    ASGI application taking the screenshots in a browser pool bound to the server event loop.
+
+    :param render_timeout: the maximum number of seconds of a screenshot
+    :type render_timeout: float
+
+    .. info:: The screenshot is cancelled when all the clients waiting for it disconnect
+    .. info:: The requests go through the rate limiter, the coalescer, the prewarmer and the \
+        request metrics and the screenshots through a render gate of the worker, like in the \
+        WSGI application
+    """
+    def __init__(self, render_timeout=30):
+        self.render_timeout = render_timeout
+        self.browser_pool = None
+        self.render_gate = None
+        self._clients = {}
+        self._render_tasks = {}
+
+    def get_browser_pool(self):
+        """
+        :return: the browser pool of the worker, built from the settings on first call
+        :retype: BrowserPool
+        """
+        if self.browser_pool is None:
+            self.browser_pool = BrowserPool(
+                size=settings.BROWSER_POOL_SIZE,
+                max_pages=settings.BROWSER_MAX_PAGES,
+                max_age=settings.BROWSER_MAX_AGE,
+                launch_args=settings.BROWSER_LAUNCH_ARGS,
+                health_check_timeout=settings.BROWSER_HEALTH_CHECK_TIMEOUT,
+                cache_dir=settings.RESOURCE_CACHE_DIR,
+                cache_size=settings.RESOURCE_CACHE_SIZE,
+                session_idle_timeout=settings.SESSION_IDLE_TIMEOUT,
+                max_sessions=settings.MAX_SESSIONS)
+        return self.browser_pool
+
+    def get_render_gate(self):
+        """
+        :return: the render gate of the worker, built from the settings on first call, or \
+            ``None`` if ``MAX_RENDERS`` is ``0``
+        :retype: AsyncRenderGate
+        """
+        if self.render_gate is None and settings.MAX_RENDERS > 0:
+            self.render_gate = AsyncRenderGate(
+                settings.MAX_RENDERS, settings.MAX_QUEUED_RENDERS,
+                queue_timeout=settings.RENDER_QUEUE_TIMEOUT, max_rss=settings.MAX_RSS)
+        return self.render_gate
+
+    @asynccontextmanager
+    async def _render_slot(self):
+        gate = self.get_render_gate()
+        if gate is None:
+            yield
+            return
+        async with gate.slot():
+            yield
+
+    async def _render(self, url, **kwargs):
+        async with self._render_slot():
+            with RENDERS_IN_FLIGHT.track():
+                return await wait_for(self.get_browser_pool().render(url, **kwargs),
+                                      self.render_timeout)
+
+    async def _tracked_render(self, key, url, kwargs):
+        if key not in self._clients:
+            raise CancelledError()
+        tasks = self._render_tasks.setdefault(key, set())
+        task = current_task()
+        tasks.add(task)
+        try:
+            return await self._render(url, **kwargs)
+        finally:
+            tasks.discard(task)
+            if not tasks:
+                del self._render_tasks[key]
+
+    async def _coalesced_render(self, serializer):
+        loop = get_event_loop()
+        key = serializer.cache_key()
+
+        def render():
+            return run_coroutine_threadsafe(
+                self._tracked_render(key, serializer.url, serializer.render_kwargs()),
+                loop).result()
+        # The coalescer waits in a thread of the executor, the screenshot is taken in the loop
+        return await loop.run_in_executor(None, partial(
+            get_coalescer().do, key, render,
+            fresh=serializer.options.get('cache') in ('bypass', 'refresh')))
+
+    def _leave(self, key):
+        self._clients[key] -= 1
+        if self._clients[key] == 0:
+            del self._clients[key]
+            for task in self._render_tasks.get(key, ()):
+                task.cancel()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.browser_pool is not None:
+                    await self.browser_pool.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _send(send, status, body, content_type, headers=None):
+        raw_headers = [(b'content-type', content_type.encode('latin-1')),
+                       (b'content-length', str(len(body)).encode('latin-1'))]
+        for name, value in (headers or {}).items():
+            raw_headers.append((name.lower().encode('latin-1'), value.encode('latin-1')))
+        await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+        if not isinstance(body, SpooledBody):
+            await send({'type': 'http.response.body', 'body': body})
+            return
+        chunks = body.chunks(settings.STREAM_CHUNK_SIZE)
+        try:
+            for chunk in chunks:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            chunks.close()
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _send_errors(self, send, status, errors, headers=None):
+        await self._send(send, status, dumps({'errors': errors}).encode('utf-8'),
+                         'application/json', headers)
+
+    @staticmethod
+    def _header(scope, name):
+        for header_name, value in scope.get('headers', []):
+            if header_name.lower() == name:
+                return value.decode('latin-1')
+        return None
+
+    @staticmethod
+    async def _read_body(receive):
+        body = b''
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                return body
+
+    @staticmethod
+    def _parse_form(content_type, body):
+        environ = {'REQUEST_METHOD': 'POST', 'wsgi.input': BytesIO(body),
+                   'CONTENT_TYPE': content_type or 'application/x-www-form-urlencoded',
+                   'CONTENT_LENGTH': str(len(body))}
+        _, form, files = parse_form_data(environ)
+        for uploaded_file in files.values():
+            uploaded_file.close()
+        return collapse_values(form.to_dict(flat=False))
+
+    async def _http(self, scope, receive, send):
+        start = perf_counter()
+        statuses = []
+
+        async def counted_send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+            await send(message)
+        try:
+            await self._take_screenshot(scope, receive, counted_send)
+        finally:
+            if statuses:
+                endpoint = ('take_screenshot' if scope['path'] == '/api/take-screenshot'
+                            else 'unknown')
+                REQUESTS.inc(endpoint=endpoint, method=scope['method'], status=statuses[0])
+                REQUEST_DURATION.observe(perf_counter() - start, endpoint=endpoint)
+
+    async def _take_screenshot(self, scope, receive, send):
+        if scope['path'] != '/api/take-screenshot':
+            await self._send_errors(send, 404, ['Not found'])
+            return
+        if scope['method'] not in ('GET', 'POST'):
+            await self._send_errors(send, 405, ['Method not allowed'])
+            return
+        args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        body = await self._read_body(receive)
+        if body is None:
+            return
+        rate_limiter = get_rate_limiter()
+        if rate_limiter is not None:
+            client = scope.get('client')
+            try:
+                rate_limiter.check(client_key(
+                    self._header(scope, settings.API_KEY_HEADER.lower().encode('latin-1')),
+                    client[0] if client else None))
+            except AdmissionError as exc:
+                await self._send_errors(send, exc.status_code, [str(exc)],
+                                        {'Retry-After': str(exc.retry_after)})
+                return
+        url = args.get('url')
+        if not url:
+            await self._send_errors(send, 400, ['No url'])
+            return
+        loop = get_event_loop()
+        raw_data = None
+        if scope['method'] == 'POST':
+            raw_data = await loop.run_in_executor(
+                None, self._parse_form, self._header(scope, b'content-type'), body)
+        serializer = ScreenshotSerializer(url, raw_data=raw_data)
+        if not serializer.is_valid():
+            await self._send_errors(send, 400, serializer.errors)
+            return
+
+        if await loop.run_in_executor(None, serializer.get_cached_object) is None:
+            key = serializer.cache_key()
+            self._clients[key] = self._clients.get(key, 0) + 1
+            try:
+                with time_stage(serializer.timings, 'render'):
+                    render = ensure_future(self._coalesced_render(serializer))
+                    disconnect = ensure_future(receive())
+                    await wait([render, disconnect], return_when=FIRST_COMPLETED)
+            finally:
+                self._leave(key)
+            if not render.done():
+                render.cancel()
+                return
+            disconnect.cancel()
+            try:
+                bytes_img, coalesced = render.result()
+                await loop.run_in_executor(
+                    None, partial(serializer.set_object, bytes_img, coalesced=coalesced))
+            except (BadUrl, BadSelector) as exc:
+                ERRORS.inc(type=exc.__class__.__name__)
+                await self._send_errors(send, 400, [str(exc)])
+                return
+            except AdmissionError as exc:
+                await self._send_errors(send, exc.status_code, [str(exc)],
+                                        {'Retry-After': str(exc.retry_after)})
+                return
+            except AsyncTimeoutError:
+                await self._send_errors(send, 504, ['Timeout'])
+                return
+
+        output, mimetype = await loop.run_in_executor(
+            None, serializer.get_output, serializer.bytes_img)
+        headers, not_modified = await loop.run_in_executor(
+            None, serializer.conditional_headers, output, mimetype,
+            self._header(scope, b'if-none-match'))
+        headers.update(serializer.response_headers())
+        if not_modified:
+            if isinstance(output, SpooledBody):
+                output.close()
+            await self._send(send, 304, b'', mimetype, headers)
+        else:
+            await self._send(send, 200, output, mimetype, headers)
+        get_prewarmer().record(serializer)
+
+
+application = ScreenshotApplication(render_timeout=settings.RENDER_TIMEOUT)
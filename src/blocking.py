@@ -0,0 +1,165 @@
+"""
+Contains the resource blocking: the requests of a page that do not change the screenshot (trackers,
+ads, video, fonts...) are aborted by type or by domain, following a named profile or custom lists.
+"""
+from re import compile as compile_regex
+from threading import Lock
+from urllib.parse import urlsplit
+
+from .metrics import BLOCKED_REQUESTS
+
+
+# The resource types of the browser, the documents cannot be blocked
+AUTHORIZED_RESOURCE_TYPES = ['stylesheet', 'image', 'media', 'font', 'script', 'texttrack', 'xhr',
+                             'fetch', 'eventsource', 'websocket', 'manifest', 'other']
+DOMAIN_PATTERN_REGEX = compile_regex(r'^(\*\.)?[A-Za-z0-9-]+(\.[A-Za-z0-9-]+)*$')
+TRACKER_DOMAINS = [
+    'adnxs.com', 'adsrvr.org', 'amazon-adsystem.com', 'criteo.com', 'criteo.net',
+    'doubleclick.net', 'facebook.net', 'google-analytics.com', 'googleadservices.com',
+    'googlesyndication.com', 'googletagmanager.com', 'googletagservices.com', 'hotjar.com',
+    'mixpanel.com', 'nr-data.net', 'outbrain.com', 'quantserve.com', 'scorecardresearch.com',
+    'segment.io', 'taboola.com']
+BLOCK_PROFILES = {
+    'none': {},
+    'fast': {'types': ['eventsource', 'font', 'manifest', 'media', 'texttrack', 'websocket'],
+             'deny': TRACKER_DOMAINS},
+    'no-media': {'types': ['image', 'media']},
+    'first-party-only': {'first_party_only': True},
+}
+
+
+def normalize_domain(pattern):
+    """
+    :return: the domain of a ``example.com`` or ``*.example.com`` pattern, in lower case
+    :retype: str
+    """
+    pattern = pattern.lower()
+    return pattern[2:] if pattern.startswith('*.') else pattern
+
+
+def _matches(host, domains):
+    return any(host == domain or host.endswith('.' + domain) for domain in domains)
+
+
+def _site(host):
+    return '.'.join(host.split('.')[-2:])
+
+
+class BlockingRules():
+    """
+    Decides which requests of a page are blocked.
+
+    :param url: the url of the page, its host is the first party
+    :type url: str
+
+    :param types: the blocked resource types
+    :type types: list(str)
+
+    :param deny: the blocked domains, their subdomains included
+    :type deny: list(str)
+
+    :param allow: the domains never blocked, their subdomains included
+    :type allow: list(str)
+
+    :param first_party_only: ``True`` to block the domains of another site than the page
+    :type first_party_only: bool
+
+    .. info:: The site of a host is its last two labels, so ``cdn.example.com`` is a first party \
+        of ``www.example.com``
+    """
+    def __init__(self, url, types=None, deny=None, allow=None, first_party_only=False):
+        self.site = _site(urlsplit(url).hostname or '')
+        self.types = frozenset(types or [])
+        self.deny = list(deny or [])
+        self.allow = list(allow or [])
+        self.first_party_only = first_party_only
+
+    def blocks(self, url, resource_type):
+        """
+        :return: ``True`` if the request of ``url`` is blocked
+        :retype: bool
+        """
+        host = urlsplit(url).hostname
+        if host is None:
+            # data: and blob: urls are not loaded from the network
+            return False
+        host = host.lower()
+        if _matches(host, self.allow):
+            return False
+        if resource_type in self.types or _matches(host, self.deny):
+            return True
+        return self.first_party_only and _site(host) != self.site
+
+
+class RequestTimings():
+    """
+    Keeps the moving average of the duration of the requests of each resource type, used to \
+        estimate the time saved by a blocked request.
+
+    :param weight: the weight of a new duration in the averages
+    :type weight: float
+    """
+    def __init__(self, weight=0.1):
+        self.weight = weight
+        self._means = {}
+        self._lock = Lock()
+
+    def add(self, resource_type, duration):
+        """
+        Adds the duration in seconds of a finished request
+        """
+        with self._lock:
+            for key in (resource_type, None):
+                mean = self._means.get(key)
+                self._means[key] = duration if mean is None else \
+                    mean + self.weight * (duration - mean)
+
+    def mean(self, resource_type):
+        """
+        :return: the average duration of the requests of ``resource_type``, of all the requests \
+            if none of this type finished yet, ``0`` if none finished
+        :retype: float
+        """
+        with self._lock:
+            mean = self._means.get(resource_type)
+            return mean if mean is not None else self._means.get(None, 0)
+
+
+REQUEST_TIMINGS = RequestTimings()
+
+
+class BlockingStats():
+    """
+    Counts the requests blocked while a screenshot is taken.
+
+    :attributes:
+    * blocked (**dict**): the number of blocked requests by resource type
+    * time_saved (**float**): the estimated number of seconds saved, the sum of the average \
+        durations of the blocked requests
+    """
+    def __init__(self):
+        self.blocked = {}
+        self.time_saved = 0
+
+    def add(self, resource_type):
+        """
+        Counts a blocked request
+        """
+        self.blocked[resource_type] = self.blocked.get(resource_type, 0) + 1
+        self.time_saved += REQUEST_TIMINGS.mean(resource_type)
+        BLOCKED_REQUESTS.inc(type=resource_type)
+
+    def headers(self):
+        """
+        :return: the ``X-Blocked-Requests`` header, the total and the count by resource type, \
+            and the ``X-Blocked-Time-Saved`` header in seconds, or nothing if no request was \
+            blocked
+        :retype: dict
+        """
+        if not self.blocked:
+            return {}
+        counts = ['total={0}'.format(sum(self.blocked.values()))] + [
+            '{0}={1}'.format(resource_type, count)
+            for resource_type, count in sorted(self.blocked.items())]
+        return {'X-Blocked-Requests': ', '.join(counts),
+                'X-Blocked-Time-Saved': '{0:.3f}'.format(self.time_saved)}
@@ -0,0 +1,383 @@
+"""
+Contains the pool of warm browsers used to take the screenshots.
+
+Launching a headless browser costs far more than opening a tab, so each worker process keeps a
+few browsers alive and every request only opens a tab in one of them.
+"""
+from asyncio import Condition, new_event_loop, run_coroutine_threadsafe, set_event_loop, wait_for
+from atexit import register
+from errno import EACCES, EAGAIN
+from fcntl import LOCK_EX, LOCK_NB, flock
+from os import makedirs
+from os.path import join
+from threading import Lock, Thread
+from time import monotonic
+
+from pyppeteer import launch
+
+from screamshot import generate_bytes_img_wrap
+from screamshot.errors import ScreamshotException
+
+from . import settings
+from .renderer import (RENDERER_PARAMETERS, STATS_PARAMETERS, ResourceCacheStats,
+                       render_screenshot)
+from .sessions import SessionStore
+
+
+class _PooledBrowser():
+    def __init__(self, browser, slot=None):
+        self.browser = browser
+        self.slot = slot
+        self.launched_at = monotonic()
+        self.pages = 0
+        self.contexts = {}
+
+
+class BrowserPool():
+    """
+    Pool of warm headless browsers.
+
+    :param size: the maximum number of browsers
+    :type size: int
+
+    :param max_pages: a browser is recycled after taking this number of screenshots
+    :type max_pages: int
+
+    :param max_age: a browser is recycled after this number of seconds
+    :type max_age: float
+
+    :param launch_args: optional, the command line arguments given to the browsers
+    :type launch_args: list(str)
+
+    :param health_check_timeout: an idle browser that does not answer within this number of \
+        seconds is replaced
+    :type health_check_timeout: float
+
+    :param cache_dir: optional, the directory of the disk caches of the browsers, each browser \
+        uses the ``slot-<index>`` subdirectory of a slot locked for its lifetime, so the caches \
+        outlive the browsers and the workers of the host never share one
+    :type cache_dir: str
+
+    :param cache_size: optional, the maximum size in bytes of the disk cache of each browser
+    :type cache_size: int
+
+    :param session_idle_timeout: the incognito context of a set of credentials is closed after \
+        this number of seconds without screenshot, ``0`` renders each screenshot with \
+        credentials in a new tab of the default context
+    :type session_idle_timeout: float
+
+    :param max_sessions: the maximum number of sets of credentials kept warm
+    :type max_sessions: int
+
+    .. warning:: The pool is bound to the event loop it is first used in
+    """
+    def __init__(self, size=2, max_pages=100, max_age=600, launch_args=None,
+                 health_check_timeout=5, cache_dir=None, cache_size=None, session_idle_timeout=300,
+                 max_sessions=32):
+        self.size = size
+        self.max_pages = max_pages
+        self.max_age = max_age
+        self.launch_args = launch_args if launch_args else []
+        self.health_check_timeout = health_check_timeout
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.launch_count = 0
+        self.recycle_count = 0
+        self.failure_count = 0
+        self.resource_cache_hits = 0
+        self.resource_cache_misses = 0
+        self.session_count = 0
+        self.session_reuse_count = 0
+        self.sessions = SessionStore(session_idle_timeout, max_sessions) \
+            if session_idle_timeout > 0 else None
+        self._idle = []
+        self._slots = {}
+        self._busy = 0
+        self._condition = None
+
+    def _get_condition(self):
+        if self._condition is None:
+            self._condition = Condition()
+        return self._condition
+
+    def _take_slot(self):
+        if not self.cache_dir:
+            return None
+        makedirs(self.cache_dir, exist_ok=True)
+        slot = 0
+        while True:
+            if slot not in self._slots:
+                lock_file = open(join(self.cache_dir, 'slot-{0}.lock'.format(slot)), 'a+b')
+                try:
+                    flock(lock_file, LOCK_EX | LOCK_NB)
+                except OSError as exc:
+                    lock_file.close()
+                    if exc.errno not in (EAGAIN, EACCES):
+                        raise
+                else:
+                    self._slots[slot] = lock_file
+                    return slot
+            slot += 1
+
+    def _release_slot(self, slot):
+        lock_file = self._slots.pop(slot, None)
+        if lock_file is not None:
+            lock_file.close()
+
+    async def _launch(self):
+        slot = self._take_slot()
+        args = list(self.launch_args)
+        if slot is not None:
+            args.append('--disk-cache-dir={0}'.format(
+                join(self.cache_dir, 'slot-{0}'.format(slot))))
+            if self.cache_size:
+                args.append('--disk-cache-size={0}'.format(self.cache_size))
+        try:
+            browser = await launch(headless=True, args=args, handleSIGINT=False,
+                                   handleSIGTERM=False, handleSIGHUP=False)
+        except BaseException:
+            self._release_slot(slot)
+            raise
+        self.launch_count += 1
+        return _PooledBrowser(browser, slot)
+
+    async def _close(self, pooled):
+        try:
+            await pooled.browser.close()
+        except Exception as _:  # pylint: disable=broad-except
+            pass
+        self._release_slot(pooled.slot)
+
+    async def _get_context(self, pooled, session):
+        context = pooled.contexts.get(session.key)
+        if context is None:
+            context = await pooled.browser.createIncognitoBrowserContext()
+            pooled.contexts[session.key] = context
+            self.session_count += 1
+        else:
+            self.session_reuse_count += 1
+        return context
+
+    async def _close_expired_contexts(self, pooled):
+        expired = [key for key in pooled.contexts if not self.sessions.is_alive(key)]
+        for key in expired:
+            try:
+                await pooled.contexts.pop(key).close()
+            except Exception as _:  # pylint: disable=broad-except
+                pass
+
+    def _is_expired(self, pooled):
+        return (pooled.pages >= self.max_pages
+                or monotonic() - pooled.launched_at >= self.max_age)
+
+    async def _is_healthy(self, pooled):
+        process = pooled.browser.process
+        if process is not None and process.poll() is not None:
+            return False
+        try:
+            await wait_for(pooled.browser.version(), self.health_check_timeout)
+        except Exception as _:  # pylint: disable=broad-except
+            return False
+        return True
+
+    async def _acquire(self):
+        condition = self._get_condition()
+        async with condition:
+            while not self._idle and self._busy >= self.size:
+                await condition.wait()
+            pooled = self._idle.pop() if self._idle else None
+            self._busy += 1
+        try:
+            if pooled is not None and self._is_expired(pooled):
+                self.recycle_count += 1
+                await self._close(pooled)
+                pooled = None
+            elif pooled is not None and not await self._is_healthy(pooled):
+                self.failure_count += 1
+                await self._close(pooled)
+                pooled = None
+            if pooled is None:
+                pooled = await self._launch()
+        except BaseException:
+            await self._release(None)
+            raise
+        return pooled
+
+    async def _release(self, pooled):
+        condition = self._get_condition()
+        async with condition:
+            self._busy -= 1
+            if pooled is not None:
+                self._idle.append(pooled)
+            condition.notify()
+
+    async def render(self, url, resource_stats=None, credentials=None, **kwargs):
+        """
+        This coroutine takes a screenshot in a tab of one of the pooled browsers
+
+        It accepts the same parameters as ``render_screenshot``.
+
+        :return: the screenshot as a png image
+        :retype: bytes
+
+        .. info:: It waits for a browser when all of them are busy
+        .. info:: A browser is replaced when it has expired, when it does not answer or when \
+            the screenshot fails for another reason than ``BadUrl`` or ``BadSelector``
+        .. info:: The screenshots with ``credentials`` are taken in the incognito context of \
+            their session, opened in the browser on first use and closed once the session is idle
+        """
+        resource_stats = resource_stats if resource_stats is not None else ResourceCacheStats()
+        session = self.sessions.get(credentials) \
+            if credentials and self.sessions is not None else None
+        pooled = await self._acquire()
+        broken = False
+        try:
+            target = pooled.browser
+            if self.sessions is not None:
+                await self._close_expired_contexts(pooled)
+            if session is not None:
+                target = await self._get_context(pooled, session)
+            return await render_screenshot(target, url, credentials=credentials, session=session,
+                                           resource_stats=resource_stats, **kwargs)
+        except ScreamshotException:
+            raise
+        except Exception:
+            broken = True
+            raise
+        finally:
+            pooled.pages += 1
+            self.resource_cache_hits += resource_stats.hits
+            self.resource_cache_misses += resource_stats.misses
+            if broken:
+                self.failure_count += 1
+                await self._close(pooled)
+                pooled = None
+            elif self._is_expired(pooled):
+                self.recycle_count += 1
+                await self._close(pooled)
+                pooled = None
+            await self._release(pooled)
+
+    async def close(self):
+        """
+        This coroutine closes the idle browsers
+        """
+        condition = self._get_condition()
+        async with condition:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            await self._close(pooled)
+
+    def stats(self):
+        """
+        :return: the number of idle and busy browsers, the launch, recycle and failure counters, \
+            the number of responses of the pages served by the browser caches or not, and the \
+            number of session contexts opened and reused
+        :retype: dict
+        """
+        return {
+            'size': self.size,
+            'idle': len(self._idle),
+            'busy': self._busy,
+            'launch_count': self.launch_count,
+            'recycle_count': self.recycle_count,
+            'failure_count': self.failure_count,
+            'resource_cache_hits': self.resource_cache_hits,
+            'resource_cache_misses': self.resource_cache_misses,
+            'session_count': self.session_count,
+            'session_reuse_count': self.session_reuse_count,
+        }
+
+
+class EventLoopThread():
+    """
+    Runs an event loop in a daemon thread so that synchronous views can wait for coroutines.
+
+    .. info:: The thread is started on first use, after gunicorn has forked the worker
+    """
+    def __init__(self):
+        self._loop = None
+        self._lock = Lock()
+
+    @property
+    def started(self):
+        """
+        ``True`` once the event loop thread has been started
+        """
+        return self._loop is not None
+
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = new_event_loop()
+                Thread(target=self._run, name='screamshot-event-loop', daemon=True).start()
+        return self._loop
+
+    def _run(self):
+        set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def run(self, coroutine, timeout=None):
+        """
+        :return: the result of ``coroutine`` once it has run in the event loop thread
+        """
+        return run_coroutine_threadsafe(coroutine, self._get_loop()).result(timeout)
+
+
+_LOOP_THREAD = EventLoopThread()
+_BROWSER_POOL = None
+_BROWSER_POOL_LOCK = Lock()
+
+
+def get_browser_pool():
+    """
+    :return: the browser pool of the current worker, built from the settings on first call
+    :retype: BrowserPool
+    """
+    global _BROWSER_POOL  # pylint: disable=global-statement
+    with _BROWSER_POOL_LOCK:
+        if _BROWSER_POOL is None:
+            _BROWSER_POOL = BrowserPool(
+                size=settings.BROWSER_POOL_SIZE,
+                max_pages=settings.BROWSER_MAX_PAGES,
+                max_age=settings.BROWSER_MAX_AGE,
+                launch_args=settings.BROWSER_LAUNCH_ARGS,
+                health_check_timeout=settings.BROWSER_HEALTH_CHECK_TIMEOUT,
+                cache_dir=settings.RESOURCE_CACHE_DIR,
+                cache_size=settings.RESOURCE_CACHE_SIZE,
+                session_idle_timeout=settings.SESSION_IDLE_TIMEOUT,
+                max_sessions=settings.MAX_SESSIONS)
+    return _BROWSER_POOL
+
+
+async def _render_once(url, **kwargs):
+    browser = await launch(headless=True, args=settings.BROWSER_LAUNCH_ARGS, handleSIGINT=False,
+                           handleSIGTERM=False, handleSIGHUP=False)
+    try:
+        return await render_screenshot(browser, url, **kwargs)
+    finally:
+        await browser.close()
+
+
+def render_wrap(url, **kwargs):
+    """
+    This function takes a screenshot in the browser pool of the current worker and returns it \
+        as a ``bytes`` object in synchronous mode
+
+    It accepts the same parameters as ``render_screenshot``.
+
+    .. info:: When ``BROWSER_POOL_SIZE`` is ``0``, ``generate_bytes_img_wrap`` is called instead, \
+        or a browser is launched for the screenshot when a parameter it does not know is given
+    """
+    if settings.BROWSER_POOL_SIZE <= 0:
+        if any(kwargs.get(key) for key in RENDERER_PARAMETERS):
+            return _LOOP_THREAD.run(_render_once(url, **kwargs))
+        return generate_bytes_img_wrap(url, **{key: value for key, value in kwargs.items()
+                                               if key not in STATS_PARAMETERS})
+    return _LOOP_THREAD.run(get_browser_pool().render(url, **kwargs))
+
+
+@register
+def _close_browser_pool():
+    if _BROWSER_POOL is not None and _LOOP_THREAD.started:
+        _LOOP_THREAD.run(_BROWSER_POOL.close(), timeout=10)
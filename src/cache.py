@@ -0,0 +1,261 @@
+"""
+Contains the screenshot cache.
+
+Screenshots are stored under a hash of the url and of the validated parameters, in a bounded
+in-memory LRU tier and optionally in an on-disk tier shared by the workers of the host.
+"""
+from collections import OrderedDict
+from hashlib import sha256
+from json import dumps
+from os import listdir, makedirs, remove, replace, stat
+from os.path import join
+from struct import Struct
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from time import time
+
+from . import settings
+
+
+_EXPIRY = Struct('>d')
+
+
+def cache_key(url, data):
+    """
+    :return: the hash of ``url`` and of the validated ``data`` dict, the same parameters in any \
+        order give the same key
+    :retype: str
+    """
+    canonical = dumps({'url': url, 'data': data}, sort_keys=True, separators=(',', ':'),
+                      default=str)
+    return sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class MemoryCache():
+    """
+    In-memory LRU cache.
+
+    :param max_entries: the maximum number of entries
+    :type max_entries: int
+
+    :param max_bytes: the maximum total size of the entries
+    :type max_bytes: int
+
+    :param ttl: the default lifetime of an entry in seconds
+    :type ttl: float
+    """
+    def __init__(self, max_entries=256, max_bytes=64 * 2 ** 20, ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _pop(self, key):
+        _, value = self._entries.pop(key)
+        self.size -= len(value)
+
+    def get(self, key):
+        """
+        :return: the value stored under ``key`` or ``None`` if it is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores ``value`` under ``key`` and evicts the least recently used entries if the cache \
+            is full
+
+        .. info:: A value bigger than ``max_bytes`` is not stored
+        """
+        if len(value) > self.max_bytes:
+            return
+        expires_at = time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (expires_at, value)
+            self.size += len(value)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def delete(self, key):
+        """
+        Removes the entry stored under ``key`` if any
+        """
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+
+
+class DiskCache():
+    """
+    On-disk cache, each entry is a file named after its key.
+
+    :param directory: the cache directory, it can be shared by several workers
+    :type directory: str
+
+    :param max_bytes: the maximum total size of the files, the least recently written are \
+        removed first
+    :type max_bytes: int
+
+    :param ttl: the default lifetime of an entry in seconds
+    :type ttl: float
+    """
+    def __init__(self, directory, max_bytes=512 * 2 ** 20, ttl=300):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, _, size in self._files())
+
+    def _files(self):
+        for name in listdir(self.directory):
+            try:
+                file_stat = stat(join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            yield name, file_stat.st_mtime, file_stat.st_size
+
+    def _path(self, key):
+        return join(self.directory, key)
+
+    def get(self, key):
+        """
+        :return: the value stored under ``key`` or ``None`` if it is missing or expired
+        """
+        try:
+            with open(self._path(key), 'rb') as cache_file:
+                expires_at, = _EXPIRY.unpack(cache_file.read(_EXPIRY.size))
+                value = cache_file.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        if expires_at <= time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores ``value`` under ``key``, the file is written atomically
+        """
+        if len(value) > self.max_bytes:
+            return
+        expires_at = time() + (self.ttl if ttl is None else ttl)
+        with NamedTemporaryFile(dir=self.directory, prefix='.', delete=False) as temp_file:
+            temp_file.write(_EXPIRY.pack(expires_at))
+            temp_file.write(value)
+        replace(temp_file.name, self._path(key))
+        self._size += _EXPIRY.size + len(value)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def delete(self, key):
+        """
+        Removes the entry stored under ``key`` if any
+        """
+        try:
+            remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        files = sorted(self._files(), key=lambda file: file[1])
+        self._size = sum(size for _, _, size in files)
+        for name, _, size in files:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                remove(join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+
+class ScreenshotCache():
+    """
+    Two-tier screenshot cache: a memory tier and an optional disk tier.
+
+    :param memory: the memory tier
+    :type memory: MemoryCache
+
+    :param disk: optional, the disk tier
+    :type disk: DiskCache
+    """
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        :return: the screenshot stored under ``key`` or ``None``
+
+        .. info:: A hit in the disk tier is copied into the memory tier
+        """
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores the screenshot ``value`` under ``key`` in every tier
+        """
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            self.disk.set(key, value, ttl)
+
+    def stats(self):
+        """
+        :return: the hit and miss counters and the size of the memory tier
+        :retype: dict
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.memory),
+            'bytes': self.memory.size,
+        }
+
+
+_SCREENSHOT_CACHE = None
+_SCREENSHOT_CACHE_LOCK = Lock()
+
+
+def get_screenshot_cache():
+    """
+    :return: the screenshot cache of the current worker, built from the settings on first call
+    :retype: ScreenshotCache
+    """
+    global _SCREENSHOT_CACHE  # pylint: disable=global-statement
+    with _SCREENSHOT_CACHE_LOCK:
+        if _SCREENSHOT_CACHE is None:
+            memory = MemoryCache(max_entries=settings.CACHE_MAX_ENTRIES,
+                                 max_bytes=settings.CACHE_MAX_BYTES, ttl=settings.CACHE_TTL)
+            disk = None
+            if settings.CACHE_DIR:
+                disk = DiskCache(settings.CACHE_DIR, max_bytes=settings.CACHE_DISK_MAX_BYTES,
+                                 ttl=settings.CACHE_TTL)
+            _SCREENSHOT_CACHE = ScreenshotCache(memory, disk)
+    return _SCREENSHOT_CACHE
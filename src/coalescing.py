@@ -0,0 +1,219 @@
+"""
+Contains the request coalescing: while a screenshot is being taken, identical requests wait for
+it and share its bytes instead of taking their own.
+"""
+from errno import EAGAIN, EACCES
+from fcntl import LOCK_EX, LOCK_NB, LOCK_UN, flock
+from os import listdir, makedirs, remove, replace, stat, utime
+from os.path import join
+from tempfile import NamedTemporaryFile
+from threading import Event, Lock
+from time import monotonic, sleep, time
+
+from . import settings
+
+
+class _Call():
+    def __init__(self):
+        self.event = Event()
+        self.result = None
+        self.exception = None
+
+
+class SingleFlight():
+    """
+    Coalesces the identical calls made by the threads of one process.
+    """
+    def __init__(self):
+        self.shared_count = 0
+        self._calls = {}
+        self._lock = Lock()
+
+    def do(self, key, function):
+        """
+        Calls ``function`` unless a call with the same ``key`` is in flight, in which case it \
+            waits for that call and shares its result
+
+        :return: the result and ``True`` if it was shared with another call
+        :retype: tuple
+
+        .. info:: The exception raised by the call is raised in every waiting thread
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+        if not leader:
+            call.event.wait()
+            with self._lock:
+                self.shared_count += 1
+            if call.exception is not None:
+                raise call.exception
+            return call.result, True
+        try:
+            call.result = function()
+        except BaseException as exc:
+            call.exception = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result, False
+
+
+class FileLockCoordinator():
+    """
+    Coalesces the identical calls made by the processes of one host with a lock file per key.
+
+    The first process to lock the file takes the screenshot and writes it next to the lock file,
+    the processes that were waiting for the lock read it instead of taking their own.
+
+    :param directory: the directory of the lock and result files, shared by the workers
+    :type directory: str
+
+    :param result_ttl: the number of seconds during which a result can be shared
+    :type result_ttl: float
+
+    :param timeout: the maximum number of seconds to wait for the lock, the function is called \
+        without it afterwards
+    :type timeout: float
+
+    :param max_age: lock and result files older than this number of seconds are removed from \
+        time to time
+    :type max_age: float
+    """
+    def __init__(self, directory, result_ttl=5, timeout=60, max_age=3600):
+        self.directory = directory
+        self.result_ttl = result_ttl
+        self.timeout = timeout
+        self.max_age = max_age
+        self.shared_count = 0
+        self._last_cleanup = time()
+        makedirs(directory, exist_ok=True)
+
+    def _lock(self, lock_file):
+        deadline = monotonic() + self.timeout
+        while True:
+            try:
+                flock(lock_file, LOCK_EX | LOCK_NB)
+                return True
+            except OSError as exc:
+                if exc.errno not in (EAGAIN, EACCES):
+                    raise
+            if monotonic() >= deadline:
+                return False
+            sleep(0.05)
+
+    def _read_result(self, path, newer_than=None):
+        try:
+            mtime = stat(path).st_mtime
+            if time() - mtime > self.result_ttl or (newer_than is not None and mtime < newer_than):
+                return None
+            with open(path, 'rb') as result_file:
+                return result_file.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_result(self, path, result):
+        with NamedTemporaryFile(dir=self.directory, prefix='.', delete=False) as temp_file:
+            temp_file.write(result)
+        replace(temp_file.name, path)
+
+    def _cleanup(self):
+        now = time()
+        if now - self._last_cleanup < self.max_age:
+            return
+        self._last_cleanup = now
+        for name in listdir(self.directory):
+            path = join(self.directory, name)
+            try:
+                if now - stat(path).st_mtime > self.max_age:
+                    remove(path)
+            except FileNotFoundError:
+                pass
+
+    def do(self, key, function, fresh=False):
+        """
+        Calls ``function`` unless another process has just made the call with the same ``key``, \
+            in which case its result is shared
+
+        :param fresh: optional, ``True`` to share only the result of a call that was in flight \
+            when this one started, not the result of an earlier call
+        :type fresh: bool
+
+        :return: the result and ``True`` if it was shared with another process
+        :retype: tuple
+
+        .. warning:: ``function`` must return ``bytes``
+        """
+        self._cleanup()
+        started_at = time()
+        path = join(self.directory, key)
+        with open(path + '.lock', 'a+b') as lock_file:
+            locked = self._lock(lock_file)
+            try:
+                utime(lock_file.name)
+                result = self._read_result(path, newer_than=started_at if fresh else None)
+                if result is not None:
+                    self.shared_count += 1
+                    return result, True
+                result = function()
+                if result:
+                    self._write_result(path, result)
+                return result, False
+            finally:
+                if locked:
+                    flock(lock_file, LOCK_UN)
+
+
+class Coalescer():
+    """
+    Coalesces the identical calls made by the threads of the process and, when a coordinator is \
+        given, by the processes of the host.
+
+    :param coordinator: optional, the cross-process coordinator
+    :type coordinator: FileLockCoordinator
+    """
+    def __init__(self, coordinator=None):
+        self.single_flight = SingleFlight()
+        self.coordinator = coordinator
+
+    def do(self, key, function, fresh=False):
+        """
+        :param fresh: optional, ``True`` to share only the result of a call in flight, for the \
+            screenshots that must not be older than the request
+        :type fresh: bool
+
+        :return: the result of ``function`` and ``True`` if it was shared with another call
+        :retype: tuple
+        """
+        if self.coordinator is None:
+            return self.single_flight.do(key, function)
+        # A fresh call does not join a call that may share an earlier result of another process
+        (result, shared), thread_shared = self.single_flight.do(
+            (key, fresh), lambda: self.coordinator.do(key, function, fresh=fresh))
+        return result, shared or thread_shared
+
+
+_COALESCER = None
+_COALESCER_LOCK = Lock()
+
+
+def get_coalescer():
+    """
+    :return: the coalescer of the current worker, built from the settings on first call
+    :retype: Coalescer
+    """
+    global _COALESCER  # pylint: disable=global-statement
+    with _COALESCER_LOCK:
+        if _COALESCER is None:
+            coordinator = None
+            if settings.COALESCING_DIR:
+                coordinator = FileLockCoordinator(settings.COALESCING_DIR,
+                                                  result_ttl=settings.COALESCING_RESULT_TTL,
+                                                  timeout=settings.COALESCING_TIMEOUT)
+            _COALESCER = Coalescer(coordinator)
+    return _COALESCER
@@ -0,0 +1,245 @@
+"""
+Contains the visual comparison of a screenshot with a baseline image and the store of the
+baselines.
+"""
+from io import BytesIO
+from os import makedirs, replace
+from os.path import isfile, join
+from re import compile as compile_regex
+from tempfile import NamedTemporaryFile
+from threading import Lock
+
+import numpy as np
+
+from PIL import Image, ImageDraw
+
+from . import settings
+
+
+BASELINE_KEY_REGEX = compile_regex(r'^[A-Za-z0-9_.-]{1,128}$')
+HIGHLIGHT_COLOR = (255, 0, 0)
+# The images are compared by horizontal bands of about this number of pixels, so that the
+# temporary arrays stay small whatever the size of the images
+BAND_PIXELS = 2 ** 20
+
+
+def image_size(bytes_obj):
+    """
+    :return: the size of an image, only its header is read
+    :retype: tuple(int)
+
+    .. warning:: Raises ``ValueError`` if the image is wider than ``COMPARE_MAX_WIDTH`` or \
+        higher than ``FULL_PAGE_MAX_HEIGHT`` pixels
+    """
+    width, height = Image.open(BytesIO(bytes_obj)).size
+    if width > settings.COMPARE_MAX_WIDTH or height > settings.FULL_PAGE_MAX_HEIGHT:
+        raise ValueError('Image too large to compare: {0}x{1}, the maximum is {2}x{3}'.format(
+            width, height, settings.COMPARE_MAX_WIDTH, settings.FULL_PAGE_MAX_HEIGHT))
+    return width, height
+
+
+def _to_array(bytes_obj, size):
+    img = Image.open(BytesIO(bytes_obj)).convert('RGB')
+    if img.size == size:
+        return np.asarray(img)
+    array = np.full((size[1], size[0], 3), 255, dtype=np.uint8)
+    array[:img.height, :img.width] = np.asarray(img)
+    return array
+
+
+def _bands(array):
+    rows = max(1, BAND_PIXELS // array.shape[1])
+    for top in range(0, array.shape[0], rows):
+        yield slice(top, top + rows)
+
+
+def _rmsd(array1, array2):
+    """
+    The root-mean-square deviation of the two images normalized by their mean and standard \
+        deviation, computed from exact integer sums by bands without float copies of the images
+    """
+    count = sum1 = sum2 = squares1 = squares2 = products = 0
+    for band in _bands(array1):
+        band1, band2 = array1[band].astype(np.int64), array2[band].astype(np.int64)
+        count += band1.size
+        sum1, sum2 = sum1 + int(band1.sum()), sum2 + int(band2.sum())
+        squares1 += int(np.einsum('ijk,ijk->', band1, band1))
+        squares2 += int(np.einsum('ijk,ijk->', band2, band2))
+        products += int(np.einsum('ijk,ijk->', band1, band2))
+    # The variances and the covariance multiplied by count ** 2, without rounding
+    variance1 = count * squares1 - sum1 ** 2
+    variance2 = count * squares2 - sum2 ** 2
+    covariance = count * products - sum1 * sum2
+    square = (variance1 > 0) + (variance2 > 0) - 2 * covariance / (
+        (variance1 ** 0.5 or 1) * (variance2 ** 0.5 or 1))
+    return max(0., square) ** 0.5
+
+
+def _changed_boxes(mask, cell_size):
+    """
+    Groups the changed pixels by cells of ``cell_size`` pixels and merges the adjacent changed \
+        cells into boxes
+    """
+    rows, columns = -(-mask.shape[0] // cell_size), -(-mask.shape[1] // cell_size)
+    padded = np.zeros((rows * cell_size, columns * cell_size), dtype=bool)
+    padded[:mask.shape[0], :mask.shape[1]] = mask
+    cells = padded.reshape(rows, cell_size, columns, cell_size).any(axis=(1, 3))
+    seen = np.zeros_like(cells)
+    boxes = []
+    for row, column in zip(*np.nonzero(cells)):
+        if seen[row, column]:
+            continue
+        seen[row, column] = True
+        stack, top, left, bottom, right = [(row, column)], row, column, row, column
+        while stack:
+            current_row, current_column = stack.pop()
+            top, bottom = min(top, current_row), max(bottom, current_row)
+            left, right = min(left, current_column), max(right, current_column)
+            for next_row, next_column in ((current_row - 1, current_column),
+                                          (current_row + 1, current_column),
+                                          (current_row, current_column - 1),
+                                          (current_row, current_column + 1)):
+                if (0 <= next_row < rows and 0 <= next_column < columns
+                        and cells[next_row, next_column] and not seen[next_row, next_column]):
+                    seen[next_row, next_column] = True
+                    stack.append((next_row, next_column))
+        boxes.append({
+            'x': int(left * cell_size),
+            'y': int(top * cell_size),
+            'width': int(min((right + 1) * cell_size, mask.shape[1]) - left * cell_size),
+            'height': int(min((bottom + 1) * cell_size, mask.shape[0]) - top * cell_size),
+        })
+    return boxes
+
+
+def highlight_diff(array, mask, boxes):
+    """
+    :return: the image faded, its changed pixels in red and the changed boxes outlined, as a \
+        png image
+    :retype: bytes
+    """
+    highlighted = np.empty_like(array)
+    for band in _bands(array):
+        highlighted[band] = array[band].astype(np.uint16) * 2 // 5 + 153
+    highlighted[mask] = HIGHLIGHT_COLOR
+    img = Image.fromarray(highlighted)
+    draw = ImageDraw.Draw(img)
+    for box in boxes:
+        draw.rectangle([box['x'], box['y'], box['x'] + box['width'] - 1,
+                        box['y'] + box['height'] - 1], outline=HIGHLIGHT_COLOR)
+    output = BytesIO()
+    img.save(output, format='PNG')
+    return output.getvalue()
+
+
+def compare_images(bytes_img, bytes_baseline, tolerance=16, cell_size=16, diff_image=False):
+    """
+    This function compares a screenshot with a baseline image
+
+    :param bytes_img: mandatory, the screenshot
+    :type bytes_img: bytes
+
+    :param bytes_baseline: mandatory, the baseline image
+    :type bytes_baseline: bytes
+
+    :param tolerance: optional, a pixel is changed when one of its channels differs by more \
+        than this value, between 0 and 255
+    :type tolerance: int
+
+    :param cell_size: optional, the changed pixels closer than this number of pixels are \
+        grouped in the same box
+    :type cell_size: int
+
+    :param diff_image: optional, ``True`` to return the highlighted diff image
+    :type diff_image: bool
+
+    :return: the ``score`` (the share of unchanged pixels), the ``rmsd`` of the normalized \
+        images, the number and the share of ``changed_pixels``, the changed ``boxes``, whether \
+        the ``size_changed`` and the ``diff_image`` when requested
+    :retype: dict
+
+    .. info:: Images of different sizes are compared on the largest size, the missing area of \
+        the smaller one being white
+    .. info:: The images are compared by bands, beside the two decoded images the memory used \
+        is a boolean mask of the pixels and a few arrays of ``BAND_PIXELS`` pixels
+    .. warning:: Raises ``ValueError`` if one of the images is too large, see ``image_size``
+    """
+    img_size = image_size(bytes_img)
+    baseline_size = image_size(bytes_baseline)
+    size = (max(img_size[0], baseline_size[0]), max(img_size[1], baseline_size[1]))
+    array = _to_array(bytes_img, size)
+    baseline = _to_array(bytes_baseline, size)
+
+    mask = np.empty((size[1], size[0]), dtype=bool)
+    for band in _bands(array):
+        mask[band] = (np.abs(array[band].astype(np.int16) - baseline[band]) > tolerance).any(
+            axis=2)
+    changed_pixels = int(np.count_nonzero(mask))
+    boxes = _changed_boxes(mask, cell_size)
+    result = {
+        'score': 1 - changed_pixels / mask.size,
+        'rmsd': _rmsd(array, baseline),
+        'changed_pixels': changed_pixels,
+        'changed_ratio': changed_pixels / mask.size,
+        'boxes': boxes,
+        'size_changed': img_size != baseline_size,
+    }
+    if diff_image:
+        result['diff_image'] = highlight_diff(array, mask, boxes)
+    return result
+
+
+class BaselineStore():
+    """
+    Stores the baseline images in a directory shared by the workers, one file per key.
+
+    :param directory: the directory, created on first write
+    :type directory: str
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return join(self.directory, key + '.png')
+
+    def get(self, key):
+        """
+        :return: the baseline image or ``None`` if there is none
+        :retype: bytes
+        """
+        try:
+            with open(self._path(key), 'rb') as baseline_file:
+                return baseline_file.read()
+        except OSError as _:
+            return None
+
+    def exists(self, key):
+        """
+        :return: ``True`` if there is a baseline image for ``key``
+        """
+        return isfile(self._path(key))
+
+    def set(self, key, bytes_img):
+        """
+        Stores the baseline image of ``key``, the file is replaced atomically
+        """
+        makedirs(self.directory, exist_ok=True)
+        with NamedTemporaryFile(dir=self.directory, delete=False) as temp_file:
+            temp_file.write(bytes_img)
+        replace(temp_file.name, self._path(key))
+
+
+_BASELINE_STORE = None
+_BASELINE_STORE_LOCK = Lock()
+
+
+def get_baseline_store():
+    """
+    :return: the baseline store, built from the settings on first call
+    :retype: BaselineStore
+    """
+    global _BASELINE_STORE  # pylint: disable=global-statement
+    with _BASELINE_STORE_LOCK:
+        if _BASELINE_STORE is None:
+            _BASELINE_STORE = BaselineStore(settings.BASELINES_DIR)
+    return _BASELINE_STORE
@@ -0,0 +1,158 @@
+"""
+Contains the validators of the conditional requests: a strong ``ETag`` hashing the bytes sent and
+a perceptual hash of the image, so that a client can skip an image that did not change, or that
+only changed by some rendering noise.
+"""
+from collections import OrderedDict
+from hashlib import sha256
+from io import BytesIO
+from threading import Lock
+
+from PIL import Image
+
+from . import settings
+from .streaming import SpooledBody
+
+
+def content_etag(bytes_obj):
+    """
+    :param bytes_obj: mandatory, the body sent
+    :type bytes_obj: bytes or SpooledBody
+
+    :return: the strong entity tag of ``bytes_obj``, without quotes
+    :retype: str
+    """
+    if isinstance(bytes_obj, SpooledBody):
+        return bytes_obj.hash.hexdigest()[:32]
+    return sha256(bytes_obj).hexdigest()[:32]
+
+
+def parse_etags(header):
+    """
+    :param header: mandatory, the value of an ``If-None-Match`` header
+    :type header: str
+
+    :return: the entity tags of the header without quotes nor weak prefix, ``*`` included
+    :retype: list(str)
+    """
+    etags = []
+    for etag in (header or '').split(','):
+        etag = etag.strip()
+        if etag.startswith('W/'):
+            etag = etag[2:]
+        etag = etag.strip('"')
+        if etag:
+            etags.append(etag)
+    return etags
+
+
+def dhash(bytes_img, max_pixels=None):
+    """
+    This function computes the difference hash of an image: the image is reduced to 9x8 gray \
+        pixels and each bit tells whether a pixel is brighter than its right neighbour
+
+    :param bytes_img: mandatory, the image
+    :type bytes_img: bytes
+
+    :param max_pixels: optional, the images of more pixels are not decoded
+    :type max_pixels: int
+
+    :return: the 64 bits hash as 16 hexadecimal characters
+    :retype: str
+
+    .. warning:: Raises ``ValueError`` if the image has more than ``max_pixels`` pixels, only \
+        its header is read
+    """
+    img = Image.open(BytesIO(bytes_img))
+    width, height = img.size
+    if max_pixels and width * height > max_pixels:
+        raise ValueError('Image too large to hash: {0}x{1}'.format(width, height))
+    img.draft('L', (9, 8))
+    if img.mode not in ('L', 'RGB'):
+        img = img.convert('RGB')
+    # The image is first shrunk by an integer factor, then converted once it is small
+    pixels = img.resize((9, 8), Image.BOX, reducing_gap=2.0).convert('L').tobytes()
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            value = value << 1 | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return '{0:016x}'.format(value)
+
+
+def hamming_distance(hash1, hash2):
+    """
+    :return: the number of different bits of two hashes returned by ``dhash``
+    :retype: int
+    """
+    return bin(int(hash1, 16) ^ int(hash2, 16)).count('1')
+
+
+class PerceptualHashCache():
+    """
+    A LRU mapping the entity tags sent by the worker to the perceptual hashes of their image, \
+        it avoids hashing an image twice and finds the hash of the version held by a client.
+
+    :param max_entries: the maximum number of entries
+    :type max_entries: int
+
+    :param max_pixels: optional, the images of more pixels are not hashed, they are sent with \
+        their ``ETag`` only
+    :type max_pixels: int
+    """
+    def __init__(self, max_entries, max_pixels=None):
+        self.max_entries = max_entries
+        self.max_pixels = max_pixels
+        self._hashes = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, etag):
+        """
+        :return: the perceptual hash of the image of ``etag`` or ``None`` if it is unknown
+        :retype: str
+        """
+        with self._lock:
+            phash = self._hashes.get(etag)
+            if phash is not None:
+                self._hashes.move_to_end(etag)
+            return phash
+
+    def set(self, etag, phash):
+        """
+        Stores the perceptual hash of the image of ``etag``
+        """
+        with self._lock:
+            self._hashes[etag] = phash
+            self._hashes.move_to_end(etag)
+            while len(self._hashes) > self.max_entries:
+                self._hashes.popitem(last=False)
+
+    def hash(self, etag, bytes_img):
+        """
+        :return: the perceptual hash of ``bytes_img``, computed once per ``etag``
+        :retype: str
+
+        .. warning:: Raises ``ValueError`` if the image has more than ``max_pixels`` pixels
+        """
+        phash = self.get(etag)
+        if phash is None:
+            phash = dhash(bytes_img, max_pixels=self.max_pixels)
+            self.set(etag, phash)
+        return phash
+
+
+_PHASH_CACHE = None
+_PHASH_CACHE_LOCK = Lock()
+
+
+def get_phash_cache():
+    """
+    :return: the perceptual hash cache of the current worker, built from the settings on first \
+        call
+    :retype: PerceptualHashCache
+    """
+    global _PHASH_CACHE  # pylint: disable=global-statement
+    with _PHASH_CACHE_LOCK:
+        if _PHASH_CACHE is None:
+            _PHASH_CACHE = PerceptualHashCache(settings.PHASH_CACHE_MAX_ENTRIES,
+                                               max_pixels=settings.PHASH_MAX_PIXELS)
+    return _PHASH_CACHE
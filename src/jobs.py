@@ -0,0 +1,336 @@
+"""
+Contains the asynchronous screenshot jobs: a request creates a job and returns at once, a pool of
+threads takes the screenshot and the client polls the job or receives a callback.
+"""
+from json import dumps, loads
+from math import ceil
+from queue import Full, Queue
+from sqlite3 import connect
+from threading import Lock, Thread
+from time import time
+from urllib.request import Request, urlopen
+from uuid import uuid4
+
+from . import settings
+from .serializers import ScreenshotSerializer
+
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a job is submitted while the queue is full
+
+    :attributes:
+    * retry_after (**int**): the number of seconds after which the client should retry
+    """
+    def __init__(self, retry_after):
+        super().__init__('Too many pending jobs')
+        self.retry_after = retry_after
+
+
+class Job():
+    """
+    A screenshot job.
+
+    :attributes:
+    * id (**str**): the job id
+    * url (**str**): the website's url
+    * raw_data (**dict**): the parameters given to the ``ScreenshotSerializer``
+    * status (**str**): ``pending``, ``running``, ``done`` or ``failed``
+    * errors (**list**): the errors of the serializer
+    * callback_url (**str**): optional, the url the job is posted to when it is finished
+    * created_at (**float**): the creation timestamp
+    * expires_at (**float**): the job and its result are removed after this timestamp
+    * result (**bytes**): the screenshot once the job is done
+    """
+    def __init__(self, url, raw_data=None, callback_url=None, ttl=600, job_id=None):
+        self.id = job_id if job_id else uuid4().hex  # pylint: disable=invalid-name
+        self.url = url
+        self.raw_data = raw_data if raw_data else {}
+        self.status = PENDING
+        self.errors = []
+        self.callback_url = callback_url
+        self.created_at = time()
+        self.expires_at = self.created_at + ttl
+        self.result = None
+
+    def to_dict(self):
+        """
+        :return: the job without its result
+        :retype: dict
+        """
+        return {
+            'id': self.id,
+            'url': self.url,
+            'status': self.status,
+            'errors': self.errors,
+            'created_at': self.created_at,
+            'expires_at': self.expires_at,
+        }
+
+
+class MemoryJobStore():
+    """
+    Stores the jobs in the memory of the worker.
+
+    .. warning:: Each worker has its own store, use ``SQLiteJobStore`` with several workers
+    """
+    def __init__(self):
+        self._jobs = {}
+        self._lock = Lock()
+
+    def add(self, job):
+        """
+        Stores ``job``
+        """
+        with self._lock:
+            self._jobs[job.id] = job
+
+    def get(self, job_id):
+        """
+        :return: the job or ``None`` if it does not exist or has expired
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.expires_at <= time():
+            return None
+        return job
+
+    def save(self, job):
+        """
+        Stores the new state of ``job``
+        """
+        self.add(job)
+
+    def purge(self):
+        """
+        Removes the expired jobs
+        """
+        now = time()
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job.expires_at <= now]:
+                del self._jobs[job_id]
+
+
+class SQLiteJobStore():
+    """
+    Stores the jobs in a SQLite database, it can be shared by the workers of the host.
+
+    :param path: the path to the database file
+    :type path: str
+
+    .. warning:: The ``credentials`` of a job are never written to the database, they are kept \
+        in the memory of the worker that submitted the job until it is finished, so a job is \
+        read back with its credentials only by this worker
+    """
+    def __init__(self, path):
+        self.path = path
+        self._connection = connect(path, check_same_thread=False, timeout=30)
+        self._lock = Lock()
+        self._credentials = {}
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, url TEXT, raw_data TEXT, '
+                'status TEXT, errors TEXT, callback_url TEXT, created_at REAL, expires_at REAL, '
+                'result BLOB)')
+
+    def add(self, job):
+        """
+        Stores ``job``
+        """
+        raw_data = dict(job.raw_data)
+        credentials = raw_data.pop('credentials', None)
+        with self._lock, self._connection:
+            if job.status in (DONE, FAILED):
+                self._credentials.pop(job.id, None)
+            elif credentials is not None:
+                self._credentials[job.id] = credentials
+            self._connection.execute(
+                'INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job.id, job.url, dumps(raw_data), job.status, dumps(job.errors),
+                 job.callback_url, job.created_at, job.expires_at, job.result))
+
+    def get(self, job_id):
+        """
+        :return: the job or ``None`` if it does not exist or has expired
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT id, url, raw_data, status, errors, callback_url, created_at, '
+                'expires_at, result FROM jobs WHERE id = ? AND expires_at > ?',
+                (job_id, time())).fetchone()
+            credentials = self._credentials.get(job_id)
+        if row is None:
+            return None
+        raw_data = loads(row[2])
+        if credentials is not None:
+            raw_data['credentials'] = credentials
+        job = Job(row[1], raw_data=raw_data, callback_url=row[5], job_id=row[0])
+        job.status = row[3]
+        job.errors = loads(row[4])
+        job.created_at = row[6]
+        job.expires_at = row[7]
+        job.result = row[8]
+        return job
+
+    def save(self, job):
+        """
+        Stores the new state of ``job``
+        """
+        self.add(job)
+
+    def purge(self):
+        """
+        Removes the expired jobs
+        """
+        now = time()
+        with self._lock, self._connection:
+            for (job_id,) in self._connection.execute('SELECT id FROM jobs WHERE expires_at <= ?',
+                                                      (now,)).fetchall():
+                self._credentials.pop(job_id, None)
+            self._connection.execute('DELETE FROM jobs WHERE expires_at <= ?', (now,))
+
+
+class JobManager():
+    """
+    Runs the jobs in a pool of threads.
+
+    :param store: the job store
+    :type store: MemoryJobStore or SQLiteJobStore
+
+    :param workers: the number of threads
+    :type workers: int
+
+    :param max_queued: the maximum number of pending jobs
+    :type max_queued: int
+
+    :param result_ttl: the number of seconds a finished job and its result are kept
+    :type result_ttl: float
+
+    :param callback_timeout: the timeout of the callback requests in seconds
+    :type callback_timeout: float
+
+    .. info:: The threads are started with the first job, after gunicorn has forked the worker
+    """
+    def __init__(self, store, workers=2, max_queued=100, result_ttl=600, callback_timeout=10):
+        self.store = store
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.callback_timeout = callback_timeout
+        self._queue = Queue(maxsize=max_queued)
+        self._threads = []
+        self._lock = Lock()
+        self._durations = []
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = Thread(target=self._work, name='screamshot-job', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    @property
+    def queued(self):
+        """
+        The number of pending jobs
+        """
+        return self._queue.qsize()
+
+    def retry_after(self):
+        """
+        :return: an estimation of the number of seconds before a slot frees up in the queue
+        :retype: int
+        """
+        durations = self._durations[-20:]
+        mean_duration = sum(durations) / len(durations) if durations else 1
+        return max(1, ceil(mean_duration / self.workers))
+
+    def submit(self, url, raw_data=None, callback_url=None):
+        """
+        Creates a job and queues it
+
+        :return: the job
+        :retype: Job
+
+        .. warning:: Raises ``QueueFullError`` if there are already ``max_queued`` pending jobs
+        """
+        self.store.purge()
+        job = Job(url, raw_data=raw_data, callback_url=callback_url, ttl=self.result_ttl)
+        self.store.add(job)
+        try:
+            self._queue.put_nowait(job.id)
+        except Full:
+            job.status = FAILED
+            job.errors = ['Too many pending jobs']
+            job.expires_at = time()
+            self.store.save(job)
+            raise QueueFullError(self.retry_after()) from None
+        self._start()
+        return job
+
+    def run(self, job):
+        """
+        Takes the screenshot of ``job`` and stores the result
+        """
+        started_at = time()
+        job.status = RUNNING
+        self.store.save(job)
+        serializer = ScreenshotSerializer(job.url, raw_data=job.raw_data)
+        try:
+            job.result = serializer.get_object()
+            job.errors = serializer.errors
+        except Exception as exc:  # pylint: disable=broad-except
+            job.errors = [str(exc)]
+        job.status = DONE if job.result else FAILED
+        job.expires_at = time() + self.result_ttl
+        self.store.save(job)
+        self._durations = self._durations[-19:] + [time() - started_at]
+        if job.callback_url:
+            self._callback(job)
+
+    def _callback(self, job):
+        request = Request(job.callback_url, data=dumps(job.to_dict()).encode('utf-8'),
+                          headers={'Content-Type': 'application/json'}, method='POST')
+        try:
+            urlopen(request, timeout=self.callback_timeout).close()
+        except (OSError, ValueError) as _:
+            pass
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                job = self.store.get(job_id)
+                if job is not None:
+                    self.run(job)
+            finally:
+                self._queue.task_done()
+
+
+_JOB_MANAGER = None
+_JOB_MANAGER_LOCK = Lock()
+
+
+def get_job_manager():
+    """
+    :return: the job manager of the current worker, built from the settings on first call
+    :retype: JobManager
+    """
+    global _JOB_MANAGER  # pylint: disable=global-statement
+    with _JOB_MANAGER_LOCK:
+        if _JOB_MANAGER is None:
+            if settings.JOBS_STORE == 'sqlite':
+                store = SQLiteJobStore(settings.JOBS_SQLITE_PATH)
+            else:
+                store = MemoryJobStore()
+            _JOB_MANAGER = JobManager(store, workers=settings.JOBS_WORKERS,
+                                      max_queued=settings.JOBS_MAX_QUEUED,
+                                      result_ttl=settings.JOBS_RESULT_TTL,
+                                      callback_timeout=settings.JOBS_CALLBACK_TIMEOUT)
+    return _JOB_MANAGER
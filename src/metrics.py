@@ -0,0 +1,251 @@
+"""
+Contains the metrics exposed in the Prometheus text format by ``/metrics``.
+
+.. warning:: The metrics are kept per worker process, each scrape shows the worker that answers
+"""
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1024, 10 * 1024, 50 * 1024, 100 * 1024, 250 * 1024, 500 * 1024, 2 ** 20,
+                5 * 2 ** 20, 10 * 2 ** 20)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, str(value).replace('"', '\\"'))
+                          for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric():
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = Lock()
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def collect(self):
+        """
+        :return: the lines of the metric in the Prometheus text format
+        :retype: list(str)
+        """
+        lines = ['# HELP {0} {1}'.format(self.name, self.documentation),
+                 '# TYPE {0} {1}'.format(self.name, self.kind)]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append('{0}{1} {2}'.format(self.name, _format_labels(self.labels, key),
+                                             _format_value(value)))
+        return lines
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up.
+    """
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """
+        Increments the counter of the given labels
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        """
+        :return: the value of the counter of the given labels
+        """
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down.
+    """
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        """
+        Decrements the gauge of the given labels
+        """
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        """
+        Sets the gauge of the given labels
+        """
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track(self, **labels):
+        """
+        Increments the gauge while the context is running
+        """
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """
+    Counts the observations in buckets.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        """
+        Adds an observation to the histogram of the given labels
+        """
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+            for index, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def collect(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.documentation),
+                 '# TYPE {0} {1}'.format(self.name, self.kind)]
+        with self._lock:
+            items = sorted((key, (list(counts), total))
+                           for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            for bucket, count in zip(self.buckets, counts):
+                lines.append('{0}_bucket{1} {2}'.format(
+                    self.name, _format_labels(self.labels, key, ('le', _format_value(bucket))),
+                    count))
+            lines.append('{0}_sum{1} {2}'.format(self.name, _format_labels(self.labels, key),
+                                                 _format_value(total)))
+            lines.append('{0}_count{1} {2}'.format(self.name, _format_labels(self.labels, key),
+                                                   counts[-1]))
+        return lines
+
+
+class Registry():
+    """
+    The metrics of the worker and the collectors called at scrape time.
+    """
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        """
+        Adds ``metric`` to the registry
+
+        :return: ``metric``
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """
+        Adds a function returning ``(name, kind, documentation, value)`` tuples, called at \
+            scrape time
+
+        :return: ``collector``
+        """
+        self.collectors.append(collector)
+        return collector
+
+    def render(self):
+        """
+        :return: all the metrics in the Prometheus text format
+        :retype: str
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        for collector in self.collectors:
+            for name, kind, documentation, value in collector():
+                lines.extend(['# HELP {0} {1}'.format(name, documentation),
+                              '# TYPE {0} {1}'.format(name, kind),
+                              '{0} {1}'.format(name, _format_value(value))])
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    'screamshot_requests_total', 'Number of HTTP requests.', ['endpoint', 'method', 'status']))
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    'screamshot_request_duration_seconds', 'Duration of the HTTP requests.', ['endpoint']))
+ERRORS = REGISTRY.register(Counter(
+    'screamshot_errors_total', 'Number of failed screenshots by error type.', ['type']))
+STAGE_DURATION = REGISTRY.register(Histogram(
+    'screamshot_stage_duration_seconds', 'Duration of each stage of a screenshot request.',
+    ['stage']))
+IMAGE_SIZE = REGISTRY.register(Histogram(
+    'screamshot_image_bytes', 'Size of the images sent.', ['format'], buckets=SIZE_BUCKETS))
+RENDERS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'screamshot_renders_in_flight', 'Number of screenshots being taken.'))
+RENDERS_QUEUED = REGISTRY.register(Gauge(
+    'screamshot_renders_queued', 'Number of screenshots waiting for a render slot.'))
+ADMISSION_QUEUED = REGISTRY.register(Counter(
+    'screamshot_admission_queued_total', 'Number of screenshots that waited for a render slot.'))
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    'screamshot_admission_rejected_total', 'Number of requests refused by the admission control.',
+    ['reason']))
+BLOCKED_REQUESTS = REGISTRY.register(Counter(
+    'screamshot_blocked_requests_total', 'Number of page requests blocked by resource type.',
+    ['type']))
+PREWARM_RENDERS = REGISTRY.register(Counter(
+    'screamshot_prewarm_renders_total', 'Number of screenshots taken again in the background.',
+    ['status']))
+
+
+@contextmanager
+def time_stage(timings, stage):
+    """
+    Measures the duration of a stage, adds it to the ``timings`` dict and to the stage histogram
+
+    :param timings: mandatory, the durations in seconds of the stages of the request
+    :type timings: dict
+
+    :param stage: mandatory, the stage name
+    :type stage: str
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        duration = perf_counter() - start
+        timings[stage] = timings.get(stage, 0) + duration
+        STAGE_DURATION.observe(duration, stage=stage)
+
+
+def server_timing(timings):
+    """
+    :return: the ``Server-Timing`` header value of the stage durations, in milliseconds
+    :retype: str
+    """
+    return ', '.join('{0};dur={1:.1f}'.format(stage, duration * 1000)
+                     for stage, duration in timings.items())
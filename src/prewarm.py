@@ -0,0 +1,339 @@
+"""
+Contains the pre-warming of the screenshot cache: the frequency of the screenshots is tracked by
+parameter set, and a background thread takes again the most requested ones and the pinned ones
+on a schedule, so that they are served from the cache.
+"""
+from threading import Event, Lock, Thread
+from time import localtime, mktime, time
+
+from . import settings
+from .metrics import PREWARM_RENDERS
+from .serializers import SCREAMSHOT_PARAMETERS, ScreenshotSerializer
+
+
+CRON_FIELDS = [('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12),
+               ('weekday', 0, 6)]
+# The calendar repeats its leap years and weekdays every 28 years, within a century
+SEARCH_DAYS = 28 * 366
+# The number of seconds after which the thread looks again for the next run when none is found
+RETRY_DELAY = 24 * 3600
+
+
+class BadSchedule(ValueError):
+    """
+    Raised when a schedule is neither a number of seconds nor a cron expression
+    """
+
+
+def _parse_cron_field(field, minimum, maximum):
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            first, last = minimum, maximum
+        elif '-' in part:
+            first, last = (int(value) for value in part.split('-', 1))
+        else:
+            first = last = int(part)
+            if step != 1:
+                last = maximum
+        if step < 1 or first < minimum or last > maximum or first > last:
+            raise ValueError(field)
+        values.update(range(first, last + 1, step))
+    return frozenset(values)
+
+
+class Schedule():
+    """
+    When the pre-warming runs.
+
+    :param spec: a number of seconds between two runs, or a cron expression of five fields \
+        (minute, hour, day of month, month, day of week with ``0`` for sunday) made of ``*``, \
+        numbers, ``a-b`` ranges, ``/n`` steps and ``,`` lists, in local time, a minute matches \
+        when all the fields match
+    :type spec: str
+
+    .. warning:: Raises ``BadSchedule`` if ``spec`` is not valid or if the cron expression \
+        never matches, e.g. ``0 0 30 2 *``
+    """
+    def __init__(self, spec):
+        self.spec = spec.strip()
+        self.interval = None
+        self.fields = None
+        try:
+            self.interval = float(self.spec)
+        except ValueError as _:
+            parts = self.spec.split()
+            if len(parts) != len(CRON_FIELDS):
+                raise BadSchedule('Bad schedule: "{0}"'.format(spec)) from None
+            try:
+                self.fields = [_parse_cron_field(part, minimum, maximum)
+                               for part, (_, minimum, maximum) in zip(parts, CRON_FIELDS)]
+            except ValueError as _:
+                raise BadSchedule('Bad schedule: "{0}"'.format(spec)) from None
+            if self.next_run(time()) is None:
+                raise BadSchedule('Bad schedule: "{0}" never matches'.format(spec))
+        else:
+            if self.interval <= 0:
+                raise BadSchedule('Bad schedule: "{0}"'.format(spec))
+
+    def next_run(self, after):
+        """
+        :return: the timestamp of the first run strictly after the ``after`` timestamp, ``None`` \
+            if the cron expression does not match within ``SEARCH_DAYS`` days
+        :retype: float
+        """
+        if self.interval is not None:
+            return after + self.interval
+        minutes, hours, days, months, weekdays = self.fields
+        moment = (int(after) // 60 + 1) * 60
+        limit = moment + SEARCH_DAYS * 24 * 3600
+        while moment <= limit:
+            date = localtime(moment)
+            if date.tm_mon not in months:
+                moment = mktime((date.tm_year, date.tm_mon + 1, 1, 0, 0, 0, 0, 0, -1))
+            elif date.tm_mday not in days or (date.tm_wday + 1) % 7 not in weekdays:
+                moment = mktime((date.tm_year, date.tm_mon, date.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+            elif date.tm_hour not in hours:
+                moment = mktime((date.tm_year, date.tm_mon, date.tm_mday, date.tm_hour + 1, 0, 0,
+                                 0, 0, -1))
+            elif date.tm_min not in minutes:
+                moment += 60
+            else:
+                return float(moment)
+            moment = int(moment)
+        return None
+
+
+class PrewarmEntry():
+    """
+    A parameter set of the screenshots.
+
+    :attributes:
+    * key (**str**): the key of the screenshot in the cache
+    * url (**str**): the website's url
+    * raw_data (**dict**): the parameters given to the ``ScreenshotSerializer``, the options \
+        left out
+    * hits (**float**): the number of requests, halved after each run
+    * pinned (**bool**): ``True`` if the entry is taken at each run whatever its hits
+    * last_run (**float**): the timestamp of the last time it was taken in the background
+    * errors (**list**): the errors of the last time it was taken in the background
+    """
+    def __init__(self, key, url, raw_data):
+        self.key = key
+        self.url = url
+        self.raw_data = raw_data
+        self.hits = 0
+        self.pinned = False
+        self.last_run = None
+        self.errors = []
+
+    def to_dict(self):
+        """
+        :return: the entry as a json serializable dict
+        :retype: dict
+        """
+        return {'key': self.key, 'url': self.url, 'data': self.raw_data, 'hits': self.hits,
+                'pinned': self.pinned, 'last_run': self.last_run, 'errors': self.errors}
+
+
+def _entry_of(serializer):
+    raw_data = {key: value for key, value in serializer.raw_data.items()
+                if key in SCREAMSHOT_PARAMETERS}
+    return PrewarmEntry(serializer.cache_key(), serializer.url, raw_data)
+
+
+class Prewarmer():
+    """
+    Tracks the frequency of the screenshots and takes the most requested ones again on a \
+        schedule.
+
+    :param schedule: optional, when the runs happen, ``None`` to only track the frequencies
+    :type schedule: Schedule
+
+    :param top: the number of most requested entries taken at each run, besides the pinned ones
+    :type top: int
+
+    :param max_tracked: the maximum number of entries tracked, the least requested one is \
+        forgotten beyond
+    :type max_tracked: int
+
+    .. info:: The thread is started with the first tracked request, after gunicorn has forked \
+        the worker
+    .. warning:: The screenshots with ``credentials`` are never tracked nor pinned, so that the \
+        credentials are not kept
+    """
+    def __init__(self, schedule=None, top=10, max_tracked=1000):
+        self.schedule = schedule
+        self.top = top
+        self.max_tracked = max_tracked
+        self.next_run = None
+        self.run_count = 0
+        self._entries = {}
+        self._lock = Lock()
+        self._thread = None
+        self._stop = Event()
+
+    @staticmethod
+    def is_trackable(serializer):
+        """
+        :return: ``True`` if the screenshot of a validated serializer can be taken again in the \
+            background
+        :retype: bool
+        """
+        return bool(serializer.valid and not serializer.data.get('credentials')
+                    and serializer.options.get('cache') != 'bypass')
+
+    def _get_entry(self, serializer):
+        entry = _entry_of(serializer)
+        entry = self._entries.setdefault(entry.key, entry)
+        if len(self._entries) > self.max_tracked:
+            coldest = min((tracked for tracked in self._entries.values()
+                           if not tracked.pinned and tracked is not entry),
+                          key=lambda tracked: tracked.hits, default=None)
+            if coldest is not None:
+                del self._entries[coldest.key]
+        return entry
+
+    def record(self, serializer):
+        """
+        Counts a request of a validated serializer
+        """
+        if not self.is_trackable(serializer):
+            return
+        with self._lock:
+            self._get_entry(serializer).hits += 1
+        self._start()
+
+    def pin(self, serializer):
+        """
+        Pins the parameter set of a validated serializer
+
+        :return: the pinned entry
+        :retype: PrewarmEntry
+        """
+        with self._lock:
+            entry = self._get_entry(serializer)
+            entry.pinned = True
+        self._start()
+        return entry
+
+    def unpin(self, key):
+        """
+        Unpins the entry of ``key``
+
+        :return: ``True`` if the entry was pinned
+        :retype: bool
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.pinned:
+                return False
+            entry.pinned = False
+            if not entry.hits:
+                del self._entries[key]
+        return True
+
+    def entries(self):
+        """
+        :return: the pinned entries then the tracked ones, the most requested first
+        :retype: list(PrewarmEntry)
+        """
+        with self._lock:
+            return sorted(self._entries.values(), key=lambda entry: (not entry.pinned, -entry.hits))
+
+    def warm_entries(self):
+        """
+        :return: the entries taken at each run, the pinned ones and the ``top`` most requested
+        :retype: list(PrewarmEntry)
+        """
+        entries = self.entries()
+        pinned = [entry for entry in entries if entry.pinned]
+        hot = [entry for entry in entries if not entry.pinned and entry.hits][:self.top]
+        return pinned + hot
+
+    def run(self):
+        """
+        Takes the screenshots of the warm entries again and stores them in the cache, then \
+            halves the hits so that the frequencies follow the recent requests
+        """
+        for entry in self.warm_entries():
+            serializer = ScreenshotSerializer(entry.url, raw_data=dict(entry.raw_data,
+                                                                       cache='refresh'))
+            try:
+                bytes_img = serializer.get_object()
+                entry.errors = serializer.errors
+            except Exception as exc:  # pylint: disable=broad-except
+                bytes_img, entry.errors = None, [str(exc)]
+            entry.last_run = time()
+            PREWARM_RENDERS.inc(status='done' if bytes_img else 'failed')
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                entry.hits /= 2
+                if entry.hits < 0.5 and not entry.pinned:
+                    del self._entries[key]
+        self.run_count += 1
+
+    def _start(self):
+        if self.schedule is None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._work, name='screamshot-prewarm', daemon=True)
+                self._thread.start()
+
+    def _work(self):
+        while True:
+            self.next_run = self.schedule.next_run(time())
+            delay = RETRY_DELAY if self.next_run is None else max(0, self.next_run - time())
+            if self._stop.wait(delay):
+                return
+            if self.next_run is None:
+                continue
+            try:
+                self.run()
+            except Exception as _:  # pylint: disable=broad-except
+                pass
+
+    def stop(self):
+        """
+        Stops the thread after the current run
+        """
+        self._stop.set()
+
+    def to_dict(self):
+        """
+        :return: the schedule, the next run timestamp, the number of runs and the entries as a \
+            json serializable dict
+        :retype: dict
+        """
+        warm = {entry.key for entry in self.warm_entries()}
+        entries = []
+        for entry in self.entries():
+            entry_dict = entry.to_dict()
+            entry_dict['warm'] = entry.key in warm
+            entries.append(entry_dict)
+        return {'schedule': self.schedule.spec if self.schedule else None,
+                'top': self.top, 'next_run': self.next_run, 'run_count': self.run_count,
+                'entries': entries}
+
+
+_PREWARMER = None
+_PREWARMER_LOCK = Lock()
+
+
+def get_prewarmer():
+    """
+    :return: the prewarmer of the current worker, built from the settings on first call
+    :retype: Prewarmer
+    """
+    global _PREWARMER  # pylint: disable=global-statement
+    with _PREWARMER_LOCK:
+        if _PREWARMER is None:
+            schedule = Schedule(settings.PREWARM_SCHEDULE) if settings.PREWARM_SCHEDULE else None
+            _PREWARMER = Prewarmer(schedule=schedule, top=settings.PREWARM_TOP,
+                                   max_tracked=settings.PREWARM_MAX_TRACKED)
+    return _PREWARMER
@@ -0,0 +1,278 @@
+"""
+Contains the coroutines that drive a browser page to take a screenshot.
+"""
+from asyncio import ensure_future, get_event_loop
+from json import dumps
+from time import monotonic
+
+from pyppeteer.errors import PageError, PyppeteerError
+
+from screamshot.errors import BadUrl, BadSelector
+
+from .archive import stream_zip
+from .blocking import REQUEST_TIMINGS, BlockingRules
+from .tiles import PNGStitcher, TileArchive
+
+
+DEFAULT_VIEWPORT = {'width': 800, 'height': 600}
+# The parameters screamshot.generate_bytes_img does not know
+RENDERER_PARAMETERS = ['full_page', 'tiles', 'viewports', 'selectors', 'blocking']
+# The parameters collecting statistics, not given to screamshot.generate_bytes_img
+STATS_PARAMETERS = ['blocking_stats', 'resource_stats']
+SCROLL_TO = '(top) => { window.scrollTo(0, top); return window.scrollY; }'
+
+
+class ResourceCacheStats():
+    """
+    Counts the responses of the requests of a page served by the browser cache.
+
+    :attributes:
+    * hits (**int**): the number of responses served from the memory or disk cache
+    * misses (**int**): the number of responses loaded from the network
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, from_cache):
+        """
+        Counts a response
+        """
+        if from_cache:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def headers(self):
+        """
+        :return: the ``X-Resource-Cache`` header, or nothing if no response was received
+        :retype: dict
+        """
+        if not self.hits and not self.misses:
+            return {}
+        return {'X-Resource-Cache': 'hits={0}, misses={1}'.format(self.hits, self.misses)}
+
+
+async def _setup_page(page, width=None, height=None, credentials=None, session=None):
+    viewport = {}
+    if width:
+        viewport['width'] = width
+    if height:
+        viewport['height'] = height
+    if viewport:
+        await page.setViewport(viewport)
+
+    if credentials:
+        credentials = dict(credentials)
+        if 'username' in credentials and 'password' in credentials:
+            await page.authenticate(credentials)
+        if credentials.pop('token_in_header', None):
+            await page.setExtraHTTPHeaders(credentials)
+        # The responses of a protected page must not be cached for the other pages, unless the
+        # page is in the context of its session; the authentication disables the cache
+        await page.setCacheEnabled(session is not None)
+        if session is not None and session.cookies:
+            await page.setCookie(*session.cookies)
+
+
+def _track_requests(page, resource_stats=None):
+    started = {}
+
+    def on_request(request):
+        started[request] = monotonic()
+
+    def on_request_done(request):
+        started_at = started.pop(request, None)
+        if started_at is not None and request.failure() is None:
+            REQUEST_TIMINGS.add(request.resourceType, monotonic() - started_at)
+
+    def on_response(response):
+        if resource_stats is not None and not response.url.startswith('data:'):
+            resource_stats.add(response.fromCache)
+
+    page.on('request', on_request)
+    page.on('requestfinished', on_request_done)
+    page.on('requestfailed', on_request_done)
+    page.on('response', on_response)
+
+
+async def _resolve(coroutine):
+    try:
+        await coroutine
+    except PyppeteerError as _:
+        # The page was closed before the request was resolved
+        pass
+
+
+async def _setup_blocking(page, url, blocking, blocking_stats=None):
+    rules = BlockingRules(url, **blocking)
+
+    def on_request(request):
+        if not (request.isNavigationRequest() and request.frame == page.mainFrame) \
+                and rules.blocks(request.url, request.resourceType):
+            if blocking_stats is not None:
+                blocking_stats.add(request.resourceType)
+            ensure_future(_resolve(request.abort('blockedbyclient')))
+        else:
+            ensure_future(_resolve(request.continue_()))
+
+    await page.setRequestInterception(True)
+    page.on('request', on_request)
+
+
+async def _navigate(page, url, wait_until=None, wait_for=None):
+    if not wait_until:
+        wait_until = ['load']
+    elif not isinstance(wait_until, list):
+        wait_until = [wait_until]
+    try:
+        await page.goto(url, waitUntil=wait_until)
+    except PageError as _:
+        raise BadUrl('url unknown: "{0}"'.format(url)) from None
+    if wait_for:
+        await page.waitForSelector(wait_for)
+
+
+async def _capture(page, selector=None):
+    if selector:
+        element = await page.querySelector(selector)
+        if not element:
+            raise BadSelector('selector unknown: "{0}"'.format(selector))
+        return await element.screenshot()
+    return await page.screenshot()
+
+
+async def _capture_full_page(page, max_height, tiles=False):
+    viewport = page.viewport or DEFAULT_VIEWPORT
+    tile_height = viewport['height']
+    scale = viewport.get('deviceScaleFactor') or 1
+    page_height = await page.evaluate('() => document.documentElement.scrollHeight')
+    height = max(1, min(page_height, max_height))
+    collector = TileArchive() if tiles else PNGStitcher(round(height * scale))
+    loop = get_event_loop()
+    for top in range(0, height, tile_height):
+        # The last tile cannot scroll past the bottom of the page, it overlaps the previous one
+        scroll_y = await page.evaluate(SCROLL_TO, top)
+        tile = await page.screenshot()
+        await loop.run_in_executor(None, collector.add, tile, round((top - scroll_y) * scale),
+                                   round(min(tile_height, height - top) * scale))
+    return await loop.run_in_executor(None, collector.close)
+
+
+async def _capture_viewports(page, viewports, selector=None, full_page=False,
+                             max_height=16384):
+    entries = []
+    for index, viewport in enumerate(viewports):
+        if index:
+            await page.setViewport(viewport)
+        if full_page:
+            bytes_img = await _capture_full_page(page, max_height)
+        else:
+            bytes_img = await _capture(page, selector=selector)
+        entries.append(('{0:04d}-{width}x{height}.png'.format(index, **viewport), bytes_img))
+    return b''.join(stream_zip(entries))
+
+
+async def _capture_selectors(page, selectors):
+    entries, manifest = [], []
+    for index, selector in enumerate(selectors):
+        entry = {'selector': selector}
+        try:
+            element = await page.querySelector(selector)
+            if not element:
+                raise BadSelector('selector unknown: "{0}"'.format(selector))
+            box = await element.boundingBox()
+            if not box:
+                raise BadSelector('selector not visible: "{0}"'.format(selector))
+            bytes_img = await element.screenshot()
+        except (BadSelector, PyppeteerError) as exc:
+            entry['errors'] = [str(exc)]
+        else:
+            entry['file'] = '{0:04d}.png'.format(index)
+            entry['box'] = box
+            entries.append((entry['file'], bytes_img))
+        manifest.append(entry)
+    entries.append(('manifest.json', dumps(manifest).encode('utf-8')))
+    return b''.join(stream_zip(entries))
+
+
+async def render_screenshot(browser, url, width=None, height=None, credentials=None,
+                            selector=None, wait_for=None, wait_until=None, full_page=False,
+                            tiles=False, max_height=16384, viewports=None, selectors=None,
+                            blocking=None, blocking_stats=None, resource_stats=None, session=None):
+    """
+    This coroutine opens a tab in ``browser``, takes the screenshot and closes the tab
+
+    It accepts the same parameters as ``screamshot.generate_bytes_img`` but does not launch nor \
+        look for a browser, and the tab is closed even if the screenshot fails.
+
+    :param full_page: optional, ``True`` to capture the whole page, scrolled one viewport at a \
+        time, the tiles are stitched into one png image
+    :type full_page: bool
+
+    :param tiles: optional, ``True`` to capture the whole page like ``full_page`` but return the \
+        tiles in a zip archive
+    :type tiles: bool
+
+    :param max_height: optional, the page is cut below this height in CSS pixels in the \
+        ``full_page`` and ``tiles`` modes
+    :type max_height: int
+
+    :param viewports: optional, the ``{'width': ..., 'height': ...}`` viewports, the page is \
+        loaded once in the first one then resized to each of them and captured, ``width`` and \
+        ``height`` are ignored
+    :type viewports: list(dict)
+
+    :param selectors: optional, CSS3 selectors, the page is loaded once and each matched \
+        element is captured, ``selector`` is ignored
+    :type selectors: list(str)
+
+    :param blocking: optional, the ``types``, ``deny``, ``allow`` and ``first_party_only`` \
+        parameters of ``BlockingRules``, the matching requests of the page are aborted
+    :type blocking: dict
+
+    :param blocking_stats: optional, counts the blocked requests
+    :type blocking_stats: BlockingStats
+
+    :param resource_stats: optional, counts the responses served by the browser cache
+    :type resource_stats: ResourceCacheStats
+
+    :param session: optional, the session of ``credentials`` when ``browser`` is its browser \
+        context, its cookies are restored before the page is loaded and saved after
+    :type session: Session
+
+    :return: the screenshot as a png image, or the zip archive of the tiles, of the \
+        ``<index>-<width>x<height>.png`` images of the viewports or of the ``<index>.png`` images \
+        of the selectors
+    :retype: bytes
+
+    .. info:: The archive of the selectors has a ``manifest.json`` file listing for each \
+        selector its image and the bounding box of its element, or its errors
+
+    .. warning:: Raises ``BadUrl`` or ``BadSelector`` like ``screamshot.generate_bytes_img``
+    """
+    if viewports:
+        width, height = viewports[0]['width'], viewports[0]['height']
+    page = await browser.newPage()
+    try:
+        await _setup_page(page, width=width, height=height, credentials=credentials,
+                          session=session)
+        _track_requests(page, resource_stats=resource_stats)
+        if blocking:
+            await _setup_blocking(page, url, blocking, blocking_stats=blocking_stats)
+            if not credentials or session is not None:
+                # The interception disables the browser cache
+                await page.setCacheEnabled(True)
+        await _navigate(page, url, wait_until=wait_until, wait_for=wait_for)
+        if session is not None:
+            session.cookies = await page.cookies()
+        if selectors:
+            return await _capture_selectors(page, selectors)
+        if viewports:
+            return await _capture_viewports(page, viewports, selector=selector,
+                                            full_page=full_page, max_height=max_height)
+        if full_page or tiles:
+            return await _capture_full_page(page, max_height, tiles=tiles)
+        return await _capture(page, selector=selector)
+    finally:
+        await page.close()
@@ -1,22 +1,88 @@
 """
 Contains all the serializers.
 """
-from sys import exc_info
-from tempfile import NamedTemporaryFile
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from io import BytesIO
+from json import dumps, loads
+from sys import exc_info
 
-from flask import jsonify, send_file
+from flask import Response, jsonify
 
-from PIL.Image import open as image_opener
+from PIL import Image
 
-from screamshot import generate_bytes_img_wrap
 from screamshot.errors import BadUrl, BadSelector
 
+from . import settings
+from .admission import render_slot
+from .archive import iter_archive_json, stream_zip
+from .blocking import (AUTHORIZED_RESOURCE_TYPES, BLOCK_PROFILES, DOMAIN_PATTERN_REGEX,
+                       BlockingStats, normalize_domain)
+from .browser_pool import render_wrap
+from .cache import cache_key, get_screenshot_cache
+from .coalescing import get_coalescer
+from .compare import BASELINE_KEY_REGEX, compare_images, get_baseline_store, image_size
+from .conditional import content_etag, get_phash_cache, hamming_distance, parse_etags
+from .metrics import ERRORS, IMAGE_SIZE, RENDERS_IN_FLIGHT, server_timing, time_stage
+from .renderer import DEFAULT_VIEWPORT, ResourceCacheStats
+from .streaming import SpooledBody
+from .transforms import AUTHORIZED_FIT_VALUE, AUTHORIZED_FORMAT_VALUE, MIMETYPES, transform_image
+
 
 AUTHORIZED_WAIT_UNTIL_VALUE = [
     'load', 'domcontentloaded', 'networkidle0', 'networkidle2']
 SCREAMSHOT_PARAMETERS = ['width', 'height',
-                         'wait_until', 'credentials', 'selector', 'wait_for']
+                         'wait_until', 'credentials', 'selector', 'wait_for',
+                         'full_page', 'tiles', 'max_height',
+                         'block_profile', 'block_types', 'block_domains', 'allow_domains']
+ARCHIVE_PARAMETERS = ['tiles', 'viewports', 'selectors']
+TRUE_VALUES = [True, 'true', '1', 'yes', 'on']
+FALSE_VALUES = [False, 'false', '0', 'no', 'off', '']
+AUTHORIZED_CACHE_VALUE = ['use', 'bypass', 'refresh']
+AUTHORIZED_OUTPUT_VALUE = ['zip', 'json']
+TRANSFORM_PARAMETERS = ['format', 'quality', 'compress_level', 'thumbnail_width',
+                        'thumbnail_height', 'fit']
+OPTION_PARAMETERS = ['cache', 'output', 'perceptual_threshold'] + TRANSFORM_PARAMETERS
+# The lookups of the validation, compiled once
+_PARAMETER_KINDS = dict([(key, 'data') for key in SCREAMSHOT_PARAMETERS]
+                        + [(key, 'options') for key in OPTION_PARAMETERS])
+_WAIT_UNTIL_VALUES = frozenset(AUTHORIZED_WAIT_UNTIL_VALUE)
+_RESOURCE_TYPES = frozenset(AUTHORIZED_RESOURCE_TYPES)
+_TRUE_VALUES = frozenset(TRUE_VALUES)
+_FALSE_VALUES = frozenset(FALSE_VALUES)
+_CACHE_VALUES = frozenset(AUTHORIZED_CACHE_VALUE)
+_OUTPUT_VALUES = frozenset(AUTHORIZED_OUTPUT_VALUE)
+_FORMAT_VALUES = frozenset(AUTHORIZED_FORMAT_VALUE)
+_FIT_VALUES = frozenset(AUTHORIZED_FIT_VALUE)
+
+
+def collapse_values(values):
+    """
+    :param values: mandatory, the parameters of a form, each with the list of its values
+    :type values: dict
+
+    :return: the parameters, a list of a single value being replaced by that value
+    :retype: dict
+    """
+    return {key: value[0] if isinstance(value, list) and len(value) == 1 else value
+            for key, value in values.items()}
+
+
+def parse_bool(value):
+    """
+    :return: ``True`` or ``False`` for the boolean values of a form, ``None`` otherwise
+    :retype: bool
+    """
+    if isinstance(value, str):
+        value = value.lower()
+    elif isinstance(value, (list, dict)):
+        return None
+    if value in _TRUE_VALUES:
+        return True
+    if value in _FALSE_VALUES:
+        return False
+    return None
 
 
 class ScreenshotSerializer():
@@ -26,55 +92,136 @@ class ScreenshotSerializer():
     :attributes:
     * raw_data (**dict**): the data given to initialize the serializer
     * data (**dict**): the parse and validated data
+    * options (**dict**): the parse and validated options, they change how the screenshot is \
+        served but not the screenshot itself
     * errors (**list**): all the errors
     * bytes_img (**bytes**): the screenshot
+    * cache_status (**str**): ``HIT``, ``MISS``, ``BYPASS`` or ``REFRESH`` once the screenshot \
+        was looked up in the cache
+    * coalesced (**bool**): ``True`` if the screenshot was shared with an identical request
+    * timings (**dict**): the duration in seconds of each stage of the request
+    * transform (**dict**): the validated transform options, given to ``transform_image``, \
+        the PNG bytes are sent untouched when it is empty
+    * blocking_stats (**BlockingStats**): the requests of the page blocked while the screenshot \
+        was taken
+    * resource_stats (**ResourceCacheStats**): the responses of the page served by the browser \
+        cache while the screenshot was taken
 
     .. warning:: ``data = dict()`` before calling ``is_valid``
     .. warning:: ``bytes_img = None`` before calling ``get_object``
     """
+    __slots__ = ['url', 'raw_data', 'data', 'options', 'errors', 'bytes_img', 'valid',
+                 'cache_status', 'coalesced', 'transform', 'timings', 'blocking_stats',
+                 'resource_stats', '_cache_key']
+
     def __init__(self, url, raw_data=None):
         # Public attributes
         self.url = url
         self.raw_data = raw_data if raw_data else {}
         self.data = dict()
+        self.options = dict()
         self.errors = []
         self.bytes_img = None
         self.valid = None
+        self.cache_status = None
+        self.coalesced = False
+        self.transform = dict()
+        self.timings = dict()
+        self.blocking_stats = BlockingStats()
+        self.resource_stats = ResourceCacheStats()
+        self._cache_key = None
 
     def _parse_raw_data(self):
         for key, val in self.raw_data.items():
-            if key in SCREAMSHOT_PARAMETERS:
+            kind = _PARAMETER_KINDS.get(key)
+            if kind == 'data':
                 self.data[key] = val
+            elif kind == 'options':
+                self.options[key] = val
             else:
                 self.errors.append('Unknown parameter: "{0}"'.format(key))
 
-    def _validate_window_sizes(self):
-        str_width = self.data.get('width')
-        if str_width:
+    def _parse_sizes(self, key):
+        str_sizes = self.data.get(key)
+        if not isinstance(str_sizes, list):
+            str_sizes = [str_sizes]
+        if not all(str_size is None or isinstance(str_size, (str, int))
+                   and not isinstance(str_size, bool) for str_size in str_sizes):
+            sizes = None
+        else:
             try:
-                self.data['width'] = int(str_width)
+                sizes = [None if str_size is None or str_size == '' else int(str_size)
+                         for str_size in str_sizes]
             except ValueError as _:
-                self.errors.append('Bad width')
+                sizes = None
+        if sizes is None or any(size is not None and size < 1 for size in sizes):
+            self.errors.append('Bad {0}'.format(key))
+            return None
+        return sizes
 
-        str_height = self.raw_data.get('height')
-        if str_height:
-            try:
-                self.data['height'] = int(str_height)
-            except ValueError as _:
-                self.errors.append('Bad height')
+    def _validate_window_sizes(self):
+        widths = self._parse_sizes('width')
+        heights = self._parse_sizes('height')
+        if widths is None or heights is None:
+            return
+        if not isinstance(self.data.get('width'), list) and \
+                not isinstance(self.data.get('height'), list):
+            for key, size in (('width', widths[0]), ('height', heights[0])):
+                if size is None:
+                    self.data.pop(key, None)
+                else:
+                    self.data[key] = size
+            return
+
+        count = max(len(widths), len(heights))
+        if len(widths) not in (1, count) or len(heights) not in (1, count):
+            self.errors.append('Bad viewports: as many widths as heights must be given')
+            return
+        if count > settings.MAX_CAPTURES:
+            self.errors.append('Too many viewports: the maximum is {0}'.format(
+                settings.MAX_CAPTURES))
+            return
+        widths, heights = widths * (count // len(widths)), heights * (count // len(heights))
+        self.data['viewports'] = [
+            {'width': width or DEFAULT_VIEWPORT['width'],
+             'height': height or DEFAULT_VIEWPORT['height']}
+            for width, height in zip(widths, heights)]
+        self.data.pop('width', None)
+        self.data.pop('height', None)
 
     def _validate_wait_until(self):
         wait_until = self.data.get('wait_until')
-        if wait_until:
-            valid_wait_until = all(
-                [e in AUTHORIZED_WAIT_UNTIL_VALUE for e in wait_until])
-            if not valid_wait_until:
-                self.errors.append('Bad wait_until value')
+        if not wait_until:
+            return
+        values = wait_until.split(',') if isinstance(wait_until, str) else wait_until
+        if not isinstance(values, list) or not all(
+                isinstance(value, str) and value in _WAIT_UNTIL_VALUES for value in values):
+            self.errors.append('Bad wait_until value')
+            return
+        # The page waits for all the events, in any order
+        values = sorted(set(values))
+        self.data['wait_until'] = values[0] if len(values) == 1 else values
 
     def _validate_credentials(self):
         credentials = self.data.get('credentials')
+        if isinstance(credentials, str) and credentials:
+            # A form sends the credentials as a json object
+            try:
+                credentials = loads(credentials)
+            except ValueError as _:
+                credentials = None
+            if not isinstance(credentials, dict):
+                self.errors.append('Bad credentials: a json object must be given')
+                return
+            self.data['credentials'] = credentials
         if credentials:
-            if 'username' in credentials and 'password' not in credentials:
+            if not isinstance(credentials, dict):
+                self.errors.append('Bad credentials: a json object must be given')
+            elif not all(isinstance(key, str) and isinstance(value, bool if key == 'token_in_header'
+                                                             else str)
+                         for key, value in credentials.items()):
+                self.errors.append('Bad credentials: the values must be strings')
+            elif 'username' in credentials and 'password' not in credentials:
                 self.errors.append(
                     'Bad credentials: a password must be specified')
             elif 'password' in credentials and 'username' not in credentials:
@@ -85,6 +232,157 @@ class ScreenshotSerializer():
                 self.errors.append(
                     'Bad credentials: "token_in_header" must be specified')
 
+    def _validate_cache(self):
+        cache = self.options.get('cache')
+        if cache and not (isinstance(cache, str) and cache in _CACHE_VALUES):
+            self.errors.append('Bad cache value')
+
+    def _validate_int_option(self, key, minimum, maximum=None, values=None):
+        str_value = (self.options if values is None else values).get(key)
+        if str_value is None or str_value == '':
+            return None
+        # A form field given several times or a json value of another type is refused
+        value = None
+        if isinstance(str_value, (str, int)) and not isinstance(str_value, bool):
+            try:
+                value = int(str_value)
+            except ValueError as _:
+                pass
+        if value is None or value < minimum or (maximum is not None and value > maximum):
+            self.errors.append('Bad {0}'.format(key))
+            return None
+        return value
+
+    def _validate_transform(self):
+        image_format = self.options.get('format')
+        if image_format:
+            if isinstance(image_format, str) and image_format.lower() in _FORMAT_VALUES:
+                self.transform['image_format'] = image_format.lower()
+            else:
+                self.errors.append('Bad format value')
+
+        fit = self.options.get('fit')
+        if fit:
+            if isinstance(fit, str) and fit in _FIT_VALUES:
+                self.transform['fit'] = fit
+            else:
+                self.errors.append('Bad fit value')
+
+        for key, transform_key, minimum, maximum in (
+                ('quality', 'quality', 1, 100),
+                ('compress_level', 'compress_level', 0, 9),
+                ('thumbnail_width', 'width', 1, settings.THUMBNAIL_MAX_SIZE),
+                ('thumbnail_height', 'height', 1, settings.THUMBNAIL_MAX_SIZE)):
+            value = self._validate_int_option(key, minimum, maximum)
+            if value is not None:
+                self.transform[transform_key] = value
+
+        if self.transform.get('image_format') == 'png':
+            del self.transform['image_format']
+        if list(self.transform) == ['fit']:
+            del self.transform['fit']
+
+    def _validate_selectors(self):
+        wait_for = self.data.get('wait_for')
+        if wait_for and not isinstance(wait_for, str):
+            self.errors.append('Bad wait_for')
+        selectors = self.data.get('selector')
+        if selectors and not isinstance(selectors, (str, list)):
+            self.errors.append('Bad selector')
+        if not isinstance(selectors, list):
+            return
+        if not selectors or not all(selector and isinstance(selector, str)
+                                    for selector in selectors):
+            self.errors.append('Bad selector')
+        elif len(selectors) > settings.MAX_CAPTURES:
+            self.errors.append('Too many selectors: the maximum is {0}'.format(
+                settings.MAX_CAPTURES))
+        elif self.data.get('viewports'):
+            self.errors.append('Bad selector: a single viewport must be given')
+        else:
+            self.data['selectors'] = self.data.pop('selector')
+
+    def _validate_full_page(self):
+        for key in ('full_page', 'tiles'):
+            if key in self.data:
+                value = parse_bool(self.data.pop(key))
+                if value is None:
+                    self.errors.append('Bad {0} value'.format(key))
+                elif value:
+                    self.data[key] = True
+
+        max_height = self._validate_int_option('max_height', 1, settings.FULL_PAGE_MAX_HEIGHT,
+                                               values=self.data)
+        self.data.pop('max_height', None)
+        if not self.data.get('full_page') and not self.data.get('tiles'):
+            if max_height:
+                self.errors.append('Bad max_height: full_page or tiles must be specified')
+            return
+        self.data['max_height'] = max_height if max_height else settings.FULL_PAGE_MAX_HEIGHT
+        if self.data.get('selector') or self.data.get('selectors'):
+            self.errors.append('Bad full_page: a selector cannot be specified')
+        if self.data.get('tiles') and self.data.get('viewports'):
+            self.errors.append('Bad tiles: a single viewport must be given')
+
+    def _parse_list(self, key):
+        values = self.data.pop(key, None)
+        if not isinstance(values, list):
+            values = [values] if values else []
+        items = []
+        for value in values:
+            if not isinstance(value, str):
+                return None
+            items.extend(item.strip() for item in value.split(',') if item.strip())
+        return items
+
+    def _validate_blocking(self):
+        profile = self.data.pop('block_profile', None) or settings.BLOCK_PROFILE
+        blocking = {}
+        if profile:
+            if isinstance(profile, str) and profile in BLOCK_PROFILES:
+                blocking = dict(BLOCK_PROFILES[profile])
+            else:
+                self.errors.append('Bad block_profile value')
+
+        for key, blocking_key in (('block_types', 'types'), ('block_domains', 'deny'),
+                                  ('allow_domains', 'allow')):
+            values = self._parse_list(key)
+            if values is None:
+                valid = False
+            elif blocking_key == 'types':
+                valid = all(value in _RESOURCE_TYPES for value in values)
+            else:
+                valid = all(DOMAIN_PATTERN_REGEX.match(value) for value in values)
+            if not valid:
+                self.errors.append('Bad {0} value'.format(key))
+            elif values:
+                if blocking_key != 'types':
+                    values = [normalize_domain(value) for value in values]
+                blocking[blocking_key] = blocking.get(blocking_key, []) + values
+
+        if blocking.get('types') or blocking.get('deny') or blocking.get('first_party_only'):
+            for blocking_key in ('types', 'deny', 'allow'):
+                if blocking.get(blocking_key):
+                    blocking[blocking_key] = sorted(set(blocking[blocking_key]))
+            self.data['blocking'] = blocking
+
+    def _validate_perceptual_threshold(self):
+        threshold = self._validate_int_option('perceptual_threshold', 0, 64)
+        self.options.pop('perceptual_threshold', None)
+        if threshold is not None:
+            self.options['perceptual_threshold'] = threshold
+
+    def _validate_archive(self):
+        archive_keys = [key for key in ARCHIVE_PARAMETERS if self.data.get(key)]
+        if archive_keys and self.transform:
+            self.errors.append('Bad {0}: the images of an archive cannot be transformed'.format(
+                archive_keys[0]))
+        output = self.options.get('output')
+        if output and not (isinstance(output, str) and output in _OUTPUT_VALUES):
+            self.errors.append('Bad output value')
+        elif output == 'json' and not archive_keys:
+            self.errors.append('Bad output: only an archive can be sent as json')
+
     def is_valid(self):
         """
         This class method parses the data and checks wether the given parameters are valid.
@@ -95,62 +393,538 @@ class ScreenshotSerializer():
             defined in the ``data`` dict attribute
         .. info:: The ``data`` attribute has the following structure: \
             ``{'url': ..., 'opt_param': {...}}``
+        .. info:: The parameters are validated once, the next calls return the same result
         """
-        self._parse_raw_data()
-        self._validate_window_sizes()
-        self._validate_credentials()
-        self._validate_wait_until()
+        if self.valid is not None:
+            return self.valid
+        with time_stage(self.timings, 'validate'):
+            self._parse_raw_data()
+            self._validate_window_sizes()
+            self._validate_credentials()
+            self._validate_wait_until()
+            self._validate_blocking()
+            self._validate_cache()
+            self._validate_perceptual_threshold()
+            self._validate_transform()
+            self._validate_selectors()
+            self._validate_full_page()
+            self._validate_archive()
         if self.errors:
             self.valid = False
+            ERRORS.inc(type='validation')
         else:
             self.valid = True
         return self.valid
 
     def get_object(self):
         """
-        This class method calls ``generate_bytes_img_wrap`` function
+        This class method takes the screenshot in the browser pool of the worker with the \
+            ``render_wrap`` function
 
         :return: an image in the ``bytes`` object format if ``data`` is valid and ``None`` otherwise
 
         .. info:: If ``is_valid`` was not called, it will call it first
         .. info:: The image is saved in the ``bytes_img`` attribute
+        .. info:: The screenshot cache is looked up first, unless the ``cache`` option is \
+            ``bypass`` (neither read nor written) or ``refresh`` (written but not read)
+        .. info:: Identical requests in flight at the same time share one screenshot, with \
+            ``bypass`` or ``refresh`` only a screenshot in flight when the request arrives is \
+            shared
+        .. warning:: Raises ``AdmissionError`` if the screenshot is refused by the render gate
         """
         if not self.valid:
             self.is_valid()
-        if self.valid:
+        if self.valid and self.get_cached_object() is None:
+            bytes_img, coalesced = None, False
             try:
-                self.bytes_img = generate_bytes_img_wrap(self.url, **self.data)
+                with time_stage(self.timings, 'render'):
+                    bytes_img, coalesced = get_coalescer().do(
+                        self.cache_key(), partial(self._render, self.url, **self.render_kwargs()),
+                        fresh=self.options.get('cache') in ('bypass', 'refresh'))
             except (BadUrl, BadSelector) as exc:
                 _, ex_value, _ = exc_info()
                 self.errors.append(str(ex_value))
+                ERRORS.inc(type=exc.__class__.__name__)
+            self.set_object(bytes_img, coalesced=coalesced)
+        return self.bytes_img
+
+    def render_kwargs(self):
+        """
+        :return: the parameters of the renderer, the validated data, the ``resource_stats`` and \
+            the ``blocking_stats`` when some requests are blocked
+        :retype: dict
+        """
+        kwargs = dict(self.data, resource_stats=self.resource_stats)
+        if self.data.get('blocking'):
+            kwargs['blocking_stats'] = self.blocking_stats
+        return kwargs
+
+    @staticmethod
+    def _render(url, **kwargs):
+        with render_slot(), RENDERS_IN_FLIGHT.track():
+            return render_wrap(url, **kwargs)
+
+    def get_cached_object(self):
+        """
+        This class method looks the screenshot up in the cache, unless the ``cache`` option is \
+            ``bypass`` or ``refresh``
+
+        :return: the image in the ``bytes`` object format or ``None`` if it is not in the cache
+
+        .. warning:: The data must have been validated
+        """
+        if (self.options.get('cache') or 'use') != 'use':
+            return None
+        with time_stage(self.timings, 'cache'):
+            self.bytes_img = get_screenshot_cache().get(self.cache_key())
+        if self.bytes_img:
+            self.cache_status = 'HIT'
         return self.bytes_img
 
+    def set_object(self, bytes_img, coalesced=False):
+        """
+        This class method saves a screenshot taken for this serializer in the ``bytes_img`` \
+            attribute and in the cache, unless the ``cache`` option is ``bypass``
+
+        :param bytes_img: mandatory, the image or ``None`` if the screenshot failed
+        :type bytes_img: bytes
+
+        :param coalesced: optional, ``True`` if the screenshot was shared with another request
+        :type coalesced: bool
+        """
+        mode = self.options.get('cache') or 'use'
+        self.bytes_img = bytes_img
+        self.coalesced = coalesced
+        if bytes_img and mode != 'bypass':
+            get_screenshot_cache().set(self.cache_key(), bytes_img)
+        self.cache_status = {'use': 'MISS', 'bypass': 'BYPASS', 'refresh': 'REFRESH'}[mode]
+
+    def cache_key(self):
+        """
+        :return: the key of the screenshot in the cache, the coalescing and the pre-warming, a \
+            hash of the url and of the validated data computed once, the same for the requests \
+            of the same screenshot whatever the order and the form of their parameters
+        :retype: str
+
+        .. warning:: The data must have been validated
+        """
+        if self._cache_key is None:
+            self._cache_key = cache_key(self.url, self.data)
+        return self._cache_key
+
+    def response_headers(self):
+        """
+        :return: the headers describing how the screenshot was obtained, ``X-Cache``, \
+            ``X-Coalesced``, ``Server-Timing`` and the headers of ``BlockingStats`` and \
+            ``ResourceCacheStats``
+        :retype: dict
+        """
+        headers = self.blocking_stats.headers()
+        headers.update(self.resource_stats.headers())
+        if self.timings:
+            headers['Server-Timing'] = server_timing(self.timings)
+        if self.cache_status:
+            headers['X-Cache'] = self.cache_status
+        if self.coalesced:
+            headers['X-Coalesced'] = 'true'
+        return headers
+
+    def get_output(self, bytes_obj):
+        """
+        This class method applies the ``transform`` options to an image
+
+        :param bytes_obj: mandatory, the screenshot
+        :type bytes_obj: bytes
+
+        :return: the image to send, as ``bytes`` or as a ``SpooledBody``, and its mimetype
+        :retype: tuple
+
+        .. info:: Without ``transform``, the screenshot is returned as it is
+        .. info:: The zip archive of the ``tiles`` mode, of several viewports or of several \
+            selectors is returned as it is, or converted into a json list with the ``output`` \
+            option, written in a ``SpooledBody`` of ``SPOOL_MAX_SIZE`` bytes in memory
+        .. info:: The transformed image is cached like the screenshot, according to the \
+            ``cache`` option
+        """
+        if any(self.data.get(key) for key in ARCHIVE_PARAMETERS):
+            if self.options.get('output') == 'json':
+                return (SpooledBody(iter_archive_json(bytes_obj), settings.SPOOL_MAX_SIZE),
+                        'application/json')
+            return bytes_obj, 'application/zip'
+        if not self.transform:
+            return bytes_obj, 'image/png'
+        mimetype = MIMETYPES[self.transform.get('image_format', 'png')]
+        cache = get_screenshot_cache()
+        key = cache_key(self.cache_key(), self.transform)
+        mode = self.options.get('cache') or 'use'
+        output = cache.get(key) if mode == 'use' else None
+        if output is None:
+            with time_stage(self.timings, 'encode'):
+                output = transform_image(bytes_obj, **self.transform)
+            if mode != 'bypass':
+                cache.set(key, output)
+        return output, mimetype
+
+    def conditional_headers(self, output, mimetype, if_none_match=None):
+        """
+        This class method computes the validators of the image sent and compares them with the \
+            versions held by the client
+
+        :param output: mandatory, the image to send
+        :type output: bytes
+
+        :param mimetype: mandatory, its mimetype
+        :type mimetype: str
+
+        :param if_none_match: optional, the ``If-None-Match`` header of the request
+        :type if_none_match: str
+
+        :return: the ``ETag`` and ``X-Perceptual-Hash`` headers, and ``True`` if the version of \
+            the client can be kept, the ``ETag`` header being then the one of that version
+        :retype: tuple
+
+        .. info:: With the ``perceptual_threshold`` option, the version of the client is kept \
+            when the hamming distance between its perceptual hash and the one of the image is \
+            at most the threshold, if that version was sent by this worker recently
+        """
+        etag = content_etag(output)
+        headers = {'ETag': '"{0}"'.format(etag)}
+        phash = None
+        if mimetype.startswith('image/'):
+            with time_stage(self.timings, 'hash'):
+                try:
+                    phash = get_phash_cache().hash(etag, output)
+                except (OSError, ValueError) as _:
+                    pass
+        if phash:
+            headers['X-Perceptual-Hash'] = phash
+        client_etags = parse_etags(if_none_match)
+        if etag in client_etags or '*' in client_etags:
+            return headers, True
+        threshold = self.options.get('perceptual_threshold')
+        if threshold is not None and phash:
+            for client_etag in client_etags:
+                client_phash = get_phash_cache().get(client_etag)
+                if client_phash is not None and hamming_distance(phash, client_phash) <= threshold:
+                    headers['ETag'] = '"{0}"'.format(client_etag)
+                    headers['X-Perceptual-Distance'] = str(hamming_distance(phash, client_phash))
+                    return headers, True
+        return headers, False
+
     @staticmethod
-    def _generic_serializer(temp_file, bytes_obj):
-        img_buf = BytesIO(bytes_obj)
-        img = image_opener(img_buf)
-        img.save(temp_file)
-        return send_file(temp_file.name, attachment_filename='screenshot.png')
+    def _generic_serializer(bytes_obj, mimetype='image/png'):
+        if isinstance(bytes_obj, SpooledBody):
+            response = Response(bytes_obj.chunks(settings.STREAM_CHUNK_SIZE), mimetype=mimetype)
+            response.call_on_close(bytes_obj.close)
+            response.headers['Content-Length'] = str(len(bytes_obj))
+        else:
+            response = Response(bytes_obj, mimetype=mimetype)
+        response.headers['Content-Disposition'] = 'inline; filename=screenshot.{0}'.format(
+            mimetype.split('/')[1])
+        return response
 
-    def serialize(self, bytes_obj=None):
+    def serialize(self, bytes_obj=None, if_none_match=None):
         """
         This class method creates a ``Response`` object
 
         :param bytes_obj: optional, the image to send
         :type bytes_obj: bytes
 
-        :return: a png image with 200 status code if there is no errors or a json with a 400 \
+        :param if_none_match: optional, the ``If-None-Match`` header of the request
+        :type if_none_match: str
+
+        :return: an image with 200 status code if there is no errors or a json with a 400 \
             status code otherwise
 
         .. info:: If there are any errors, the JSON has the following structure: \
             ``{'errors': [...]}``
         .. info:: If ``get_object`` was not called, it will call it first \
             (if no ``bytes_object`` was given)
+        .. info:: The ``X-Cache`` header tells whether the screenshot came from the cache, \
+            the ``X-Coalesced`` header whether it was shared with an identical request and the \
+            ``Server-Timing`` header gives the duration of each stage
+        .. info:: The PNG bytes are sent straight from memory, the image is only decoded and \
+            re-encoded when a ``transform`` is requested
+        .. info:: The images are sent as one in-memory body, the json archives are built and \
+            streamed by chunks of ``STREAM_CHUNK_SIZE`` bytes, from a temporary file only when \
+            they exceed ``SPOOL_MAX_SIZE`` bytes
+        .. info:: The response carries the headers of ``conditional_headers``, it is empty with \
+            a 304 status code when the version of the client can be kept
         """
-        temp_file = NamedTemporaryFile(suffix='.png')
+        if not bytes_obj:
+            self.get_object()
+            bytes_obj = self.bytes_img
         if bytes_obj:
-            return self._generic_serializer(temp_file, bytes_obj)
-        self.get_object()
-        if self.bytes_img:
-            return self._generic_serializer(temp_file, self.bytes_img)
+            output, mimetype = self.get_output(bytes_obj)
+            headers, not_modified = self.conditional_headers(output, mimetype, if_none_match)
+            if not_modified:
+                if isinstance(output, SpooledBody):
+                    output.close()
+                response = Response(status=304)
+            else:
+                IMAGE_SIZE.observe(len(output), format=mimetype.split('/')[1])
+                response = self._generic_serializer(output, mimetype)
+            headers.update(self.response_headers())
+            for name, value in headers.items():
+                response.headers[name] = value
+            return response
+        return jsonify({'errors': self.errors}), 400
+
+
+class BatchScreenshotSerializer():
+    """
+    Serializer linked to a batch of screenshots.
+
+    :attributes:
+    * raw_data (**list**): the specs given to initialize the serializer, dicts with a mandatory \
+        ``url`` key and the parameters accepted by ``ScreenshotSerializer``
+    * serializers (**list**): a ``ScreenshotSerializer`` per spec
+    * errors (**list**): all the errors
+    * concurrency (**int**): the maximum number of screenshots taken at the same time
+
+    .. warning:: ``serializers = []`` before calling ``is_valid``
+    """
+    def __init__(self, raw_data, concurrency=None):
+        # Public attributes
+        self.raw_data = raw_data
+        self.serializers = []
+        self.errors = []
+        self.concurrency = concurrency if concurrency else settings.BATCH_CONCURRENCY
+        self.valid = None
+
+    def _validate_spec(self, index, spec):
+        if not isinstance(spec, dict) or not spec.get('url'):
+            self.errors.append('Spec {0}: No url'.format(index))
+            return
+        if not isinstance(spec['url'], str):
+            self.errors.append('Spec {0}: Bad url'.format(index))
+            return
+        spec = dict(spec)
+        serializer = ScreenshotSerializer(spec.pop('url'), raw_data=spec)
+        if not serializer.is_valid():
+            self.errors.extend(['Spec {0}: {1}'.format(index, error)
+                                for error in serializer.errors])
+        self.serializers.append(serializer)
+
+    def is_valid(self):
+        """
+        This class method checks that the specs are a list and validates each of them with the \
+            ``ScreenshotSerializer`` rules.
+
+        :return: ``True`` if there is no error and ``False`` otherwise
+        """
+        if not isinstance(self.raw_data, list) or not self.raw_data:
+            self.errors.append('Specs must be a non-empty list')
+        elif len(self.raw_data) > settings.BATCH_MAX_SPECS:
+            self.errors.append('Too many specs: the maximum is {0}'.format(
+                settings.BATCH_MAX_SPECS))
+        else:
+            for index, spec in enumerate(self.raw_data):
+                self._validate_spec(index, spec)
+        self.valid = not self.errors
+        return self.valid
+
+    def get_objects(self):
+        """
+        This generator takes the screenshots, ``concurrency`` at a time, and yields the \
+            ``(index, serializer)`` pairs as soon as each screenshot is taken
+
+        .. info:: An unexpected exception is added to the errors of the serializer instead of \
+            stopping the batch
+        .. info:: When the generator is closed early, the client gone, the screenshots not \
+            started yet are cancelled and the running ones are not waited for
+        """
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        futures = {}
+        try:
+            for index, serializer in enumerate(self.serializers):
+                futures[executor.submit(serializer.get_object)] = index
+            for future in as_completed(futures):
+                serializer = self.serializers[futures[future]]
+                try:
+                    future.result()
+                except Exception as exc:  # pylint: disable=broad-except
+                    serializer.errors.append(str(exc))
+                yield futures[future], serializer
+        finally:
+            # cancel_futures of shutdown needs python 3.9
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _entries(self):
+        manifest = []
+        for index, serializer in self.get_objects():
+            entry = {'index': index, 'url': serializer.url}
+            if serializer.bytes_img:
+                output, mimetype = serializer.get_output(serializer.bytes_img)
+                entry['file'] = '{0:04d}.{1}'.format(index, mimetype.split('/')[1])
+                entry['cache'] = serializer.cache_status
+                yield entry['file'], output
+            else:
+                entry['errors'] = serializer.errors
+            manifest.append(entry)
+        manifest.sort(key=lambda entry: entry['index'])
+        yield 'manifest.json', dumps(manifest).encode('utf-8')
+
+    def serialize(self):
+        """
+        This class method creates a ``Response`` object
+
+        :return: a zip archive streamed with a 200 status code if the specs are valid or a json \
+            with a 400 status code otherwise
+
+        .. info:: The archive contains a ``<index>.<format>`` image per screenshot, in the order \
+            they are taken, and a ``manifest.json`` file listing for each spec its url and its \
+            image or its errors
+        """
+        if self.valid is None:
+            self.is_valid()
+        if not self.valid:
+            return jsonify({'errors': self.errors}), 400
+        response = Response(stream_zip(self._entries()), mimetype='application/zip')
+        response.headers['Content-Disposition'] = 'attachment; filename=screenshots.zip'
+        return response
+
+
+class CompareSerializer():
+    """
+    Serializer comparing a screenshot with a baseline image.
+
+    :attributes:
+    * screenshot (**ScreenshotSerializer**): the serializer of the screenshot, it gets the \
+        parameters that are not specific to the comparison
+    * baseline (**bytes**): the uploaded baseline image
+    * baseline_key (**str**): the key of the stored baseline image, an uploaded baseline is \
+        stored under it
+    * update_baseline (**bool**): ``True`` to store the screenshot as the new baseline
+    * diff_image (**bool**): ``True`` to return the highlighted diff image
+    * tolerance (**int**): a pixel is changed when one of its channels differs by more than \
+        this value
+    * errors (**list**): all the errors
+    * result (**dict**): the comparison once ``serialize`` was called
+
+    .. warning:: ``result = None`` before calling ``serialize``
+    """
+    def __init__(self, url, raw_data=None, baseline=None):
+        raw_data = dict(raw_data) if raw_data else {}
+        # Public attributes
+        self.baseline = baseline
+        self.baseline_key = raw_data.pop('baseline_key', None)
+        self.update_baseline = raw_data.pop('update_baseline', False)
+        self.diff_image = raw_data.pop('diff_image', False)
+        self.tolerance = raw_data.pop('tolerance', 16)
+        self.screenshot = ScreenshotSerializer(url, raw_data=raw_data)
+        self.errors = []
+        self.valid = None
+        self.result = None
+
+    def _validate_flags(self):
+        for key in ('update_baseline', 'diff_image'):
+            value = parse_bool(getattr(self, key))
+            if value is None:
+                self.errors.append('Bad {0} value'.format(key))
+            setattr(self, key, bool(value))
+        try:
+            self.tolerance = int(self.tolerance)
+        except (TypeError, ValueError) as _:
+            self.tolerance = None
+        if self.tolerance is None or not 0 <= self.tolerance <= 255:
+            self.errors.append('Bad tolerance')
+
+    def _validate_baseline(self):
+        if self.baseline_key is not None and not (
+                isinstance(self.baseline_key, str) and BASELINE_KEY_REGEX.match(self.baseline_key)):
+            self.errors.append('Bad baseline_key')
+            return
+        if self.baseline is not None:
+            try:
+                Image.open(BytesIO(self.baseline)).verify()
+            except Exception as _:  # pylint: disable=broad-except
+                self.errors.append('Bad baseline: the file is not an image')
+                return
+            try:
+                image_size(self.baseline)
+            except ValueError as exc:
+                self.errors.append('Bad baseline: {0}'.format(exc))
+        elif not self.baseline_key:
+            self.errors.append('No baseline')
+        elif not self.update_baseline and not get_baseline_store().exists(self.baseline_key):
+            self.errors.append('Unknown baseline: "{0}"'.format(self.baseline_key))
+
+    def is_valid(self):
+        """
+        This class method validates the parameters of the screenshot with the \
+            ``ScreenshotSerializer`` rules and the parameters of the comparison
+
+        :return: ``True`` if there is no error and ``False`` otherwise
+        """
+        if not self.screenshot.is_valid():
+            self.errors.extend(self.screenshot.errors)
+        elif self.screenshot.transform or any(self.screenshot.data.get(key)
+                                              for key in ARCHIVE_PARAMETERS):
+            self.errors.append('Bad compare: only a png screenshot can be compared')
+        self._validate_flags()
+        self._validate_baseline()
+        self.valid = not self.errors
+        return self.valid
+
+    def compare(self):
+        """
+        This class method takes the screenshot, compares it with the baseline and updates the \
+            baseline store
+
+        :return: the result of ``compare_images``, the ``baseline_key`` and whether the \
+            ``baseline_updated``, or ``None`` if the screenshot failed
+        :retype: dict
+
+        .. info:: When there is no baseline yet and ``update_baseline`` is ``True``, the \
+            screenshot becomes the baseline and is not compared
+        .. warning:: Raises ``AdmissionError`` if the comparison is refused by the render gate
+        """
+        bytes_img = self.screenshot.get_object()
+        if not bytes_img:
+            self.errors.extend(self.screenshot.errors)
+            return None
+        store = get_baseline_store()
+        baseline = self.baseline
+        if baseline is None:
+            baseline = store.get(self.baseline_key)
+        elif self.baseline_key:
+            store.set(self.baseline_key, baseline)
+
+        self.result = {}
+        if baseline is not None:
+            # The comparison holds decoded images as large as a render, it takes a render slot
+            with render_slot(), time_stage(self.screenshot.timings, 'compare'):
+                try:
+                    self.result = compare_images(bytes_img, baseline, tolerance=self.tolerance,
+                                                 diff_image=self.diff_image)
+                except ValueError as exc:
+                    self.errors.append(str(exc))
+                    return None
+            if self.diff_image:
+                self.result['diff_image'] = b64encode(self.result['diff_image']).decode('ascii')
+        if self.baseline_key and (self.update_baseline or baseline is None):
+            store.set(self.baseline_key, bytes_img)
+            self.result['baseline_updated'] = True
+        self.result['baseline_key'] = self.baseline_key
+        return self.result
+
+    def serialize(self):
+        """
+        This class method creates a ``Response`` object
+
+        :return: the comparison as a json with a 200 status code if there is no errors or a \
+            json with a 400 status code otherwise
+
+        .. info:: The ``diff_image`` is a base64 encoded png image
+        """
+        if self.valid is None:
+            self.is_valid()
+        if self.valid and self.compare() is not None:
+            response = jsonify(self.result)
+            for name, value in self.screenshot.response_headers().items():
+                response.headers[name] = value
+            return response
         return jsonify({'errors': self.errors}), 400
@@ -0,0 +1,96 @@
+"""
+Contains the authenticated sessions.
+
+The screenshots taken with credentials are rendered in an incognito browser context of their own,
+kept warm and reused by the next screenshots taken with the same credentials: the HTTP
+authentication and the cookies of the site are not negotiated again, and the contexts of two
+different credentials never share a cookie, an authentication or a cached response.
+"""
+from collections import OrderedDict
+from hashlib import sha256
+from json import dumps
+from threading import Lock
+from time import monotonic
+
+
+def credentials_key(credentials):
+    """
+    :return: the hash of the ``credentials`` dict, the same credentials in any order give the \
+        same key
+    :retype: str
+    """
+    canonical = dumps(credentials, sort_keys=True, separators=(',', ':'), default=str)
+    return sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class Session():
+    """
+    The state kept between the screenshots taken with the same credentials.
+
+    :attributes:
+    * key (**str**): the hash of the credentials
+    * cookies (**list(dict)**): the cookies of the last page rendered, restored in the browser \
+        contexts opened for this session
+    * last_used (**float**): the monotonic time of the last screenshot
+    """
+    def __init__(self, key):
+        self.key = key
+        self.cookies = []
+        self.last_used = monotonic()
+
+
+class SessionStore():
+    """
+    Keeps the sessions of the credentials used recently.
+
+    :param idle_timeout: a session unused for this number of seconds is forgotten
+    :type idle_timeout: float
+
+    :param max_sessions: the maximum number of sessions, the least recently used one is \
+        forgotten beyond
+    :type max_sessions: int
+
+    .. info:: Only the hash of the credentials is kept, never the credentials themselves
+    """
+    def __init__(self, idle_timeout=300, max_sessions=32):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _expire(self, now):
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used < self.idle_timeout:
+                break
+            self._sessions.popitem(last=False)
+
+    def get(self, credentials):
+        """
+        :return: the session of ``credentials``, a new one if they were not used recently
+        :retype: Session
+        """
+        key = credentials_key(credentials)
+        now = monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.pop(key, None)
+            if session is None:
+                session = Session(key)
+                while len(self._sessions) >= self.max_sessions:
+                    self._sessions.popitem(last=False)
+            session.last_used = now
+            self._sessions[key] = session
+        return session
+
+    def is_alive(self, key):
+        """
+        :return: ``True`` if the session of ``key`` is still kept
+        :retype: bool
+        """
+        with self._lock:
+            self._expire(monotonic())
+            return key in self._sessions
@@ -0,0 +1,110 @@
+"""
+Contains all the settings.
+
+Each setting can be overridden by an environment variable of the same name prefixed with
+``SCREAMSHOT_``, e.g. ``SCREAMSHOT_BROWSER_POOL_SIZE=4 gunicorn src:app``.
+"""
+from os import environ
+
+
+def _get(name, default, cast=str):
+    value = environ.get('SCREAMSHOT_' + name)
+    if value is None:
+        return default
+    return cast(value)
+
+
+# Browser pool, one per worker process
+BROWSER_POOL_SIZE = _get('BROWSER_POOL_SIZE', 2, int)
+BROWSER_MAX_PAGES = _get('BROWSER_MAX_PAGES', 100, int)
+BROWSER_MAX_AGE = _get('BROWSER_MAX_AGE', 600, float)
+BROWSER_HEALTH_CHECK_TIMEOUT = _get('BROWSER_HEALTH_CHECK_TIMEOUT', 5, float)
+BROWSER_LAUNCH_ARGS = _get('BROWSER_LAUNCH_ARGS', [], str.split)
+
+# The disk caches of the page resources, one per pool slot of RESOURCE_CACHE_SIZE bytes at most,
+# an empty directory disables them
+RESOURCE_CACHE_DIR = _get('RESOURCE_CACHE_DIR', 'screamshot-resource-cache')
+RESOURCE_CACHE_SIZE = _get('RESOURCE_CACHE_SIZE', 100 * 1024 * 1024, int)
+
+# The authenticated sessions, the browser contexts of the MAX_SESSIONS credentials used last are
+# kept warm until SESSION_IDLE_TIMEOUT seconds without screenshot, 0 disables them
+SESSION_IDLE_TIMEOUT = _get('SESSION_IDLE_TIMEOUT', 300, float)
+MAX_SESSIONS = _get('MAX_SESSIONS', 32, int)
+
+# ASGI application
+RENDER_TIMEOUT = _get('RENDER_TIMEOUT', 30, float)
+
+# Full page screenshots, the page is cut below FULL_PAGE_MAX_HEIGHT CSS pixels
+FULL_PAGE_MAX_HEIGHT = _get('FULL_PAGE_MAX_HEIGHT', 16384, int)
+
+# The maximum number of images taken from one page load
+MAX_CAPTURES = _get('MAX_CAPTURES', 20, int)
+
+# The largest thumbnail_width and thumbnail_height, the images are never enlarged either
+THUMBNAIL_MAX_SIZE = _get('THUMBNAIL_MAX_SIZE', 4096, int)
+
+# The resource blocking profile of the requests that do not give one, none by default
+BLOCK_PROFILE = _get('BLOCK_PROFILE', '')
+
+# Screenshot cache, CACHE_DIR enables the on-disk tier shared by the workers
+CACHE_MAX_ENTRIES = _get('CACHE_MAX_ENTRIES', 256, int)
+CACHE_MAX_BYTES = _get('CACHE_MAX_BYTES', 64 * 2 ** 20, int)
+CACHE_TTL = _get('CACHE_TTL', 300, float)
+CACHE_DIR = _get('CACHE_DIR', None)
+CACHE_DISK_MAX_BYTES = _get('CACHE_DISK_MAX_BYTES', 512 * 2 ** 20, int)
+
+# The bodies built on the fly are streamed by chunks of STREAM_CHUNK_SIZE bytes, they are written in
+# a temporary file beyond SPOOL_MAX_SIZE bytes
+STREAM_CHUNK_SIZE = _get('STREAM_CHUNK_SIZE', 256 * 1024, int)
+SPOOL_MAX_SIZE = _get('SPOOL_MAX_SIZE', 32 * 1024 * 1024, int)
+
+# Perceptual hashes of the images sent, remembered by entity tag, the images of more than
+# PHASH_MAX_PIXELS pixels are not hashed, 0 disables the cap
+PHASH_CACHE_MAX_ENTRIES = _get('PHASH_CACHE_MAX_ENTRIES', 4096, int)
+PHASH_MAX_PIXELS = _get('PHASH_MAX_PIXELS', 16 * 2 ** 20, int)
+
+# Request coalescing, COALESCING_DIR enables the coalescing between the workers of the host
+COALESCING_DIR = _get('COALESCING_DIR', None)
+COALESCING_RESULT_TTL = _get('COALESCING_RESULT_TTL', 5, float)
+COALESCING_TIMEOUT = _get('COALESCING_TIMEOUT', 60, float)
+
+# Pre-warming, the PREWARM_TOP most requested screenshots and the pinned ones are taken again on
+# PREWARM_SCHEDULE, a number of seconds or a cron expression, empty disables it, the /api/prewarm
+# endpoints answer only to the requests sending PREWARM_ADMIN_KEY in PREWARM_ADMIN_KEY_HEADER,
+# empty disables them
+PREWARM_SCHEDULE = _get('PREWARM_SCHEDULE', '')
+PREWARM_TOP = _get('PREWARM_TOP', 10, int)
+PREWARM_MAX_TRACKED = _get('PREWARM_MAX_TRACKED', 1000, int)
+PREWARM_ADMIN_KEY = _get('PREWARM_ADMIN_KEY', '')
+PREWARM_ADMIN_KEY_HEADER = _get('PREWARM_ADMIN_KEY_HEADER', 'X-Admin-Key')
+
+# Batch screenshots
+BATCH_MAX_SPECS = _get('BATCH_MAX_SPECS', 500, int)
+BATCH_CONCURRENCY = _get('BATCH_CONCURRENCY', 4, int)
+
+# Asynchronous jobs, JOBS_STORE is either memory or sqlite
+JOBS_STORE = _get('JOBS_STORE', 'memory')
+JOBS_SQLITE_PATH = _get('JOBS_SQLITE_PATH', 'screamshot-jobs.sqlite3')
+JOBS_WORKERS = _get('JOBS_WORKERS', 2, int)
+JOBS_MAX_QUEUED = _get('JOBS_MAX_QUEUED', 100, int)
+JOBS_RESULT_TTL = _get('JOBS_RESULT_TTL', 600, float)
+JOBS_CALLBACK_TIMEOUT = _get('JOBS_CALLBACK_TIMEOUT', 10, float)
+
+# Visual comparison, the baselines are stored in BASELINES_DIR, shared by the workers, the images
+# wider than COMPARE_MAX_WIDTH or higher than FULL_PAGE_MAX_HEIGHT pixels are not compared
+BASELINES_DIR = _get('BASELINES_DIR', 'screamshot-baselines')
+COMPARE_MAX_WIDTH = _get('COMPARE_MAX_WIDTH', 4096, int)
+
+# Admission control, per worker process: MAX_RENDERS screenshots taken at the same time, 0
+# disables the cap, MAX_RSS in bytes, 0 disables the memory check, RATE_LIMIT in requests per
+# second per client (configured API key or IP address), 0 disables the rate limit
+MAX_RENDERS = _get('MAX_RENDERS', 4, int)
+MAX_QUEUED_RENDERS = _get('MAX_QUEUED_RENDERS', 16, int)
+RENDER_QUEUE_TIMEOUT = _get('RENDER_QUEUE_TIMEOUT', 30, float)
+MAX_RSS = _get('MAX_RSS', 0, int)
+RATE_LIMIT = _get('RATE_LIMIT', 0, float)
+RATE_LIMIT_BURST = _get('RATE_LIMIT_BURST', 10, int)
+API_KEY_HEADER = _get('API_KEY_HEADER', 'X-API-Key')
+# The API keys, separated by spaces, that get a rate limit of their own, the clients sending
+# another key are rate limited by IP address
+API_KEYS = _get('API_KEYS', frozenset(), lambda value: frozenset(value.split()))
@@ -0,0 +1,64 @@
+"""
+Contains the streamed delivery of the bodies built on the fly: they are kept in memory and sent
+chunk by chunk, and only written in a temporary file when they exceed a memory ceiling.
+
+The images are already held in memory as ``bytes`` (and in the screenshot cache), they are sent as
+one body: slicing them into chunks would only copy them.
+"""
+from hashlib import sha256
+from tempfile import SpooledTemporaryFile
+
+
+class SpooledBody():
+    """
+    A response body built from chunks, kept in memory up to ``max_size`` bytes and spilled into \
+        a temporary file beyond.
+
+    :param chunks: the chunks of the body
+    :type chunks: iterable
+
+    :param max_size: the memory ceiling in bytes
+    :type max_size: int
+
+    :attributes:
+    * size (**int**): the size of the body in bytes
+    * hash (**_hashlib.HASH**): the sha256 hash of the body
+    * spilled (**bool**): ``True`` if the body was written into a temporary file
+
+    .. warning:: The temporary file is removed once the body is iterated by ``chunks`` or closed
+    """
+    def __init__(self, chunks, max_size):
+        self.size = 0
+        self.hash = sha256()
+        self._file = SpooledTemporaryFile(max_size=max_size, prefix='screamshot-')
+        try:
+            for chunk in chunks:
+                self._file.write(chunk)
+                self.hash.update(chunk)
+                self.size += len(chunk)
+        except BaseException:
+            self._file.close()
+            raise
+        self.spilled = self.size > max_size
+
+    def __len__(self):
+        return self.size
+
+    def chunks(self, chunk_size):
+        """
+        This generator yields the body by chunks of ``chunk_size`` bytes and closes it
+        """
+        try:
+            self._file.seek(0)
+            chunk = self._file.read(chunk_size)
+            while chunk:
+                yield chunk
+                chunk = self._file.read(chunk_size)
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Frees the memory or removes the temporary file of the body
+        """
+        self._file.close()
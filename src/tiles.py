@@ -0,0 +1,141 @@
+"""
+Contains the assembly of the full page screenshots taken in viewport-sized tiles: the tiles are
+either stitched into one PNG image, encoded band by band, or returned in a zip archive.
+
+Only one decoded tile is held in memory at a time, whatever the height of the page.
+"""
+from io import BytesIO
+from struct import pack
+from zlib import compressobj, crc32
+
+from PIL import Image
+
+from .archive import stream_zip
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+COLOR_TYPES = {'RGB': 2, 'RGBA': 6}
+
+
+def _chunk(chunk_type, data):
+    return (pack('>I', len(data)) + chunk_type + data
+            + pack('>I', crc32(data, crc32(chunk_type)) & 0xffffffff))
+
+
+def crop_tile(bytes_img, top=0, height=None):
+    """
+    Decodes a tile and keeps ``height`` rows from ``top``
+
+    :param bytes_img: mandatory, the tile as a png image
+    :type bytes_img: bytes
+
+    :param top: optional, the first row kept
+    :type top: int
+
+    :param height: optional, the number of rows kept, all the rows below ``top`` by default
+    :type height: int
+
+    :return: the cropped tile
+    :retype: PIL.Image.Image
+    """
+    img = Image.open(BytesIO(bytes_img))
+    bottom = img.height if height is None else min(img.height, top + height)
+    if top or bottom != img.height:
+        img = img.crop((0, top, img.width, bottom))
+    return img
+
+
+class PNGStitcher():
+    """
+    Stitches tiles of the same width into a PNG image, the rows of each tile are compressed as \
+        soon as it is added.
+
+    :param height: the height of the image in pixels, the missing rows are left white and the \
+        extra rows are dropped
+    :type height: int
+
+    :param compress_level: the zlib compression level
+    :type compress_level: int
+    """
+    def __init__(self, height, compress_level=6):
+        self.height = height
+        self.width = None
+        self.mode = None
+        self.rows = 0
+        self._output = BytesIO()
+        self._compressor = compressobj(compress_level)
+
+    def _write_header(self, img):
+        self.width = img.width
+        self.mode = 'RGBA' if img.mode in ('RGBA', 'LA', 'P') else 'RGB'
+        self._output.write(PNG_SIGNATURE)
+        self._output.write(_chunk(b'IHDR', pack('>IIBBBBB', self.width, self.height, 8,
+                                                COLOR_TYPES[self.mode], 0, 0, 0)))
+
+    def _write_rows(self, raw, count):
+        stride = len(raw) // count if count else 0
+        data = b''.join(b'\x00' + raw[row * stride:(row + 1) * stride] for row in range(count))
+        compressed = self._compressor.compress(data)
+        if compressed:
+            self._output.write(_chunk(b'IDAT', compressed))
+        self.rows += count
+
+    def add(self, bytes_img, top=0, height=None):
+        """
+        Appends the rows of a tile below the previous ones
+
+        It accepts the ``top`` and ``height`` parameters of ``crop_tile``.
+        """
+        img = crop_tile(bytes_img, top=top, height=height)
+        if self.width is None:
+            self._write_header(img)
+        if img.mode != self.mode:
+            img = img.convert(self.mode)
+        if img.width != self.width:
+            img = img.crop((0, 0, self.width, img.height))
+        count = min(img.height, self.height - self.rows)
+        if count > 0:
+            self._write_rows(img.crop((0, 0, self.width, count)).tobytes(), count)
+
+    def close(self):
+        """
+        :return: the PNG image
+        :retype: bytes
+        """
+        if self.width is None:
+            self._write_header(Image.new('RGB', (1, 1)))
+        if self.rows < self.height:
+            blank = Image.new(self.mode, (self.width, self.height - self.rows), 'white')
+            self._write_rows(blank.tobytes(), blank.height)
+        self._output.write(_chunk(b'IDAT', self._compressor.flush()))
+        self._output.write(_chunk(b'IEND', b''))
+        return self._output.getvalue()
+
+
+class TileArchive():
+    """
+    Collects the tiles, cropped when they overlap, in a zip archive of ``tile-<index>.png`` files.
+    """
+    def __init__(self):
+        self.tiles = []
+
+    def add(self, bytes_img, top=0, height=None):
+        """
+        Appends a tile
+
+        It accepts the ``top`` and ``height`` parameters of ``crop_tile``.
+        """
+        tile_height = Image.open(BytesIO(bytes_img)).height
+        if top or (height is not None and height < tile_height):
+            output = BytesIO()
+            crop_tile(bytes_img, top=top, height=height).save(output, format='PNG')
+            bytes_img = output.getvalue()
+        self.tiles.append(bytes_img)
+
+    def close(self):
+        """
+        :return: the zip archive
+        :retype: bytes
+        """
+        return b''.join(stream_zip(('tile-{0:04d}.png'.format(index), tile)
+                                   for index, tile in enumerate(self.tiles)))
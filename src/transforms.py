@@ -0,0 +1,97 @@
+"""
+Contains the image transforms applied to the screenshots before they are sent: output format,
+quality, resize and thumbnailing.
+"""
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+
+AUTHORIZED_FORMAT_VALUE = ['png', 'jpeg', 'webp']
+AUTHORIZED_FIT_VALUE = ['contain', 'cover', 'fill']
+MIMETYPES = {'png': 'image/png', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+
+def _target_size(size, width=None, height=None, fit='contain'):
+    img_width, img_height = size
+    if width and not height:
+        width, height = width, img_height * width / img_width
+    elif height and not width:
+        width, height = img_width * height / img_height, height
+    elif fit == 'contain':
+        ratio = min(width / img_width, height / img_height)
+        width, height = img_width * ratio, img_height * ratio
+    # The box is shrunk to the size of the image, it is never enlarged
+    ratio = min(1, img_width / width, img_height / height)
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+
+def resize_image(img, width=None, height=None, fit='contain'):
+    """
+    Resizes a PIL image
+
+    :param width: optional, the target width
+    :type width: int
+
+    :param height: optional, the target height
+    :type height: int
+
+    :param fit: optional, when both sizes are given ``contain`` (default) keeps the ratio and \
+        fits the image in the box, ``cover`` keeps the ratio and crops the image to fill the \
+        box and ``fill`` stretches the image to the box
+    :type fit: str
+
+    .. info:: A box larger than the image is shrunk to it, keeping its ratio, so that the image \
+        is never enlarged
+
+    :return: the resized image, or ``img`` itself if no size is given
+    """
+    if not width and not height:
+        return img
+    size = _target_size(img.size, width=width, height=height, fit=fit)
+    if width and height and fit == 'cover':
+        return ImageOps.fit(img, size, Image.LANCZOS)
+    return img.resize(size, Image.LANCZOS)
+
+
+def transform_image(bytes_obj, image_format='png', quality=None, width=None, height=None,
+                    fit='contain', compress_level=None):
+    """
+    This function decodes an image, resizes it and encodes it in the given format
+
+    :param bytes_obj: mandatory, the image
+    :type bytes_obj: bytes
+
+    :param image_format: optional, ``png`` (default), ``jpeg`` or ``webp``
+    :type image_format: str
+
+    :param quality: optional, the jpeg or webp quality, between 1 and 100
+    :type quality: int
+
+    :param compress_level: optional, the png compression level, between 0 and 9
+    :type compress_level: int
+
+    It also accepts the ``width``, ``height`` and ``fit`` parameters of ``resize_image``.
+
+    :return: the encoded image
+    :retype: bytes
+
+    .. info:: The transparent areas are flattened on a white background in jpeg
+    """
+    img = resize_image(Image.open(BytesIO(bytes_obj)), width=width, height=height, fit=fit)
+    options = {}
+    if image_format == 'jpeg':
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+    if quality and image_format in ('jpeg', 'webp'):
+        options['quality'] = quality
+    if compress_level is not None and image_format == 'png':
+        options['compress_level'] = compress_level
+    output = BytesIO()
+    img.save(output, format=image_format.upper(), **options)
+    return output.getvalue()
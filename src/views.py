@@ -1,9 +1,33 @@
 """
 Contains all the views.
 """
-from flask import request, jsonify
+from hmac import compare_digest
 
-from .serializers import ScreenshotSerializer
+from flask import Response, request, jsonify, url_for
+
+from . import settings
+from .admission import client_key, get_rate_limiter
+from .browser_pool import get_browser_pool
+from .cache import get_screenshot_cache
+from .jobs import DONE, FAILED, QueueFullError, get_job_manager
+from .metrics import REGISTRY
+from .prewarm import get_prewarmer
+from .serializers import (BatchScreenshotSerializer, CompareSerializer, ScreenshotSerializer,
+                          collapse_values)
+
+
+def _check_rate_limit():
+    rate_limiter = get_rate_limiter()
+    if rate_limiter is not None:
+        rate_limiter.check(client_key(request.headers.get(settings.API_KEY_HEADER),
+                                      request.remote_addr))
+
+
+def _is_admin():
+    admin_key = request.headers.get(settings.PREWARM_ADMIN_KEY_HEADER)
+    return bool(settings.PREWARM_ADMIN_KEY and admin_key
+                and compare_digest(admin_key.encode('utf-8'),
+                                   settings.PREWARM_ADMIN_KEY.encode('utf-8')))
 
 
 def take_screenshot_view():
@@ -18,27 +42,329 @@ def take_screenshot_view():
     :type path: str
 
     :param width: optionnal, the window's width
-    :type width: int
+    :type width: int or list(int)
 
     :param height: optionnal, the window's height
-    :type height: int
+    :type height: int or list(int)
 
-    :param selector: optionnal, CSS3 selector, item whose screenshot is taken
-    :type selector: str
+    :param selector: optionnal, CSS3 selector, item whose screenshot is taken, when several \
+        selectors are given the page is loaded once and each item is captured
+    :type selector: str or list(str)
 
     :param wait_for: optionnal, CSS3 selector, item to wait before taking the screenshot
     :type wait_for: str
 
     :param wait_until: optionnal, define how long you wait for the page to be loaded should \
-        be either load, domcontentloaded, networkidle0 or networkidle2
+        be either load, domcontentloaded, networkidle0 or networkidle2, several comma separated \
+        or repeated events are all waited for
     :type wait_until: str or list(str)
+
+    :param credentials: optional, in POST mode, a json object with a ``username`` and a \
+        ``password``, or HTTP headers and ``"token_in_header": true``
+    :type credentials: str
+
+    :param block_profile: optional, the requests of the page blocked, ``fast`` (trackers, fonts, \
+        video...), ``no-media`` (images and video), ``first-party-only`` or ``none``, \
+        ``BLOCK_PROFILE`` by default
+    :type block_profile: str
+
+    :param block_types: optional, comma separated resource types blocked in addition to the \
+        profile, e.g. ``image,font``
+    :type block_types: str or list(str)
+
+    :param block_domains: optional, comma separated domains blocked in addition to the profile, \
+        their subdomains included
+    :type block_domains: str or list(str)
+
+    :param allow_domains: optional, comma separated domains never blocked
+    :type allow_domains: str or list(str)
+
+    :param full_page: optional, ``true`` to capture the whole page, one viewport at a time, \
+        the tiles are stitched into one image
+    :type full_page: bool
+
+    :param tiles: optional, ``true`` to capture the whole page and return the tiles in a zip \
+        archive, the image parameters are not available
+    :type tiles: bool
+
+    :param max_height: optional, in the ``full_page`` and ``tiles`` modes the page is cut below \
+        this height, ``FULL_PAGE_MAX_HEIGHT`` by default and at most
+    :type max_height: int
+
+    :param format: optional, the image format, ``png`` (default), ``jpeg`` or ``webp``
+    :type format: str
+
+    :param quality: optional, the jpeg or webp quality, between 1 and 100
+    :type quality: int
+
+    :param compress_level: optional, the png compression level, between 0 and 9
+    :type compress_level: int
+
+    :param thumbnail_width: optional, the width the image is resized to
+    :type thumbnail_width: int
+
+    :param thumbnail_height: optional, the height the image is resized to
+    :type thumbnail_height: int
+
+    :param fit: optional, when both thumbnail sizes are given, ``contain`` (default) fits the \
+        image in the box, ``cover`` crops it to fill the box and ``fill`` stretches it
+    :type fit: str
+
+    :param output: optional, ``zip`` (default) sends an archive of several images as it is and \
+        ``json`` sends its manifest with the base64 encoded images
+    :type output: str
+
+    :param perceptual_threshold: optional, between 0 and 64, a 304 status code is returned when \
+        the perceptual hash of a version given in ``If-None-Match`` is at most this number of \
+        bits away from the one of the image
+    :type perceptual_threshold: int
+
+    :param cache: optional, ``use`` (default) serves the screenshot from the cache when it is \
+        there, ``bypass`` neither reads nor writes the cache and ``refresh`` takes a new \
+        screenshot and stores it
+    :type cache: str
+
+    .. info:: When several widths or heights are given, the page is loaded once and captured in \
+        each viewport, the images are returned in a zip archive
+    .. info:: When requests are blocked, the ``X-Blocked-Requests`` header counts them by \
+        resource type and ``X-Blocked-Time-Saved`` estimates the seconds saved
+    .. info:: The response has a strong ``ETag`` and an ``X-Perceptual-Hash`` header, an \
+        ``If-None-Match`` header matching the ``ETag`` gets an empty 304 response
+    .. info:: A json with a 429 or 503 status code and a ``Retry-After`` header is returned \
+        when the request is refused by the admission control
+    .. info:: The request is counted by the prewarmer
     """
+    _check_rate_limit()
     url = request.args.get('url')
-    if url and request.method == 'GET':
+    if not url or request.method not in ('GET', 'POST'):
+        return jsonify({'errors': ['No url']}), 400
+    if request.method == 'GET':
         serializer = ScreenshotSerializer(url)
-        return serializer.serialize()
-    if url and request.method == 'POST':
-        data = request.form.to_dict()
-        serializer = ScreenshotSerializer(url, raw_data=data)
-        return serializer.serialize()
-    return jsonify({'errors': ['No url']}), 400
+    else:
+        serializer = ScreenshotSerializer(url, raw_data=collapse_values(
+            request.form.to_dict(flat=False)))
+    response = serializer.serialize(if_none_match=request.headers.get('If-None-Match'))
+    get_prewarmer().record(serializer)
+    return response
+
+
+def take_screenshots_view():
+    """
+    Takes a batch of screenshots concurrently and streams them back in a zip archive with a 200 \
+        status code if every spec is valid or returns a json with a 400 status code otherwise.
+
+    The body is a json list of specs, or a json object with a ``specs`` key, each spec being an \
+        object with a mandatory ``url`` key and the parameters of ``take_screenshot_view``.
+    """
+    _check_rate_limit()
+    specs = request.get_json(silent=True)
+    if isinstance(specs, dict):
+        specs = specs.get('specs')
+    serializer = BatchScreenshotSerializer(specs)
+    return serializer.serialize()
+
+
+def compare_view():
+    """
+    Takes a screenshot of a web page and compares it with a baseline image, returns the \
+        comparison as a json with a 200 status code if there is no errors or a json with a 400 \
+        status code otherwise.
+
+    It takes the parameters of ``take_screenshot_view`` in POST mode, a single png screenshot \
+        being compared, and:
+
+    :param baseline: optional, the uploaded baseline image
+    :type baseline: file
+
+    :param baseline_key: optional, the key of the stored baseline image, an uploaded baseline \
+        is stored under it
+    :type baseline_key: str
+
+    :param update_baseline: optional, ``true`` to store the screenshot as the new baseline
+    :type update_baseline: bool
+
+    :param diff_image: optional, ``true`` to return the base64 encoded highlighted diff image
+    :type diff_image: bool
+
+    :param tolerance: optional, a pixel is changed when one of its channels differs by more \
+        than this value, between 0 and 255, ``16`` by default
+    :type tolerance: int
+    """
+    _check_rate_limit()
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'errors': ['No url']}), 400
+    baseline = request.files.get('baseline')
+    serializer = CompareSerializer(url, raw_data=collapse_values(request.form.to_dict(flat=False)),
+                                   baseline=baseline.read() if baseline else None)
+    return serializer.serialize()
+
+
+def create_job_view():
+    """
+    Creates a screenshot job and returns it as a json with a 202 status code, a json with a 400 \
+        status code if the parameters are not valid or a json with a 429 status code and a \
+        ``Retry-After`` header if there are too many pending jobs.
+
+    It takes the parameters of ``take_screenshot_view`` in POST mode and an optional \
+        ``callback_url``, the finished job is posted as a json to that url.
+    """
+    _check_rate_limit()
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'errors': ['No url']}), 400
+    data = collapse_values(request.form.to_dict(flat=False))
+    callback_url = data.pop('callback_url', None)
+    serializer = ScreenshotSerializer(url, raw_data=data)
+    if not serializer.is_valid():
+        return jsonify({'errors': serializer.errors}), 400
+    if callback_url and not callback_url.startswith(('http://', 'https://')):
+        return jsonify({'errors': ['Bad callback_url']}), 400
+    try:
+        job = get_job_manager().submit(url, raw_data=data, callback_url=callback_url)
+    except QueueFullError as exc:
+        response = jsonify({'errors': [str(exc)]})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(exc.retry_after)
+        return response
+    response = jsonify(job.to_dict())
+    response.status_code = 202
+    response.headers['Location'] = url_for('job', job_id=job.id)
+    return response
+
+
+def job_view(job_id):
+    """
+    Returns the job as a json with a 200 status code or a json with a 404 status code if it does \
+        not exist or has expired.
+    """
+    job = get_job_manager().store.get(job_id)
+    if job is None:
+        return jsonify({'errors': ['Unknown job']}), 404
+    return jsonify(job.to_dict())
+
+
+def job_result_view(job_id):
+    """
+    Returns the screenshot of a finished job as a png image with a 200 status code, a json with \
+        a 400 status code if the job has failed, with a 409 status code if it is not finished \
+        or with a 404 status code if it does not exist or has expired.
+    """
+    job = get_job_manager().store.get(job_id)
+    if job is None:
+        return jsonify({'errors': ['Unknown job']}), 404
+    if job.status == DONE:
+        serializer = ScreenshotSerializer(job.url, raw_data=job.raw_data)
+        serializer.is_valid()
+        return serializer.serialize(bytes_obj=job.result)
+    if job.status == FAILED:
+        return jsonify({'errors': job.errors}), 400
+    return jsonify({'errors': ['Job is not finished']}), 409
+
+
+def admission_error_view(exc):
+    """
+    Returns the error of a request refused by the admission control as a json with a 429 or 503 \
+        status code and a ``Retry-After`` header.
+    """
+    response = jsonify({'errors': [str(exc)]})
+    response.status_code = exc.status_code
+    response.headers['Retry-After'] = str(exc.retry_after)
+    return response
+
+
+def prewarm_view():
+    """
+    Returns the state of the prewarmer of the worker as a json with a 200 status code in GET \
+        mode: its schedule, its next run and its entries, pinned or tracked with their hits.
+
+    In POST mode, pins the screenshot of the ``url`` and of the parameters of \
+        ``take_screenshot_view``, its entry is returned as a json with a 201 status code, or a \
+        json with a 400 status code if the parameters are not valid.
+
+    .. warning:: A screenshot with ``credentials`` cannot be pinned
+    .. warning:: Answers with a 403 status code unless the request sends the admin key in the \
+        ``PREWARM_ADMIN_KEY_HEADER`` header
+    """
+    _check_rate_limit()
+    if not _is_admin():
+        return jsonify({'errors': ['Bad admin key']}), 403
+    prewarmer = get_prewarmer()
+    if request.method == 'GET':
+        return jsonify(prewarmer.to_dict())
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'errors': ['No url']}), 400
+    serializer = ScreenshotSerializer(url, raw_data=collapse_values(
+        request.form.to_dict(flat=False)))
+    if not serializer.is_valid():
+        return jsonify({'errors': serializer.errors}), 400
+    if not prewarmer.is_trackable(serializer):
+        return jsonify({'errors': ['A screenshot with credentials cannot be pinned']}), 400
+    return jsonify(prewarmer.pin(serializer).to_dict()), 201
+
+
+def prewarm_entry_view(key):
+    """
+    Unpins an entry of the prewarmer and returns an empty response with a 204 status code, or a \
+        json with a 404 status code if it is not pinned.
+
+    .. warning:: Answers with a 403 status code unless the request sends the admin key in the \
+        ``PREWARM_ADMIN_KEY_HEADER`` header
+    """
+    _check_rate_limit()
+    if not _is_admin():
+        return jsonify({'errors': ['Bad admin key']}), 403
+    if not get_prewarmer().unpin(key):
+        return jsonify({'errors': ['Unknown pinned entry']}), 404
+    return Response(status=204)
+
+
+def browser_pool_view():
+    """
+    Returns the state of the browser pool of the worker as a json: its size, the number of idle \
+        and busy browsers, the launch, recycle and failure counters and the resource cache \
+        counters.
+    """
+    return jsonify(get_browser_pool().stats())
+
+
+@REGISTRY.register_collector
+def _worker_metrics():
+    pool_stats = get_browser_pool().stats()
+    cache_stats = get_screenshot_cache().stats()
+    return [
+        ('screamshot_browsers_idle', 'gauge', 'Number of idle browsers in the pool.',
+         pool_stats['idle']),
+        ('screamshot_browsers_busy', 'gauge', 'Number of busy browsers in the pool.',
+         pool_stats['busy']),
+        ('screamshot_browser_launches_total', 'counter', 'Number of browsers launched.',
+         pool_stats['launch_count']),
+        ('screamshot_browser_recycles_total', 'counter', 'Number of browsers recycled.',
+         pool_stats['recycle_count']),
+        ('screamshot_browser_failures_total', 'counter', 'Number of browsers replaced after a '
+         'failure.', pool_stats['failure_count']),
+        ('screamshot_resource_cache_hits_total', 'counter', 'Number of page responses served by '
+         'the browser caches.', pool_stats['resource_cache_hits']),
+        ('screamshot_resource_cache_misses_total', 'counter', 'Number of page responses loaded '
+         'from the network.', pool_stats['resource_cache_misses']),
+        ('screamshot_sessions_opened_total', 'counter', 'Number of browser contexts opened for '
+         'a set of credentials.', pool_stats['session_count']),
+        ('screamshot_sessions_reused_total', 'counter', 'Number of screenshots taken in a warm '
+         'browser context of their credentials.', pool_stats['session_reuse_count']),
+        ('screamshot_cache_hits_total', 'counter', 'Number of screenshot cache hits.',
+         cache_stats['hits']),
+        ('screamshot_cache_misses_total', 'counter', 'Number of screenshot cache misses.',
+         cache_stats['misses']),
+        ('screamshot_cache_bytes', 'gauge', 'Size of the memory tier of the screenshot cache.',
+         cache_stats['bytes']),
+        ('screamshot_jobs_queued', 'gauge', 'Number of pending jobs.',
+         get_job_manager().queued),
+    ]
+
+
+def metrics_view():
+    """
+    Returns the metrics of the worker in the Prometheus text format.
+    """
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
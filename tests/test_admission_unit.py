@@ -0,0 +1,151 @@
+from asyncio import gather, run, sleep as async_sleep
+from os import getpid
+from subprocess import Popen
+from threading import Event, Thread
+from time import sleep
+from unittest import TestCase, mock
+
+from src.admission import (AdmissionError, AsyncRenderGate, RateLimiter, RenderGate, TokenBucket,
+                           _children, process_tree_rss)
+from src.metrics import ADMISSION_QUEUED, ADMISSION_REJECTED
+
+
+class TestTokenBucketUnit(TestCase):
+    def test_take(self):
+        bucket = TokenBucket(rate=2, burst=2)
+        now = bucket.updated_at
+        self.assertEqual(bucket.take(now), 0)
+        self.assertEqual(bucket.take(now), 0)
+        self.assertAlmostEqual(bucket.take(now), 0.5)
+        self.assertEqual(bucket.take(now + 0.5), 0)
+        self.assertEqual(bucket.take(now + 10), 0)
+        self.assertEqual(bucket.tokens, 1)
+
+
+class TestRateLimiterUnit(TestCase):
+    def test_check(self):
+        rejected = ADMISSION_REJECTED.get(reason='rate_limit')
+        rate_limiter = RateLimiter(rate=0.1, burst=1, max_clients=2)
+        rate_limiter.check('1.2.3.4')
+        with self.assertRaises(AdmissionError) as context:
+            rate_limiter.check('1.2.3.4')
+        self.assertEqual(context.exception.status_code, 429)
+        self.assertEqual(context.exception.retry_after, 10)
+        self.assertEqual(ADMISSION_REJECTED.get(reason='rate_limit'), rejected + 1)
+
+        rate_limiter.check('api-key')
+        rate_limiter.check('5.6.7.8')
+        self.assertEqual(list(rate_limiter._buckets), ['api-key', '5.6.7.8'])
+        rate_limiter.check('1.2.3.4')
+
+
+class TestRenderGateUnit(TestCase):
+    def _hold(self, gate, started, release):
+        def hold():
+            with gate.slot():
+                started.set()
+                release.wait()
+        thread = Thread(target=hold)
+        thread.start()
+        started.wait()
+        return thread
+
+    def test_queue(self):
+        gate = RenderGate(max_renders=1, max_queued=1, queue_timeout=5)
+        release = Event()
+        holder = self._hold(gate, Event(), release)
+        queued = ADMISSION_QUEUED.get()
+        waiter = Thread(target=self._hold, args=(gate, Event(), release))
+        waiter.start()
+        sleep(0.2)
+        self.assertEqual(gate.queued, 1)
+        self.assertEqual(ADMISSION_QUEUED.get(), queued + 1)
+
+        with self.assertRaises(AdmissionError) as context:
+            with gate.slot():
+                pass
+        self.assertEqual(context.exception.status_code, 503)
+        self.assertEqual(str(context.exception), 'Too many pending screenshots')
+
+        release.set()
+        holder.join()
+        waiter.join()
+        self.assertEqual(gate.queued, 0)
+
+    def test_queue_timeout(self):
+        gate = RenderGate(max_renders=1, max_queued=1, queue_timeout=0.1)
+        release = Event()
+        holder = self._hold(gate, Event(), release)
+        rejected = ADMISSION_REJECTED.get(reason='queue_timeout')
+        with self.assertRaises(AdmissionError):
+            with gate.slot():
+                pass
+        self.assertEqual(ADMISSION_REJECTED.get(reason='queue_timeout'), rejected + 1)
+        release.set()
+        holder.join()
+        with gate.slot():
+            pass
+
+    def test_memory(self):
+        gate = RenderGate(max_renders=1, max_queued=1, max_rss=1000)
+        with mock.patch('src.admission.process_tree_rss', lambda: 2000):
+            with self.assertRaises(AdmissionError) as context:
+                with gate.slot():
+                    pass
+        self.assertEqual(str(context.exception), 'Server is low on memory')
+        self.assertEqual(context.exception.status_code, 503)
+        gate._rss_measured_at = None
+        with mock.patch('src.admission.process_tree_rss', lambda: 500):
+            with gate.slot():
+                pass
+
+    def test_retry_after(self):
+        gate = RenderGate(max_renders=2, max_queued=10)
+        self.assertEqual(gate.retry_after(), 1)
+        gate._durations = [4, 6]
+        gate.queued = 3
+        self.assertEqual(gate.retry_after(), 10)
+
+    def test_process_tree_rss(self):
+        self.assertGreater(process_tree_rss(), 0)
+
+    def test_async_slot(self):
+        gate = AsyncRenderGate(max_renders=1, max_queued=1, queue_timeout=0.05)
+        events = []
+        async def render(name, duration):
+            async with gate.slot():
+                events.append(name)
+                await async_sleep(duration)
+        async def main():
+            return await gather(render('a', 0.02), render('b', 0), render('c', 0),
+                                return_exceptions=True)
+        results = run(main())
+        self.assertEqual(events, ['a', 'b'])
+        self.assertEqual(results[:2], [None, None])
+        self.assertIsInstance(results[2], AdmissionError)
+        self.assertEqual(gate.queued, 0)
+
+        gate = AsyncRenderGate(max_renders=1, max_queued=1, queue_timeout=0.05)
+        async def timeout():
+            return await gather(render('d', 0.2), render('e', 0), return_exceptions=True)
+        results = run(timeout())
+        self.assertEqual(str(results[1]), 'Too many pending screenshots')
+        self.assertEqual(gate.queued, 0)
+
+    def test_children_of_a_thread(self):
+        started, done = Event(), Event()
+        processes = []
+        def spawn():
+            processes.append(Popen(['sleep', '30']))
+            started.set()
+            done.wait(10)
+        thread = Thread(target=spawn)
+        thread.start()
+        try:
+            started.wait(10)
+            self.assertIn(processes[0].pid, _children(getpid()))
+        finally:
+            processes[0].kill()
+            processes[0].wait()
+            done.set()
+            thread.join()
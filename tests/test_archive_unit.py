@@ -0,0 +1,47 @@
+from base64 import b64encode
+from io import BytesIO
+from json import dumps
+from unittest import TestCase
+from zipfile import ZipFile
+
+from src.archive import archive_to_json, stream_zip
+from src.streaming import SpooledBody
+
+
+class TestArchiveUnit(TestCase):
+    def test_stream_zip(self):
+        chunks = list(stream_zip([('0000.png', b'first'), ('0001.png', b'second')]))
+        self.assertEqual(len(chunks), 3)
+        self.assertIn(b'first', chunks[0])
+        self.assertIn(b'second', chunks[1])
+        with ZipFile(BytesIO(b''.join(chunks))) as archive:
+            self.assertEqual(archive.namelist(), ['0000.png', '0001.png'])
+            self.assertEqual(archive.read('0001.png'), b'second')
+
+    def test_stream_zip_spooled(self):
+        body = SpooledBody([b'a' * 10, b'b' * 10], 4)
+        chunks = list(stream_zip([('0000.json', body), ('0001.png', b'second')]))
+        with ZipFile(BytesIO(b''.join(chunks))) as archive:
+            self.assertEqual(archive.namelist(), ['0000.json', '0001.png'])
+            self.assertEqual(archive.read('0000.json'), b'a' * 10 + b'b' * 10)
+            self.assertEqual(archive.read('0001.png'), b'second')
+        self.assertTrue(body._file.closed)
+
+    def test_stream_zip_empty(self):
+        with ZipFile(BytesIO(b''.join(stream_zip([])))) as archive:
+            self.assertEqual(archive.namelist(), [])
+
+    def test_archive_to_json(self):
+        archive = b''.join(stream_zip([('a.png', b'a'), ('b.png', b'b')]))
+        self.assertEqual(archive_to_json(archive), [
+            {'file': 'a.png', 'image': b64encode(b'a').decode('ascii')},
+            {'file': 'b.png', 'image': b64encode(b'b').decode('ascii')}])
+
+        manifest = [{'selector': '#a', 'file': '0000.png', 'box': {'x': 1}},
+                    {'selector': '#b', 'errors': ['selector unknown: "#b"']}]
+        archive = b''.join(stream_zip([('0000.png', b'a'),
+                                       ('manifest.json', dumps(manifest).encode('utf-8'))]))
+        self.assertEqual(archive_to_json(archive), [
+            {'selector': '#a', 'file': '0000.png', 'box': {'x': 1},
+             'image': b64encode(b'a').decode('ascii')},
+            {'selector': '#b', 'errors': ['selector unknown: "#b"']}])
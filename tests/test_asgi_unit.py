@@ -0,0 +1,207 @@
+from asyncio import Event, gather, run, sleep
+from json import loads
+from unittest import TestCase, mock
+
+from screamshot.errors import BadUrl
+
+from src.admission import AsyncRenderGate, RateLimiter
+from src.asgi import ScreenshotApplication
+from src.cache import MemoryCache
+from src.metrics import ERRORS, REQUESTS
+
+
+class BrowserPool():
+    def __init__(self):
+        self.calls = []
+        self.cancelled = False
+    async def render(self, url, resource_stats=None, **kwargs):
+        self.calls.append((url, kwargs))
+        if url == 'http://bad':
+            raise BadUrl('url unknown: "http://bad"')
+        if url in ('http://slow', 'http://shared'):
+            try:
+                await sleep(10 if url == 'http://slow' else 0.2)
+            except BaseException:
+                self.cancelled = True
+                raise
+        return b'img'
+
+
+async def send_request(application, path='/api/take-screenshot', method='GET',
+                       query_string=b'', body=b'', disconnect=False, headers=()):
+    scope = {'type': 'http', 'path': path, 'method': method, 'query_string': query_string,
+             'headers': list(headers)}
+    messages = [{'type': 'http.request', 'body': body}]
+    sent = []
+    disconnected = Event()
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        if disconnect:
+            await sleep(0.1)
+        else:
+            await disconnected.wait()
+        return {'type': 'http.disconnect'}
+    async def send(message):
+        sent.append(message)
+    await application(scope, receive, send)
+    disconnected.set()
+    if not sent:
+        return None, None, None
+    return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+
+def request(application, **kwargs):
+    return run(send_request(application, **kwargs))
+
+
+@mock.patch('src.serializers.get_screenshot_cache', lambda cache=MemoryCache(): cache)
+class TestAsgiUnit(TestCase):
+    def setUp(self):
+        self.application = ScreenshotApplication(render_timeout=0.5)
+        self.application.browser_pool = BrowserPool()
+
+    def test_get(self):
+        status, headers, body = request(self.application, query_string=b'url=http://fake/get')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'img')
+        self.assertEqual(headers[b'content-type'], b'image/png')
+        self.assertEqual(headers[b'content-length'], b'3')
+        self.assertEqual(headers[b'x-cache'], b'MISS')
+        status, headers, body = request(self.application, query_string=b'url=http://fake/get')
+        self.assertEqual(headers[b'x-cache'], b'HIT')
+        self.assertEqual(len(self.application.browser_pool.calls), 1)
+
+    def test_not_modified(self):
+        _, headers, _ = request(self.application, query_string=b'url=http://fake/etag')
+        status, not_modified_headers, body = request(
+            self.application, query_string=b'url=http://fake/etag',
+            headers=[(b'if-none-match', headers[b'etag'])])
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b'')
+        self.assertEqual(not_modified_headers[b'etag'], headers[b'etag'])
+
+    def test_post(self):
+        status, _, body = request(self.application, method='POST',
+                                  query_string=b'url=http://fake/post',
+                                  body=b'width=100&selector=%23godot')
+        self.assertEqual(status, 200)
+        self.assertEqual(self.application.browser_pool.calls,
+                         [('http://fake/post', {'width': 100, 'selector': '#godot'})])
+
+    def test_post_multipart(self):
+        body = (b'--bound\r\nContent-Disposition: form-data; name="width"\r\n\r\n100\r\n'
+                b'--bound\r\nContent-Disposition: form-data; name="selector"\r\n\r\n\r\n'
+                b'--bound--\r\n')
+        status, _, _ = request(
+            self.application, method='POST', query_string=b'url=http://fake/multipart',
+            body=body, headers=[(b'content-type', b'multipart/form-data; boundary=bound')])
+        self.assertEqual(status, 200)
+        self.assertEqual(self.application.browser_pool.calls,
+                         [('http://fake/multipart', {'width': 100, 'selector': ''})])
+        status, _, body = request(
+            self.application, method='POST', query_string=b'url=http://fake/blank',
+            body=b'width=', headers=[(b'content-type', b'application/x-www-form-urlencoded')])
+        self.assertEqual(status, 200)
+        status, _, body = request(
+            self.application, method='POST', query_string=b'url=http://fake/repeated',
+            body=b'compress_level=1&compress_level=2')
+        self.assertEqual((status, loads(body)), (400, {'errors': ['Bad compress_level']}))
+
+    def test_coalescing(self):
+        prewarmer = mock.Mock()
+        async def main():
+            return await gather(
+                send_request(self.application, query_string=b'url=http://shared'),
+                send_request(self.application, query_string=b'url=http://shared'),
+                send_request(self.application, query_string=b'url=http://shared',
+                             disconnect=True))
+        with mock.patch('src.asgi.get_prewarmer', lambda: prewarmer):
+            first, second, third = run(main())
+        self.assertEqual(len(self.application.browser_pool.calls), 1)
+        self.assertFalse(self.application.browser_pool.cancelled)
+        self.assertEqual((first[0], first[2], second[0], second[2]), (200, b'img', 200, b'img'))
+        self.assertEqual(third, (None, None, None))
+        self.assertEqual([response[1].get(b'x-coalesced') for response in (first, second)].count(b'true'),
+                         1)
+        self.assertIn(b'render;dur=', first[1][b'server-timing'])
+        self.assertEqual(prewarmer.record.call_count, 2)
+
+    def test_metrics(self):
+        requests = REQUESTS.get(endpoint='take_screenshot', method='GET', status=200)
+        not_found = REQUESTS.get(endpoint='unknown', method='GET', status=404)
+        request(self.application, query_string=b'url=http://fake/metrics')
+        request(self.application, path='/other')
+        self.assertEqual(REQUESTS.get(endpoint='take_screenshot', method='GET', status=200),
+                         requests + 1)
+        self.assertEqual(REQUESTS.get(endpoint='unknown', method='GET', status=404),
+                         not_found + 1)
+
+    def test_errors(self):
+        errors = ERRORS.get(type='BadUrl')
+        status, _, body = request(self.application)
+        self.assertEqual((status, loads(body)), (400, {'errors': ['No url']}))
+        status, _, body = request(self.application, method='POST',
+                                  query_string=b'url=http://fake', body=b'width=coucou')
+        self.assertEqual((status, loads(body)), (400, {'errors': ['Bad width']}))
+        status, _, body = request(self.application, query_string=b'url=http://bad')
+        self.assertEqual((status, loads(body)), (400, {'errors': ['url unknown: "http://bad"']}))
+        self.assertEqual(ERRORS.get(type='BadUrl'), errors + 1)
+        status, _, body = request(self.application, path='/other')
+        self.assertEqual(status, 404)
+        status, _, body = request(self.application, method='PUT')
+        self.assertEqual(status, 405)
+
+    def test_timeout(self):
+        status, _, body = request(self.application, query_string=b'url=http://slow')
+        self.assertEqual((status, loads(body)), (504, {'errors': ['Timeout']}))
+        self.assertTrue(self.application.browser_pool.cancelled)
+
+    def test_disconnect(self):
+        status, _, _ = request(self.application, query_string=b'url=http://slow',
+                               disconnect=True)
+        self.assertIsNone(status)
+        self.assertTrue(self.application.browser_pool.cancelled)
+
+    @mock.patch('src.admission.settings.API_KEYS', frozenset(['key']))
+    def test_rate_limit(self):
+        rate_limiter = RateLimiter(rate=0.1, burst=1)
+        with mock.patch('src.asgi.get_rate_limiter', lambda: rate_limiter):
+            status, _, _ = request(self.application, query_string=b'url=http://fake/limit',
+                                   headers=[(b'x-api-key', b'key')])
+            self.assertEqual(status, 200)
+            status, headers, body = request(self.application,
+                                            query_string=b'url=http://fake/limit',
+                                            headers=[(b'x-api-key', b'key')])
+        self.assertEqual((status, loads(body)), (429, {'errors': ['Too many requests']}))
+        self.assertIn(b'retry-after', headers)
+        self.assertEqual(list(rate_limiter._buckets), ['key'])
+
+        rate_limiter = RateLimiter(rate=0.1, burst=1)
+        with mock.patch('src.asgi.get_rate_limiter', lambda: rate_limiter):
+            for index, expected_status in enumerate((200, 429)):
+                status, _, _ = request(self.application, query_string=b'url=http://fake/limit',
+                                       headers=[(b'x-api-key', 'random-{0}'.format(
+                                           index).encode('latin-1'))])
+                self.assertEqual(status, expected_status)
+        self.assertEqual(len(rate_limiter._buckets), 1)
+
+    def test_render_gate(self):
+        self.application.render_gate = AsyncRenderGate(1, 0, queue_timeout=0.1)
+        status, headers, body = request(self.application, query_string=b'url=http://slow')
+        self.assertEqual(status, 504)
+
+        async def main():
+            running = []
+            async def render(url, **kwargs):
+                running.append(url)
+                await sleep(0.05)
+                return len(running)
+            self.application.get_browser_pool().render = render
+            return await gather(self.application._render('http://a'),
+                                self.application._render('http://b'),
+                                return_exceptions=True)
+        first, second = run(main())
+        self.assertEqual(first, 1)
+        self.assertEqual((second.status_code, str(second)),
+                         (503, 'Too many pending screenshots'))
@@ -0,0 +1,167 @@
+from asyncio import new_event_loop, sleep
+from unittest import TestCase, mock
+
+from src.blocking import BlockingRules, BlockingStats, RequestTimings
+from src.renderer import render_screenshot
+from src.serializers import ScreenshotSerializer
+
+
+class FakeRequest():
+    def __init__(self, url, resource_type, frame='main'):
+        self.url = url
+        self.resourceType = resource_type
+        self.frame = frame
+        self.resolution = None
+
+    def isNavigationRequest(self):
+        return self.resourceType == 'document'
+
+    def failure(self):
+        return {'errorText': 'net::ERR_BLOCKED_BY_CLIENT'} if self.resolution == 'abort' \
+            else None
+
+    async def abort(self, errorCode='failed'):
+        self.resolution = 'abort'
+
+    async def continue_(self):
+        self.resolution = 'continue'
+
+
+class FakePage():
+    mainFrame = 'main'
+
+    def __init__(self):
+        self.listeners = {}
+        self.interception = False
+        self.requests = [
+            FakeRequest('http://www.example.com/', 'document'),
+            FakeRequest('http://cdn.example.com/style.css', 'stylesheet'),
+            FakeRequest('http://www.example.com/video.mp4', 'media'),
+            FakeRequest('https://www.google-analytics.com/analytics.js', 'script'),
+            FakeRequest('http://fonts.example.org/font.woff2', 'font'),
+            FakeRequest('data:image/png;base64,', 'image'),
+        ]
+
+    def on(self, event, listener):
+        self.listeners.setdefault(event, []).append(listener)
+
+    async def setRequestInterception(self, value):
+        self.interception = value
+
+    async def setCacheEnabled(self, enabled=True):
+        self.cache_enabled = enabled
+
+    async def goto(self, url, waitUntil=None):
+        for request in self.requests:
+            for listener in self.listeners.get('request', []):
+                listener(request)
+        await sleep(0)
+
+    async def screenshot(self):
+        return b'img'
+
+    async def close(self):
+        pass
+
+
+class FakeBrowser():
+    def __init__(self):
+        self.page = FakePage()
+
+    async def newPage(self):
+        return self.page
+
+
+class TestBlockingUnit(TestCase):
+    def test_rules(self):
+        rules = BlockingRules('http://www.example.com/', types=['image'],
+                              deny=['doubleclick.net'], allow=['img.doubleclick.net'])
+        self.assertTrue(rules.blocks('http://www.example.com/a.png', 'image'))
+        self.assertFalse(rules.blocks('http://www.example.com/a.css', 'stylesheet'))
+        self.assertTrue(rules.blocks('http://ad.doubleclick.net/a.js', 'script'))
+        self.assertTrue(rules.blocks('http://DoubleClick.net/a.js', 'script'))
+        self.assertFalse(rules.blocks('http://notdoubleclick.net/a.js', 'script'))
+        self.assertFalse(rules.blocks('http://img.doubleclick.net/a.png', 'image'))
+        self.assertFalse(rules.blocks('data:image/png;base64,', 'image'))
+
+        rules = BlockingRules('http://www.example.com/', first_party_only=True)
+        self.assertFalse(rules.blocks('http://cdn.example.com/a.js', 'script'))
+        self.assertTrue(rules.blocks('http://cdn.example.org/a.js', 'script'))
+
+    def test_request_timings(self):
+        timings = RequestTimings(weight=0.5)
+        self.assertEqual(timings.mean('image'), 0)
+        timings.add('image', 1)
+        timings.add('image', 2)
+        self.assertEqual(timings.mean('image'), 1.5)
+        self.assertEqual(timings.mean('font'), 1.5)
+
+    @mock.patch('src.blocking.REQUEST_TIMINGS.mean', lambda resource_type: 0.25)
+    def test_stats(self):
+        stats = BlockingStats()
+        self.assertEqual(stats.headers(), {})
+        stats.add('script')
+        stats.add('font')
+        stats.add('script')
+        self.assertEqual(stats.headers(), {'X-Blocked-Requests': 'total=3, font=1, script=2',
+                                           'X-Blocked-Time-Saved': '0.750'})
+
+    def test_render(self):
+        browser = FakeBrowser()
+        stats = BlockingStats()
+        loop = new_event_loop()
+        try:
+            loop.run_until_complete(render_screenshot(
+                browser, 'http://www.example.com/', blocking={
+                    'types': ['font', 'media'], 'deny': ['google-analytics.com'],
+                    'allow': ['www.example.com']},
+                blocking_stats=stats))
+        finally:
+            loop.close()
+        self.assertTrue(browser.page.interception)
+        self.assertTrue(browser.page.cache_enabled)
+        self.assertEqual([request.resolution for request in browser.page.requests],
+                         ['continue', 'continue', 'continue', 'abort', 'abort', 'continue'])
+        self.assertEqual(stats.blocked, {'script': 1, 'font': 1})
+
+    def test_validate_blocking(self):
+        serializer = ScreenshotSerializer('http://fake')
+        self.assertTrue(serializer.is_valid())
+        self.assertNotIn('blocking', serializer.data)
+        self.assertNotIn('blocking_stats', serializer.render_kwargs())
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'block_profile': 'no-media', 'block_types': 'font,image',
+            'block_domains': ['*.Ads.example.com', 'tracker.net'],
+            'allow_domains': 'cdn.example.com'})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.data['blocking'], {
+            'types': ['font', 'image', 'media'], 'deny': ['ads.example.com', 'tracker.net'],
+            'allow': ['cdn.example.com']})
+        self.assertIs(serializer.render_kwargs()['blocking_stats'], serializer.blocking_stats)
+
+        serializer = ScreenshotSerializer('http://fake',
+                                          raw_data={'block_profile': 'first-party-only'})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.data['blocking'], {'first_party_only': True})
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'allow_domains': 'a.com'})
+        self.assertTrue(serializer.is_valid())
+        self.assertNotIn('blocking', serializer.data)
+
+        with mock.patch('src.serializers.settings.BLOCK_PROFILE', 'fast'):
+            serializer = ScreenshotSerializer('http://fake')
+            self.assertTrue(serializer.is_valid())
+            self.assertIn('doubleclick.net', serializer.data['blocking']['deny'])
+            serializer = ScreenshotSerializer('http://fake', raw_data={'block_profile': 'none'})
+            self.assertTrue(serializer.is_valid())
+            self.assertNotIn('blocking', serializer.data)
+
+        for key, value in (('block_profile', 'slow'), ('block_types', 'document'),
+                           ('block_domains', 'http://a.com'), ('allow_domains', [1]),
+                           ('block_profile', ['fast', 'none']), ('block_profile', {'a': 1}),
+                           ('block_types', [['font']]), ('block_types', 5),
+                           ('block_domains', {'a.com': 1}), ('allow_domains', [{'a': 1}])):
+            serializer = ScreenshotSerializer('http://fake', raw_data={key: value})
+            self.assertFalse(serializer.is_valid())
+            self.assertEqual(serializer.errors, ['Bad {0} value'.format(key)])
@@ -0,0 +1,140 @@
+from asyncio import gather, run
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock
+
+from screamshot.errors import BadUrl
+
+from src.browser_pool import BrowserPool
+
+
+class Process():
+    def __init__(self):
+        self.returncode = None
+    def poll(self):
+        return self.returncode
+
+
+class Browser():
+    def __init__(self, args=None):
+        self.args = args
+        self.process = Process()
+        self.closed = False
+    async def version(self):
+        return 'HeadlessChrome'
+    async def close(self):
+        self.closed = True
+
+
+async def fake_launch(**kwargs):
+    return Browser(kwargs.get('args'))
+
+
+async def fake_render_screenshot(browser, url, resource_stats=None, **kwargs):
+    if url == 'http://bad':
+        raise BadUrl('url unknown: "http://bad"')
+    if url == 'http://crash':
+        raise RuntimeError('Target closed')
+    if resource_stats is not None:
+        resource_stats.add(from_cache=True)
+        resource_stats.add(from_cache=False)
+    return id(browser)
+
+
+@mock.patch('src.browser_pool.render_screenshot', fake_render_screenshot)
+@mock.patch('src.browser_pool.launch', fake_launch)
+class TestBrowserPoolUnit(TestCase):
+    def test_reuse(self):
+        pool = BrowserPool(size=2)
+        async def main():
+            first = await pool.render('http://fake')
+            second = await pool.render('http://fake')
+            return first, second
+        first, second = run(main())
+        self.assertEqual(first, second)
+        self.assertEqual(pool.stats(), {'size': 2, 'idle': 1, 'busy': 0, 'launch_count': 1,
+                                        'recycle_count': 0, 'failure_count': 0,
+                                        'resource_cache_hits': 2, 'resource_cache_misses': 2,
+                                        'session_count': 0, 'session_reuse_count': 0})
+
+    def test_size(self):
+        pool = BrowserPool(size=2)
+        async def main():
+            return await gather(*[pool.render('http://fake') for _ in range(6)])
+        results = run(main())
+        self.assertEqual(len(set(results)), 2)
+        self.assertEqual(pool.launch_count, 2)
+        self.assertEqual(pool.stats()['idle'], 2)
+
+    def test_recycle_after_max_pages(self):
+        pool = BrowserPool(size=1, max_pages=2)
+        async def main():
+            return [await pool.render('http://fake') for _ in range(5)]
+        run(main())
+        self.assertEqual(pool.launch_count, 3)
+        self.assertEqual(pool.recycle_count, 2)
+
+    def test_recycle_after_max_age(self):
+        pool = BrowserPool(size=1, max_age=0)
+        async def main():
+            await pool.render('http://fake')
+            await pool.render('http://fake')
+        run(main())
+        self.assertEqual(pool.launch_count, 2)
+        self.assertEqual(pool.recycle_count, 2)
+
+    def test_health_check(self):
+        pool = BrowserPool(size=1)
+        async def main():
+            await pool.render('http://fake')
+            pool._idle[0].browser.process.returncode = 1
+            await pool.render('http://fake')
+        run(main())
+        self.assertEqual(pool.launch_count, 2)
+        self.assertEqual(pool.failure_count, 1)
+
+    def test_errors(self):
+        pool = BrowserPool(size=1)
+        async def main():
+            with self.assertRaises(BadUrl):
+                await pool.render('http://bad')
+            self.assertEqual(pool.stats()['idle'], 1)
+            with self.assertRaises(RuntimeError):
+                await pool.render('http://crash')
+            self.assertEqual(pool.stats()['idle'], 0)
+            await pool.render('http://fake')
+        run(main())
+        self.assertEqual(pool.stats()['busy'], 0)
+        self.assertEqual(pool.launch_count, 2)
+        self.assertEqual(pool.failure_count, 1)
+
+    def test_close(self):
+        pool = BrowserPool(size=1)
+        async def main():
+            await pool.render('http://fake')
+            browser = pool._idle[0].browser
+            await pool.close()
+            return browser
+        browser = run(main())
+        self.assertTrue(browser.closed)
+        self.assertEqual(pool.stats()['idle'], 0)
+
+    def test_resource_cache_slots(self):
+        with TemporaryDirectory() as cache_dir:
+            pool = BrowserPool(size=2, cache_dir=cache_dir, cache_size=1024)
+            other_pool = BrowserPool(size=1, cache_dir=cache_dir)
+            async def main():
+                await gather(*[pool.render('http://fake') for _ in range(6)])
+                await other_pool.render('http://fake')
+                self.assertEqual(sorted(pool._slots), [0, 1])
+                await pool.close()
+                self.assertEqual(pool._slots, {})
+                await pool.render('http://fake')
+                return other_pool._idle[0].browser, pool._idle[0].browser
+            other_browser, browser = run(main())
+            self.assertEqual(other_browser.args,
+                             ['--disk-cache-dir={0}'.format(join(cache_dir, 'slot-2'))])
+            self.assertEqual(browser.args, [
+                '--disk-cache-dir={0}'.format(join(cache_dir, 'slot-0')),
+                '--disk-cache-size=1024'])
+            run(other_pool.close())
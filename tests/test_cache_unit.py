@@ -0,0 +1,80 @@
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock
+
+from src.cache import DiskCache, MemoryCache, ScreenshotCache, cache_key
+
+
+class TestCacheUnit(TestCase):
+    def test_cache_key(self):
+        self.assertEqual(cache_key('http://fake', {'width': 100, 'height': 200}),
+                         cache_key('http://fake', {'height': 200, 'width': 100}))
+        self.assertNotEqual(cache_key('http://fake', {'width': 100}),
+                            cache_key('http://fake', {'width': 200}))
+        self.assertNotEqual(cache_key('http://fake', {}), cache_key('http://other', {}))
+
+    def test_memory_cache_lru(self):
+        cache = MemoryCache(max_entries=2)
+        cache.set('a', b'a')
+        cache.set('b', b'b')
+        self.assertEqual(cache.get('a'), b'a')
+        cache.set('c', b'c')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'a')
+        self.assertEqual(cache.get('c'), b'c')
+
+    def test_memory_cache_max_bytes(self):
+        cache = MemoryCache(max_bytes=4)
+        cache.set('a', b'aa')
+        cache.set('b', b'bb')
+        self.assertEqual(cache.size, 4)
+        cache.set('c', b'cc')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 4)
+        cache.set('d', b'ddddd')
+        self.assertIsNone(cache.get('d'))
+        cache.set('b', b'b')
+        self.assertEqual(cache.size, 3)
+
+    @mock.patch('src.cache.time')
+    def test_memory_cache_ttl(self, time_mock):
+        time_mock.return_value = 1000
+        cache = MemoryCache(ttl=10)
+        cache.set('a', b'a')
+        cache.set('b', b'b', ttl=100)
+        time_mock.return_value = 1010
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), b'b')
+        self.assertEqual(cache.size, 1)
+
+    def test_disk_cache(self):
+        with TemporaryDirectory() as directory:
+            cache = DiskCache(directory, ttl=10)
+            cache.set('a', b'a' * 10)
+            self.assertEqual(DiskCache(directory).get('a'), b'a' * 10)
+            cache.set('b', b'b', ttl=-1)
+            self.assertIsNone(cache.get('b'))
+            self.assertIsNone(cache.get('c'))
+            cache.delete('a')
+            self.assertIsNone(cache.get('a'))
+
+    def test_disk_cache_max_bytes(self):
+        with TemporaryDirectory() as directory:
+            cache = DiskCache(directory, max_bytes=40)
+            cache.set('a', b'a' * 10)
+            cache.set('b', b'b' * 10)
+            cache.set('c', b'c' * 10)
+            self.assertLessEqual(cache._size, 40)
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(cache.get('c'), b'c' * 10)
+
+    def test_screenshot_cache(self):
+        with TemporaryDirectory() as directory:
+            disk = DiskCache(directory)
+            cache = ScreenshotCache(MemoryCache(), disk)
+            self.assertIsNone(cache.get('a'))
+            disk.set('a', b'a')
+            self.assertEqual(cache.get('a'), b'a')
+            self.assertEqual(cache.memory.get('a'), b'a')
+            cache.set('b', b'b')
+            self.assertEqual(disk.get('b'), b'b')
+            self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'entries': 2, 'bytes': 2})
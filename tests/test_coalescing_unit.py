@@ -0,0 +1,89 @@
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from time import sleep
+from unittest import TestCase
+
+from src.coalescing import Coalescer, FileLockCoordinator, SingleFlight
+
+
+class TestCoalescingUnit(TestCase):
+    def test_single_flight(self):
+        single_flight = SingleFlight()
+        started = Event()
+        release = Event()
+        calls = []
+        results = []
+        def render():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return b'img'
+        def request():
+            results.append(single_flight.do('key', render))
+        leader = Thread(target=request)
+        leader.start()
+        started.wait()
+        followers = [Thread(target=request) for _ in range(5)]
+        for follower in followers:
+            follower.start()
+        sleep(0.2)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [(b'img', False)] + [(b'img', True)] * 5)
+        self.assertEqual(single_flight.shared_count, 5)
+        self.assertEqual(single_flight._calls, {})
+
+    def test_single_flight_exception(self):
+        single_flight = SingleFlight()
+        def render():
+            raise ValueError('bad')
+        with self.assertRaises(ValueError):
+            single_flight.do('key', render)
+        self.assertEqual(single_flight.do('key', lambda: b'img'), (b'img', False))
+
+    def test_file_lock_coordinator(self):
+        with TemporaryDirectory() as directory:
+            first = FileLockCoordinator(directory)
+            second = FileLockCoordinator(directory)
+            self.assertEqual(first.do('key', lambda: b'img'), (b'img', False))
+            self.assertEqual(second.do('key', lambda: b'other'), (b'img', True))
+            self.assertEqual(second.do('other_key', lambda: b'other'), (b'other', False))
+
+            expired = FileLockCoordinator(directory, result_ttl=-1)
+            self.assertEqual(expired.do('key', lambda: b'new'), (b'new', False))
+
+    def test_file_lock_coordinator_fresh(self):
+        with TemporaryDirectory() as directory:
+            first = FileLockCoordinator(directory)
+            second = FileLockCoordinator(directory)
+            first.do('key', lambda: b'img')
+            self.assertEqual(second.do('key', lambda: b'new', fresh=True), (b'new', False))
+
+            started = Event()
+            release = Event()
+            def render():
+                started.set()
+                release.wait()
+                return b'in flight'
+            leader = Thread(target=first.do, args=('other_key', render))
+            leader.start()
+            started.wait()
+            results = []
+            follower = Thread(target=lambda: results.append(
+                second.do('other_key', lambda: b'other', fresh=True)))
+            follower.start()
+            sleep(0.2)
+            release.set()
+            for thread in (leader, follower):
+                thread.join()
+            self.assertEqual(results, [(b'in flight', True)])
+
+    def test_coalescer(self):
+        self.assertEqual(Coalescer().do('key', lambda: b'img'), (b'img', False))
+        with TemporaryDirectory() as directory:
+            FileLockCoordinator(directory).do('key', lambda: b'img')
+            coalescer = Coalescer(FileLockCoordinator(directory))
+            self.assertEqual(coalescer.do('key', lambda: b'other'), (b'img', True))
+            self.assertEqual(coalescer.do('key', lambda: b'new', fresh=True), (b'new', False))
@@ -0,0 +1,160 @@
+from base64 import b64decode
+from io import BytesIO
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock
+
+from PIL import Image
+
+from src.compare import BaselineStore, compare_images
+from src.serializers import CompareSerializer
+
+
+def _png(width=64, height=48, boxes=()):
+    img = Image.new('RGB', (width, height), 'white')
+    for box in boxes:
+        img.paste((0, 0, 0), box)
+    output = BytesIO()
+    img.save(output, format='PNG')
+    return output.getvalue()
+
+
+class TestCompareUnit(TestCase):
+    def test_same_images(self):
+        result = compare_images(_png(), _png())
+        self.assertEqual(result['score'], 1)
+        self.assertEqual(result['rmsd'], 0)
+        self.assertEqual(result['changed_pixels'], 0)
+        self.assertEqual(result['boxes'], [])
+        self.assertFalse(result['size_changed'])
+        self.assertNotIn('diff_image', result)
+
+    def test_changed_images(self):
+        result = compare_images(_png(boxes=[(2, 2, 6, 6), (40, 30, 64, 48)]), _png(),
+                                diff_image=True)
+        self.assertEqual(result['changed_pixels'], 16 + 24 * 18)
+        self.assertAlmostEqual(result['score'], 1 - (16 + 24 * 18) / (64 * 48))
+        self.assertGreater(result['rmsd'], 0)
+        self.assertEqual(result['boxes'], [{'x': 0, 'y': 0, 'width': 16, 'height': 16},
+                                           {'x': 32, 'y': 16, 'width': 32, 'height': 32}])
+        diff = Image.open(BytesIO(result['diff_image']))
+        self.assertEqual(diff.size, (64, 48))
+        self.assertEqual(diff.getpixel((3, 3)), (255, 0, 0))
+        self.assertEqual(diff.getpixel((10, 10)), (255, 255, 255))
+
+    def test_bands(self):
+        img = _png(boxes=[(2, 2, 6, 6), (40, 30, 64, 48)])
+        baseline = _png(64, 40, boxes=[(0, 0, 3, 3)])
+        result = compare_images(img, baseline, diff_image=True)
+        with mock.patch('src.compare.BAND_PIXELS', 100):
+            banded = compare_images(img, baseline, diff_image=True)
+        self.assertAlmostEqual(banded.pop('rmsd'), result.pop('rmsd'))
+        self.assertEqual(banded, result)
+
+    def test_tolerance(self):
+        img = Image.new('RGB', (10, 10), (250, 250, 250))
+        output = BytesIO()
+        img.save(output, format='PNG')
+        self.assertEqual(compare_images(output.getvalue(), _png(10, 10))['changed_pixels'], 0)
+        self.assertEqual(compare_images(output.getvalue(), _png(10, 10),
+                                        tolerance=0)['changed_pixels'], 100)
+
+    def test_size_changed(self):
+        result = compare_images(_png(64, 64, boxes=[(0, 48, 64, 64)]), _png())
+        self.assertTrue(result['size_changed'])
+        self.assertEqual(result['changed_pixels'], 64 * 16)
+        self.assertEqual(result['boxes'], [{'x': 0, 'y': 48, 'width': 64, 'height': 16}])
+
+    def test_too_large(self):
+        with mock.patch('src.compare.settings.COMPARE_MAX_WIDTH', 63):
+            with self.assertRaises(ValueError):
+                compare_images(_png(32, 48), _png())
+        with mock.patch('src.compare.settings.FULL_PAGE_MAX_HEIGHT', 47):
+            with self.assertRaises(ValueError):
+                compare_images(_png(), _png(64, 32))
+
+    def test_baseline_store(self):
+        with TemporaryDirectory() as directory:
+            store = BaselineStore(directory + '/baselines')
+            self.assertFalse(store.exists('home'))
+            self.assertIsNone(store.get('home'))
+            store.set('home', b'img')
+            store.set('home', b'img2')
+            self.assertTrue(store.exists('home'))
+            self.assertEqual(store.get('home'), b'img2')
+
+
+class TestCompareSerializerUnit(TestCase):
+    def test_is_valid(self):
+        with TemporaryDirectory() as directory:
+            with mock.patch('src.serializers.get_baseline_store',
+                            lambda: BaselineStore(directory)):
+                serializer = CompareSerializer('http://fake', raw_data={
+                    'baseline_key': 'home', 'update_baseline': 'true', 'width': '100'})
+                self.assertTrue(serializer.is_valid())
+                self.assertEqual(serializer.screenshot.data, {'width': 100})
+                self.assertTrue(serializer.update_baseline)
+                self.assertEqual(serializer.tolerance, 16)
+
+                serializer = CompareSerializer('http://fake', baseline=_png())
+                self.assertTrue(serializer.is_valid())
+
+                for raw_data, baseline, errors in (
+                        ({}, None, ['No baseline']),
+                        ({'baseline_key': 'home'}, None, ['Unknown baseline: "home"']),
+                        ({'baseline_key': '../home'}, None, ['Bad baseline_key']),
+                        ({}, b'not an image', ['Bad baseline: the file is not an image']),
+                        ({'tolerance': '300', 'diff_image': 'maybe'}, _png(),
+                         ['Bad diff_image value', 'Bad tolerance']),
+                        ({'format': 'jpeg'}, _png(),
+                         ['Bad compare: only a png screenshot can be compared']),
+                        ({'width': 'big'}, _png(), ['Bad width']),
+                        ({}, _png(64, 16385), ['Bad baseline: Image too large to compare: '
+                                               '64x16385, the maximum is 4096x16384'])):
+                    serializer = CompareSerializer('http://fake', raw_data=raw_data,
+                                                   baseline=baseline)
+                    self.assertFalse(serializer.is_valid())
+                    self.assertEqual(serializer.errors, errors)
+
+    @mock.patch('src.serializers.ScreenshotSerializer.get_object')
+    def test_compare(self, get_object_mock):
+        get_object_mock.return_value = _png(boxes=[(0, 0, 4, 4)])
+        with TemporaryDirectory() as directory:
+            store = BaselineStore(directory)
+            with mock.patch('src.serializers.get_baseline_store', lambda: store):
+                serializer = CompareSerializer('http://fake', raw_data={
+                    'baseline_key': 'home', 'update_baseline': 'true'})
+                self.assertTrue(serializer.is_valid())
+                self.assertEqual(serializer.compare(),
+                                 {'baseline_key': 'home', 'baseline_updated': True})
+                self.assertEqual(store.get('home'), _png(boxes=[(0, 0, 4, 4)]))
+
+                serializer = CompareSerializer('http://fake', raw_data={
+                    'baseline_key': 'home', 'diff_image': 'true'}, baseline=_png())
+                self.assertTrue(serializer.is_valid())
+                result = serializer.compare()
+                self.assertEqual(result['changed_pixels'], 16)
+                self.assertEqual(result['boxes'], [{'x': 0, 'y': 0, 'width': 16, 'height': 16}])
+                self.assertEqual(Image.open(BytesIO(b64decode(result['diff_image']))).size,
+                                 (64, 48))
+                self.assertNotIn('baseline_updated', result)
+                self.assertEqual(store.get('home'), _png())
+
+                get_object_mock.return_value = None
+                serializer = CompareSerializer('http://fake', raw_data={'baseline_key': 'home'})
+                serializer.screenshot.errors.append('url unknown: "http://fake"')
+                self.assertIsNone(serializer.compare())
+                self.assertEqual(serializer.errors, ['url unknown: "http://fake"'])
+
+                with mock.patch('src.serializers.render_slot') as render_slot_mock:
+                    get_object_mock.return_value = _png()
+                    serializer = CompareSerializer('http://fake', baseline=_png())
+                    self.assertTrue(serializer.is_valid())
+                    self.assertEqual(serializer.compare()['changed_pixels'], 0)
+                render_slot_mock.return_value.__enter__.assert_called_once_with()
+
+                get_object_mock.return_value = _png(4097, 1)
+                serializer = CompareSerializer('http://fake', baseline=_png())
+                self.assertTrue(serializer.is_valid())
+                self.assertIsNone(serializer.compare())
+                self.assertEqual(serializer.errors, ['Image too large to compare: 4097x1, the '
+                                                     'maximum is 4096x16384'])
@@ -0,0 +1,130 @@
+from io import BytesIO
+from unittest import TestCase, mock
+
+from PIL import Image
+
+from src.conditional import (PerceptualHashCache, content_etag, dhash, hamming_distance,
+                             parse_etags)
+from src.serializers import ScreenshotSerializer
+
+
+def _png(width=64, height=48, boxes=()):
+    img = Image.new('RGB', (width, height), 'white')
+    for box in boxes:
+        img.paste((0, 0, 0), box)
+    output = BytesIO()
+    img.save(output, format='PNG')
+    return output.getvalue()
+
+
+class TestConditionalUnit(TestCase):
+    def test_content_etag(self):
+        self.assertEqual(len(content_etag(b'img')), 32)
+        self.assertEqual(content_etag(b'img'), content_etag(b'img'))
+        self.assertNotEqual(content_etag(b'img'), content_etag(b'other'))
+
+    def test_parse_etags(self):
+        self.assertEqual(parse_etags(None), [])
+        self.assertEqual(parse_etags('"a", W/"b" ,*'), ['a', 'b', '*'])
+
+    def test_dhash(self):
+        self.assertEqual(dhash(_png()), '0' * 16)
+        right_black = _png(boxes=[(32, 0, 64, 48)])
+        self.assertGreaterEqual(hamming_distance(dhash(_png()), dhash(right_black)), 8)
+        noisy = _png(boxes=[(32, 0, 64, 48), (0, 0, 1, 1)])
+        self.assertLessEqual(hamming_distance(dhash(right_black), dhash(noisy)), 1)
+
+        self.assertEqual(dhash(_png(), max_pixels=64 * 48), '0' * 16)
+        img = _png()
+        with mock.patch('src.conditional.Image.Image.load') as load_mock:
+            with self.assertRaises(ValueError):
+                dhash(img, max_pixels=64 * 48 - 1)
+        load_mock.assert_not_called()
+
+        output = BytesIO()
+        Image.new('P', (64, 48)).save(output, format='PNG')
+        self.assertEqual(dhash(output.getvalue()), '0' * 16)
+
+    def test_hamming_distance(self):
+        self.assertEqual(hamming_distance('0000000000000000', '0000000000000000'), 0)
+        self.assertEqual(hamming_distance('0000000000000000', '000000000000000f'), 4)
+        self.assertEqual(hamming_distance('ffffffffffffffff', '0000000000000000'), 64)
+
+    @mock.patch('src.conditional.dhash')
+    def test_perceptual_hash_cache(self, dhash_mock):
+        dhash_mock.side_effect = lambda bytes_img, max_pixels: bytes_img.decode('ascii')
+        cache = PerceptualHashCache(max_entries=2)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.hash('a', b'hash a'), 'hash a')
+        self.assertEqual(cache.hash('a', b'other'), 'hash a')
+        self.assertEqual(dhash_mock.call_count, 1)
+        cache.set('b', 'hash b')
+        cache.get('a')
+        cache.set('c', 'hash c')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'hash a')
+
+
+@mock.patch('src.serializers.get_phash_cache', lambda cache=PerceptualHashCache(16): cache)
+class TestConditionalSerializerUnit(TestCase):
+    def test_conditional_headers(self):
+        img = _png(boxes=[(32, 0, 64, 48)])
+        etag = '"{0}"'.format(content_etag(img))
+        serializer = ScreenshotSerializer('http://fake')
+        headers, not_modified = serializer.conditional_headers(img, 'image/png')
+        self.assertEqual(headers, {'ETag': etag, 'X-Perceptual-Hash': dhash(img)})
+        self.assertFalse(not_modified)
+        self.assertIn('hash', serializer.timings)
+
+        _, not_modified = serializer.conditional_headers(img, 'image/png', '"other", ' + etag)
+        self.assertTrue(not_modified)
+        _, not_modified = serializer.conditional_headers(img, 'image/png', '*')
+        self.assertTrue(not_modified)
+
+        headers, not_modified = serializer.conditional_headers(b'{}', 'application/json')
+        self.assertEqual(headers, {'ETag': '"{0}"'.format(content_etag(b'{}'))})
+        self.assertFalse(not_modified)
+
+    def test_perceptual_threshold(self):
+        img = _png(boxes=[(32, 0, 64, 48)])
+        noisy = _png(boxes=[(32, 0, 64, 48), (0, 0, 1, 1)])
+        etag = '"{0}"'.format(content_etag(img))
+        serializer = ScreenshotSerializer('http://fake')
+        serializer.conditional_headers(img, 'image/png')
+
+        _, not_modified = serializer.conditional_headers(noisy, 'image/png', etag)
+        self.assertFalse(not_modified)
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'perceptual_threshold': '4'})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.options['perceptual_threshold'], 4)
+        headers, not_modified = serializer.conditional_headers(noisy, 'image/png', etag)
+        self.assertTrue(not_modified)
+        self.assertEqual(headers['ETag'], etag)
+        self.assertLessEqual(int(headers['X-Perceptual-Distance']), 4)
+
+        headers, not_modified = serializer.conditional_headers(_png(), 'image/png', etag)
+        self.assertFalse(not_modified)
+        self.assertNotEqual(headers['ETag'], etag)
+
+        for value in ('-1', '65', 'coucou'):
+            serializer = ScreenshotSerializer('http://fake',
+                                              raw_data={'perceptual_threshold': value})
+            self.assertFalse(serializer.is_valid())
+            self.assertEqual(serializer.errors, ['Bad perceptual_threshold'])
+
+    def test_serialize_not_modified(self):
+        img = _png()
+        serializer = ScreenshotSerializer('http://fake')
+        serializer.cache_status = 'HIT'
+        response = serializer.serialize(bytes_obj=img,
+                                        if_none_match='"{0}"'.format(content_etag(img)))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+        self.assertEqual(response.headers['ETag'], '"{0}"'.format(content_etag(img)))
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+
+        response = serializer.serialize(bytes_obj=img, if_none_match='"other"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(), img)
+        self.assertEqual(response.headers['X-Perceptual-Hash'], dhash(img))
@@ -0,0 +1,119 @@
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock
+
+from src.jobs import (DONE, FAILED, PENDING, Job, JobManager, MemoryJobStore, QueueFullError,
+                      SQLiteJobStore)
+
+
+class ScreenshotSerializer():
+    def __init__(self, url, raw_data=None):
+        self.url = url
+        self.raw_data = raw_data
+        self.errors = []
+    def get_object(self):
+        if self.url == 'http://bad':
+            self.errors.append('url unknown: "http://bad"')
+            return None
+        if self.url == 'http://crash':
+            raise RuntimeError('Target closed')
+        return b'img'
+
+
+class TestJobStoresUnit(TestCase):
+    def _test_store(self, store):
+        job = Job('http://fake', raw_data={'width': '100'}, callback_url='http://callback')
+        store.add(job)
+        stored = store.get(job.id)
+        self.assertEqual(stored.to_dict(), job.to_dict())
+        self.assertEqual(stored.raw_data, {'width': '100'})
+        self.assertEqual(stored.callback_url, 'http://callback')
+
+        job.status = DONE
+        job.result = b'img'
+        store.save(job)
+        self.assertEqual(store.get(job.id).status, DONE)
+        self.assertEqual(store.get(job.id).result, b'img')
+        self.assertIsNone(store.get('unknown'))
+
+        expired = Job('http://fake', ttl=-1)
+        store.add(expired)
+        self.assertIsNone(store.get(expired.id))
+        store.purge()
+        self.assertIsNotNone(store.get(job.id))
+
+    def test_memory_store(self):
+        store = MemoryJobStore()
+        self._test_store(store)
+        self.assertEqual(len(store._jobs), 1)
+
+    def test_sqlite_store(self):
+        with TemporaryDirectory() as directory:
+            store = SQLiteJobStore(join(directory, 'jobs.sqlite3'))
+            self._test_store(store)
+            self.assertEqual(
+                store._connection.execute('SELECT COUNT(*) FROM jobs').fetchone(), (1,))
+
+    def test_sqlite_store_credentials(self):
+        with TemporaryDirectory() as directory:
+            store = SQLiteJobStore(join(directory, 'jobs.sqlite3'))
+            credentials = {'login': 'user', 'password': 'secret'}
+            job = Job('http://fake', raw_data={'width': '100', 'credentials': credentials})
+            store.add(job)
+            self.assertEqual(store.get(job.id).raw_data,
+                             {'width': '100', 'credentials': credentials})
+            self.assertEqual(
+                store._connection.execute('SELECT raw_data FROM jobs').fetchone(),
+                ('{"width": "100"}',))
+
+            other = SQLiteJobStore(join(directory, 'jobs.sqlite3'))
+            self.assertEqual(other.get(job.id).raw_data, {'width': '100'})
+
+            job.status = DONE
+            store.save(job)
+            self.assertEqual(store._credentials, {})
+            self.assertEqual(store.get(job.id).raw_data, {'width': '100'})
+            with open(join(directory, 'jobs.sqlite3'), 'rb') as database:
+                self.assertNotIn(b'secret', database.read())
+
+
+@mock.patch('src.jobs.ScreenshotSerializer', ScreenshotSerializer)
+class TestJobManagerUnit(TestCase):
+    def test_run(self):
+        manager = JobManager(MemoryJobStore())
+        for url, status, result, errors in (
+                ('http://fake', DONE, b'img', []),
+                ('http://bad', FAILED, None, ['url unknown: "http://bad"']),
+                ('http://crash', FAILED, None, ['Target closed'])):
+            job = Job(url)
+            manager.run(job)
+            self.assertEqual(job.status, status)
+            self.assertEqual(job.result, result)
+            self.assertEqual(job.errors, errors)
+
+    @mock.patch('src.jobs.urlopen')
+    def test_callback(self, urlopen_mock):
+        manager = JobManager(MemoryJobStore())
+        manager.run(Job('http://fake', callback_url='http://callback'))
+        request = urlopen_mock.call_args[0][0]
+        self.assertEqual(request.full_url, 'http://callback')
+        self.assertIn(b'"status": "done"', request.data)
+
+        urlopen_mock.side_effect = OSError('Connection refused')
+        manager.run(Job('http://fake', callback_url='http://callback'))
+
+    def test_submit(self):
+        manager = JobManager(MemoryJobStore(), max_queued=1)
+        with mock.patch.object(manager, '_start') as start_mock:
+            job = manager.submit('http://fake', raw_data={'width': '100'})
+            start_mock.assert_called_once_with()
+        self.assertEqual(manager.store.get(job.id).status, PENDING)
+        with self.assertRaises(QueueFullError) as context:
+            manager.submit('http://fake')
+        self.assertEqual(context.exception.retry_after, 1)
+
+    def test_worker(self):
+        manager = JobManager(MemoryJobStore(), workers=1)
+        job = manager.submit('http://fake')
+        manager._queue.join()
+        self.assertEqual(manager.store.get(job.id).status, DONE)
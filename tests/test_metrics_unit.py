@@ -0,0 +1,55 @@
+from unittest import TestCase
+
+from src.metrics import Counter, Gauge, Histogram, Registry, server_timing, time_stage
+
+
+class TestMetricsUnit(TestCase):
+    def test_counter(self):
+        counter = Counter('errors_total', 'Errors.', ['type'])
+        counter.inc(type='BadUrl')
+        counter.inc(2, type='BadUrl')
+        counter.inc(type='validation')
+        self.assertEqual(counter.get(type='BadUrl'), 3)
+        self.assertEqual(counter.collect(), ['# HELP errors_total Errors.',
+                                             '# TYPE errors_total counter',
+                                             'errors_total{type="BadUrl"} 3',
+                                             'errors_total{type="validation"} 1'])
+
+    def test_gauge(self):
+        gauge = Gauge('in_flight', 'In flight.')
+        with gauge.track():
+            self.assertEqual(gauge.get(), 1)
+        self.assertEqual(gauge.get(), 0)
+        gauge.set(5)
+        self.assertEqual(gauge.collect()[-1], 'in_flight 5')
+
+    def test_histogram(self):
+        histogram = Histogram('duration', 'Duration.', ['stage'], buckets=(1, 5))
+        histogram.observe(0.5, stage='render')
+        histogram.observe(3, stage='render')
+        histogram.observe(10, stage='render')
+        self.assertEqual(histogram.collect()[2:], [
+            'duration_bucket{stage="render",le="1"} 1',
+            'duration_bucket{stage="render",le="5"} 2',
+            'duration_bucket{stage="render",le="+Inf"} 3',
+            'duration_sum{stage="render"} 13.5',
+            'duration_count{stage="render"} 3'])
+
+    def test_registry(self):
+        registry = Registry()
+        registry.register(Counter('requests_total', 'Requests.')).inc()
+        registry.register_collector(lambda: [('browsers_idle', 'gauge', 'Idle browsers.', 2)])
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP requests_total Requests.', '# TYPE requests_total counter',
+            'requests_total 1', '# HELP browsers_idle Idle browsers.',
+            '# TYPE browsers_idle gauge', 'browsers_idle 2']) + '\n')
+
+    def test_time_stage(self):
+        timings = {}
+        with time_stage(timings, 'render'):
+            pass
+        with time_stage(timings, 'render'):
+            pass
+        self.assertEqual(list(timings), ['render'])
+        self.assertEqual(server_timing({'validate': 0.0001, 'render': 1.5}),
+                         'validate;dur=0.1, render;dur=1500.0')
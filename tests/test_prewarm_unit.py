@@ -0,0 +1,155 @@
+from time import localtime, mktime
+from unittest import TestCase, mock
+
+from src.prewarm import BadSchedule, Prewarmer, Schedule
+from src.serializers import ScreenshotSerializer
+
+
+def _serializer(url, raw_data=None):
+    serializer = ScreenshotSerializer(url, raw_data=raw_data)
+    serializer.is_valid()
+    return serializer
+
+
+class FakeSerializer():
+    calls = []
+    def __init__(self, url, raw_data=None):
+        self.url = url
+        self.raw_data = raw_data
+        self.errors = []
+    def get_object(self):
+        FakeSerializer.calls.append((self.url, self.raw_data))
+        if self.url == 'http://bad':
+            self.errors.append('url unknown: "http://bad"')
+            return None
+        return b'img'
+
+
+class TestScheduleUnit(TestCase):
+    def test_interval(self):
+        self.assertEqual(Schedule('300').next_run(1000), 1300)
+        for spec in ('0', '-5', '* * *', '61 * * * *', '*/0 * * * *', '5-1 * * * *', 'a b c d e'):
+            with self.assertRaises(BadSchedule):
+                Schedule(spec)
+
+    def test_cron(self):
+        # A monday
+        after = mktime((2024, 1, 1, 10, 7, 30, 0, 0, -1))
+        date = localtime(Schedule('*/15 * * * *').next_run(after))
+        self.assertEqual((date.tm_hour, date.tm_min), (10, 15))
+        date = localtime(Schedule('0 3 * * *').next_run(after))
+        self.assertEqual((date.tm_mday, date.tm_hour, date.tm_min), (2, 3, 0))
+        date = localtime(Schedule('30 9-17/4 * * 0,6').next_run(after))
+        self.assertEqual((date.tm_mday, date.tm_hour, date.tm_min), (6, 9, 30))
+        date = localtime(Schedule('0 0 1 3 *').next_run(after))
+        self.assertEqual((date.tm_mon, date.tm_mday), (3, 1))
+        # The next february 29th is more than a year after
+        after = mktime((2024, 3, 1, 0, 0, 0, 0, 0, -1))
+        date = localtime(Schedule('0 0 29 2 *').next_run(after))
+        self.assertEqual((date.tm_year, date.tm_mon, date.tm_mday), (2028, 2, 29))
+        # The first february 29th on a monday after 2024 is in 2044
+        date = localtime(Schedule('0 0 29 2 1').next_run(after))
+        self.assertEqual((date.tm_year, date.tm_mon, date.tm_mday), (2044, 2, 29))
+
+        for spec in ('0 0 31 2 *', '0 0 30 2 *', '0 0 31 4,6,9,11 *'):
+            with self.assertRaises(BadSchedule):
+                Schedule(spec)
+
+
+class TestPrewarmerUnit(TestCase):
+    def test_record(self):
+        prewarmer = Prewarmer(top=1)
+        for _ in range(3):
+            prewarmer.record(_serializer('http://hot', {'width': '100'}))
+        prewarmer.record(_serializer('http://cold'))
+        prewarmer.record(_serializer('http://fake', {'width': 'a'}))
+        prewarmer.record(_serializer('http://fake', {'credentials': {'token': 'a',
+                                                                     'token_in_header': True}}))
+        prewarmer.record(_serializer('http://fake', {'cache': 'bypass'}))
+        entries = prewarmer.entries()
+        self.assertEqual([(entry.url, entry.hits) for entry in entries],
+                         [('http://hot', 3), ('http://cold', 1)])
+        self.assertEqual(entries[0].raw_data, {'width': '100'})
+        self.assertEqual(entries[0].key, _serializer('http://hot', {'width': '100'}).cache_key())
+        self.assertEqual([entry.url for entry in prewarmer.warm_entries()], ['http://hot'])
+
+        prewarmer.record(_serializer('http://hot', {'width': '100', 'format': 'jpeg'}))
+        self.assertEqual(prewarmer.entries()[0].hits, 4)
+
+    def test_max_tracked(self):
+        prewarmer = Prewarmer(max_tracked=2)
+        prewarmer.pin(_serializer('http://pinned'))
+        prewarmer.record(_serializer('http://a'))
+        prewarmer.record(_serializer('http://a'))
+        prewarmer.record(_serializer('http://b'))
+        self.assertEqual([entry.url for entry in prewarmer.entries()],
+                         ['http://pinned', 'http://b'])
+
+    def test_pin(self):
+        prewarmer = Prewarmer(top=0)
+        entry = prewarmer.pin(_serializer('http://pinned'))
+        prewarmer.record(_serializer('http://hot'))
+        self.assertEqual([entry.url for entry in prewarmer.warm_entries()], ['http://pinned'])
+        self.assertTrue(prewarmer.unpin(entry.key))
+        self.assertFalse(prewarmer.unpin(entry.key))
+        self.assertFalse(prewarmer.unpin('unknown'))
+        self.assertEqual([entry.url for entry in prewarmer.entries()], ['http://hot'])
+
+    @mock.patch('src.prewarm.ScreenshotSerializer', FakeSerializer)
+    def test_run(self):
+        FakeSerializer.calls = []
+        prewarmer = Prewarmer(top=2)
+        prewarmer.pin(_serializer('http://bad'))
+        for url, count in (('http://a', 4), ('http://b', 2), ('http://c', 1)):
+            for _ in range(count):
+                prewarmer.record(_serializer(url, {'width': '100'}))
+        prewarmer.run()
+        self.assertEqual(FakeSerializer.calls, [
+            ('http://bad', {'cache': 'refresh'}),
+            ('http://a', {'width': '100', 'cache': 'refresh'}),
+            ('http://b', {'width': '100', 'cache': 'refresh'})])
+        entries = {entry.url: entry for entry in prewarmer.entries()}
+        self.assertEqual(entries['http://bad'].errors, ['url unknown: "http://bad"'])
+        self.assertIsNotNone(entries['http://a'].last_run)
+        self.assertEqual((entries['http://a'].hits, entries['http://b'].hits), (2, 1))
+        self.assertEqual(entries['http://c'].hits, 0.5)
+        self.assertEqual(prewarmer.run_count, 1)
+
+        state = prewarmer.to_dict()
+        self.assertEqual(state['schedule'], None)
+        self.assertEqual([(entry['url'], entry['warm']) for entry in state['entries']],
+                         [('http://bad', True), ('http://a', True), ('http://b', True),
+                          ('http://c', False)])
+
+        prewarmer.run()
+        self.assertEqual([entry.url for entry in prewarmer.entries()],
+                         ['http://bad', 'http://a', 'http://b'])
+
+    def test_thread(self):
+        prewarmer = Prewarmer()
+        prewarmer.record(_serializer('http://a'))
+        self.assertIsNone(prewarmer._thread)
+
+        prewarmer = Prewarmer(schedule=Schedule('3600'))
+        prewarmer.record(_serializer('http://a'))
+        thread = prewarmer._thread
+        self.assertTrue(thread.is_alive())
+        prewarmer.record(_serializer('http://a'))
+        self.assertIs(prewarmer._thread, thread)
+        prewarmer.stop()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+
+    def test_thread_without_next_run(self):
+        schedule = Schedule('3600')
+        prewarmer = Prewarmer(schedule=schedule)
+        with mock.patch.object(schedule, 'next_run', return_value=None), \
+                mock.patch('src.prewarm.RETRY_DELAY', 0.01):
+            prewarmer.record(_serializer('http://a'))
+            prewarmer._stop.wait(0.1)
+            self.assertTrue(prewarmer._thread.is_alive())
+            self.assertGreater(schedule.next_run.call_count, 1)
+        self.assertEqual(prewarmer.run_count, 0)
+        prewarmer.stop()
+        prewarmer._thread.join(1)
+        self.assertFalse(prewarmer._thread.is_alive())
@@ -1,7 +1,13 @@
-from tempfile import _TemporaryFileWrapper
+from io import BytesIO
+from json import dumps, loads
+from threading import Event
+from time import monotonic
 from unittest import TestCase, mock
+from zipfile import ZipFile
 
-from src.serializers import ScreenshotSerializer
+from src.archive import stream_zip
+from src.cache import MemoryCache
+from src.serializers import BatchScreenshotSerializer, ScreenshotSerializer, collapse_values
 SCREAMSHOT_PARAMETERS = ['width', 'height',
                          'wait_until', 'credentials', 'selector', 'wait_for']
 
@@ -91,9 +97,68 @@ class TestSerializerUnit(TestCase):
         self.assertEqual(serializer.errors, [])
         self.assertTrue(serializer.valid)
 
-    @mock.patch('src.serializers.generate_bytes_img_wrap')
-    def test_get_object(self, mock_generate_bytes_img_wrap):
-        mock_generate_bytes_img_wrap.side_effect = lambda a: a
+    def test_validate_wait_until(self):
+        for wait_until, expected in (('networkidle0', 'networkidle0'),
+                                     (['load', 'load'], 'load'),
+                                     ('networkidle0,load', ['load', 'networkidle0']),
+                                     (['networkidle0', 'load'], ['load', 'networkidle0'])):
+            serializer = ScreenshotSerializer('http://fake', raw_data={'wait_until': wait_until})
+            self.assertTrue(serializer.is_valid())
+            self.assertEqual(serializer.data, {'wait_until': expected})
+
+        for wait_until in ('loa', 'load,soon', ['load', 1], {'load': 1}):
+            serializer = ScreenshotSerializer('http://fake', raw_data={'wait_until': wait_until})
+            self.assertFalse(serializer.is_valid())
+            self.assertEqual(serializer.errors, ['Bad wait_until value'])
+
+    def test_validate_credentials_json(self):
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'credentials': '{"username": "makina", "password": "makina"}'})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.data['credentials'], {'username': 'makina',
+                                                          'password': 'makina'})
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'credentials': '{"username": "makina"}'})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, ['Bad credentials: a password must be specified'])
+
+        for credentials in ('username', '["username"]'):
+            serializer = ScreenshotSerializer('http://fake', raw_data={'credentials': credentials})
+            self.assertFalse(serializer.is_valid())
+            self.assertEqual(serializer.errors, ['Bad credentials: a json object must be given'])
+
+    def test_cache_key(self):
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'width': '100', 'wait_until': 'networkidle0,load', 'cache': 'refresh'})
+        self.assertTrue(serializer.is_valid())
+        other = ScreenshotSerializer('http://fake', raw_data={
+            'wait_until': ['load', 'networkidle0'], 'width': 100, 'format': 'jpeg'})
+        self.assertTrue(other.is_valid())
+        self.assertEqual(serializer.cache_key(), other.cache_key())
+        self.assertNotEqual(serializer.cache_key(),
+                            ScreenshotSerializer('http://other').cache_key())
+
+        with mock.patch('src.serializers.cache_key') as cache_key_mock:
+            serializer = ScreenshotSerializer('http://fake')
+            serializer.is_valid()
+            serializer.cache_key()
+            serializer.cache_key()
+        cache_key_mock.assert_called_once_with('http://fake', {})
+
+    def test_is_valid_once(self):
+        serializer = ScreenshotSerializer('http://fake', raw_data={'width': 'coucou'})
+        self.assertFalse(serializer.is_valid())
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, ['Bad width'])
+        with self.assertRaises(AttributeError):
+            serializer.unknown = 1
+
+    @mock.patch('src.serializers.get_screenshot_cache')
+    @mock.patch('src.serializers.render_wrap')
+    def test_get_object(self, mock_render_wrap, mock_get_screenshot_cache):
+        mock_render_wrap.side_effect = lambda a, **kwargs: a
+        mock_get_screenshot_cache.return_value = MemoryCache(ttl=0)
 
         serializer = ScreenshotSerializer('http://fake')
         serializer.get_object()
@@ -108,47 +173,426 @@ class TestSerializerUnit(TestCase):
         serializer.get_object()
         self.assertEqual(serializer.bytes_img, 'http://fake')
 
-    @mock.patch('src.serializers.BytesIO')
-    @mock.patch('src.serializers.image_opener')
-    @mock.patch('src.serializers.send_file')
-    def test_generic_serializer(self, send_file_mock, image_opener_mock, BytesIO_mock):
-        class Image():
-            def save(self, path):
-                return path
-        class TempFile():
-            def __init__(self, name):
-                self.name = name
-        def send_file(path, attachment_filename=None):
-            return path, attachment_filename
-        send_file_mock.side_effect = send_file
-        image_opener_mock.side_effect = lambda a: Image()
-        BytesIO_mock = lambda a: a
+    @mock.patch('src.serializers.get_screenshot_cache')
+    @mock.patch('src.serializers.render_wrap')
+    def test_get_object_cache(self, mock_render_wrap, mock_get_screenshot_cache):
+        mock_render_wrap.side_effect = lambda a, **kwargs: b'rendered'
+        cache = MemoryCache()
+        mock_get_screenshot_cache.return_value = cache
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'width': '100'})
+        self.assertEqual(serializer.get_object(), b'rendered')
+        self.assertEqual(serializer.cache_status, 'MISS')
+        cache.set(serializer.cache_key(), b'cached')
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'width': '100'})
+        self.assertEqual(serializer.get_object(), b'cached')
+        self.assertEqual(serializer.cache_status, 'HIT')
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'width': '100',
+                                                                   'cache': 'bypass'})
+        self.assertEqual(serializer.get_object(), b'rendered')
+        self.assertEqual(serializer.cache_status, 'BYPASS')
+        self.assertEqual(cache.get(serializer.cache_key()), b'cached')
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'width': '100',
+                                                                   'cache': 'refresh'})
+        self.assertEqual(serializer.get_object(), b'rendered')
+        self.assertEqual(serializer.cache_status, 'REFRESH')
+        self.assertEqual(cache.get(serializer.cache_key()), b'rendered')
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'cache': 'never'})
+        self.assertIsNone(serializer.get_object())
+        self.assertEqual(serializer.errors, ['Bad cache value'])
+
+    def test_validate_transform(self):
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'format': 'JPEG', 'quality': '80', 'thumbnail_width': '200',
+            'thumbnail_height': '100', 'fit': 'cover'})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.data, {})
+        self.assertEqual(serializer.transform, {'image_format': 'jpeg', 'quality': 80,
+                                                'width': 200, 'height': 100, 'fit': 'cover'})
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'format': 'png', 'fit': 'fill'})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.transform, {})
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'format': 'gif', 'quality': '0', 'compress_level': '10', 'thumbnail_width': 'big',
+            'thumbnail_height': '-1', 'fit': 'crop'})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, ['Bad format value', 'Bad fit value', 'Bad quality',
+                                             'Bad compress_level', 'Bad thumbnail_width',
+                                             'Bad thumbnail_height'])
+
+        with mock.patch('src.serializers.jsonify') as jsonify_mock:
+            jsonify_mock.side_effect = lambda a: a
+            serializer = ScreenshotSerializer('http://fake', raw_data={
+                'thumbnail_width': '100000', 'thumbnail_height': '4097'})
+            self.assertEqual(serializer.serialize(), (
+                {'errors': ['Bad thumbnail_width', 'Bad thumbnail_height']}, 400))
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'format': ['png', 'jpeg'], 'fit': ['cover'], 'cache': ['use', 'bypass']})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, ['Bad cache value', 'Bad format value',
+                                             'Bad fit value'])
+
+    def test_validate_full_page(self):
+        serializer = ScreenshotSerializer('http://fake', raw_data={'full_page': 'true'})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.data, {'full_page': True, 'max_height': 16384})
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'full_page': 'false', 'tiles': 'on', 'max_height': '2000'})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.data, {'tiles': True, 'max_height': 2000})
+        self.assertEqual(serializer.get_output(b'zip'), (b'zip', 'application/zip'))
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'full_page': 'false'})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.data, {})
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'full_page': 'maybe', 'max_height': '100000'})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, ['Bad full_page value', 'Bad max_height'])
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'max_height': '100'})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors,
+                         ['Bad max_height: full_page or tiles must be specified'])
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'tiles': '1', 'selector': '#godot', 'format': 'jpeg'})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, ['Bad full_page: a selector cannot be specified',
+                                             'Bad tiles: the images of an archive cannot be '
+                                             'transformed'])
+
+    def test_validate_viewports(self):
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'width': ['375', '768', '1280'], 'height': ['667', '1024', '']})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.data, {'viewports': [{'width': 375, 'height': 667},
+                                                         {'width': 768, 'height': 1024},
+                                                         {'width': 1280, 'height': 600}]})
+        self.assertEqual(serializer.get_output(b'zip'), (b'zip', 'application/zip'))
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'width': ['375', '768'], 'height': '500', 'full_page': 'true'})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.data['viewports'], [{'width': 375, 'height': 500},
+                                                        {'width': 768, 'height': 500}])
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'width': ['375', '768'], 'height': ['500', '600', '700']})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors,
+                         ['Bad viewports: as many widths as heights must be given'])
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'width': ['375', 'big']})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, ['Bad width'])
+
+        for raw_data, errors in (({'width': '0'}, ['Bad width']),
+                                 ({'width': 0, 'height': '-1'}, ['Bad width', 'Bad height']),
+                                 ({'width': ['0', '100']}, ['Bad width']),
+                                 ({'width': ['375', '768'], 'height': ['500', '-5']},
+                                  ['Bad height'])):
+            serializer = ScreenshotSerializer('http://fake', raw_data=raw_data)
+            self.assertFalse(serializer.is_valid())
+            self.assertEqual(serializer.errors, errors)
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'width': '100', 'height': ''})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.data, {'width': 100})
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'width': ['375'] * 21})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, ['Too many viewports: the maximum is 20'])
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'width': ['375', '768'], 'tiles': 'true', 'format': 'jpeg'})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, [
+            'Bad tiles: a single viewport must be given',
+            'Bad tiles: the images of an archive cannot be transformed'])
+
+    def test_validate_selectors(self):
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'selector': ['#a', '#b'], 'output': 'json'})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.data, {'selectors': ['#a', '#b']})
+        archive = b''.join(stream_zip([('0000.png', b'a'), ('manifest.json', dumps(
+            [{'selector': '#a', 'file': '0000.png'}, {'selector': '#b', 'errors': ['e']}]
+        ).encode('utf-8'))]))
+        output, mimetype = serializer.get_output(archive)
+        self.assertEqual(mimetype, 'application/json')
+        self.assertEqual(loads(b''.join(output.chunks(1024))), [
+            {'selector': '#a', 'file': '0000.png', 'image': 'YQ=='},
+            {'selector': '#b', 'errors': ['e']}])
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'selector': '#a'})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.data, {'selector': '#a'})
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'selector': ['#a', '']})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, ['Bad selector'])
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'selector': ['#a'] * 21})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, ['Too many selectors: the maximum is 20'])
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'selector': ['#a', '#b'], 'width': ['100', '200'], 'full_page': 'true'})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, ['Bad selector: a single viewport must be given',
+                                             'Bad full_page: a selector cannot be specified'])
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'output': 'json'})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, ['Bad output: only an archive can be sent as json'])
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'selector': ['#a', '#b'], 'output': 'xml'})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, ['Bad output value'])
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'selector': ['#a', '#b'], 'output': ['json', 'zip']})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, ['Bad output value'])
+
+    def test_collapse_values(self):
+        self.assertEqual(collapse_values({'width': ['1', '2'], 'selector': ['#godot']}),
+                         {'width': ['1', '2'], 'selector': '#godot'})
+
+    def test_validate_repeated_values(self):
+        # width, height, wait_until, selector and the blocking lists take several values
+        for key, value, extra in (
+                ('credentials', '{"username": "a", "password": "b"}', {}),
+                ('wait_for', '#a', {}),
+                ('full_page', 'true', {}),
+                ('tiles', 'true', {}),
+                ('max_height', '100', {'full_page': 'true'}),
+                ('block_profile', 'none', {}),
+                ('cache', 'use', {}),
+                ('output', 'json', {'selector': ['#a', '#b']}),
+                ('perceptual_threshold', '5', {}),
+                ('format', 'jpeg', {}),
+                ('quality', '80', {'format': 'jpeg'}),
+                ('compress_level', '1', {}),
+                ('thumbnail_width', '10', {}),
+                ('thumbnail_height', '10', {}),
+                ('fit', 'cover', {})):
+            serializer = ScreenshotSerializer('http://fake', raw_data=collapse_values(
+                dict(extra, **{key: [value, value]})))
+            self.assertFalse(serializer.is_valid(), key)
+            self.assertEqual(len(serializer.errors), 1, key)
+            self.assertIn(key, serializer.errors[0])
+
+    @mock.patch('src.serializers.get_screenshot_cache')
+    @mock.patch('src.serializers.transform_image')
+    def test_get_output(self, transform_image_mock, get_screenshot_cache_mock):
+        transform_image_mock.side_effect = lambda bytes_obj, **kwargs: b'transformed'
+        get_screenshot_cache_mock.return_value = MemoryCache()
+
         serializer = ScreenshotSerializer('http://fake')
-        temp_f = TempFile('temp file')
-        path, attachment_filename = serializer._generic_serializer(temp_f, 'bytes obj')
-        self.assertEqual(path, 'temp file')
-        self.assertEqual(attachment_filename, 'screenshot.png')
+        serializer.is_valid()
+        self.assertEqual(serializer.get_output(b'img'), (b'img', 'image/png'))
+        transform_image_mock.assert_not_called()
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'format': 'webp'})
+        serializer.is_valid()
+        self.assertEqual(serializer.get_output(b'img'), (b'transformed', 'image/webp'))
+        self.assertEqual(serializer.get_output(b'img'), (b'transformed', 'image/webp'))
+        transform_image_mock.assert_called_once_with(b'img', image_format='webp')
+
+        serializer = ScreenshotSerializer('http://fake', raw_data={'format': 'webp',
+                                                                   'cache': 'bypass'})
+        serializer.is_valid()
+        self.assertEqual(serializer.get_output(b'img'), (b'transformed', 'image/webp'))
+        self.assertEqual(transform_image_mock.call_count, 2)
+
+    @mock.patch('src.serializers.Response')
+    def test_generic_serializer(self, response_mock):
+        class Response():
+            def __init__(self, body, mimetype=None):
+                self.body = body
+                self.mimetype = mimetype
+                self.headers = {}
+        response_mock.side_effect = Response
+        response = ScreenshotSerializer._generic_serializer(b'bytes obj')
+        self.assertEqual(response.body, b'bytes obj')
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertEqual(response.headers['Content-Disposition'],
+                         'inline; filename=screenshot.png')
+
+        response = ScreenshotSerializer._generic_serializer(b'bytes obj', 'image/jpeg')
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        self.assertEqual(response.headers['Content-Disposition'],
+                         'inline; filename=screenshot.jpeg')
 
     @mock.patch('src.serializers.jsonify')
     @mock.patch('src.serializers.ScreenshotSerializer.get_object')
+    @mock.patch('src.serializers.ScreenshotSerializer.get_output')
     @mock.patch('src.serializers.ScreenshotSerializer._generic_serializer')
-    def test_serialize(self, generic_serializer_mock, get_object_mock, jsonify_mock):
-        generic_serializer_mock.side_effect = lambda a, b: (a, b)
+    @mock.patch('src.serializers.ScreenshotSerializer.conditional_headers')
+    def test_serialize(self, conditional_headers_mock, generic_serializer_mock, get_output_mock,
+                       get_object_mock, jsonify_mock):
+        class Response():
+            def __init__(self, bytes_obj, mimetype):
+                self.bytes_obj = bytes_obj
+                self.mimetype = mimetype
+                self.headers = {}
+        generic_serializer_mock.side_effect = Response
+        get_output_mock.side_effect = lambda bytes_obj: (bytes_obj, 'image/png')
         get_object_mock.side_effect = None
         jsonify_mock.side_effect = lambda a: a
+        conditional_headers_mock.side_effect = lambda *args: ({}, False)
 
         serializer = ScreenshotSerializer('http://fake')
-        temp_file, bytes_obj = serializer.serialize(bytes_obj='Bytes obj')
-        self.assertIsInstance(temp_file, _TemporaryFileWrapper)
-        self.assertTrue(bytes_obj, 'Bytes obj')
+        response = serializer.serialize(bytes_obj='Bytes obj')
+        self.assertEqual(response.bytes_obj, 'Bytes obj')
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertEqual(response.headers, {})
+        conditional_headers_mock.assert_called_with('Bytes obj', 'image/png', None)
+        get_object_mock.assert_not_called()
 
         serializer = ScreenshotSerializer('http://fake')
         serializer.bytes_img = 'Bytes obj'
-        temp_file, bytes_obj = serializer.serialize()
-        self.assertIsInstance(temp_file, _TemporaryFileWrapper)
-        self.assertTrue(bytes_obj, 'Bytes obj')
+        serializer.cache_status = 'MISS'
+        serializer.coalesced = True
+        response = serializer.serialize()
+        self.assertEqual(response.bytes_obj, 'Bytes obj')
+        self.assertEqual(response.headers, {'X-Cache': 'MISS', 'X-Coalesced': 'true'})
 
         serializer = ScreenshotSerializer('http://fake')
         response, code = serializer.serialize()
         self.assertEqual(code, 400)
         self.assertEqual(response, {'errors': []})
+
+
+class TestBatchSerializerUnit(TestCase):
+    def test_is_valid(self):
+        for raw_data in (None, [], {'url': 'http://fake'}):
+            serializer = BatchScreenshotSerializer(raw_data)
+            self.assertFalse(serializer.is_valid())
+            self.assertEqual(serializer.errors, ['Specs must be a non-empty list'])
+
+        with mock.patch('src.serializers.settings.BATCH_MAX_SPECS', 1):
+            serializer = BatchScreenshotSerializer([{'url': 'http://fake'}] * 2)
+            self.assertFalse(serializer.is_valid())
+            self.assertEqual(serializer.errors, ['Too many specs: the maximum is 1'])
+
+        serializer = BatchScreenshotSerializer([{'url': 'http://fake', 'width': 'coucou'},
+                                                {'width': 100}, 'http://fake',
+                                                {'url': 'http://fake', 'height': '200'}])
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, ['Spec 0: Bad width', 'Spec 1: No url',
+                                             'Spec 2: No url'])
+
+        serializer = BatchScreenshotSerializer([
+            {'url': 'http://fake', 'credentials': 5},
+            {'url': 'http://fake', 'credentials': {'username': 'a', 'password': 1}},
+            {'url': 'http://fake', 'quality': [1, 2], 'format': 'jpeg'},
+            {'url': 'http://fake', 'width': True, 'height': 1.5},
+            {'url': 'http://fake', 'selector': {'a': 1}, 'wait_for': ['#a']},
+            {'url': 5}])
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, [
+            'Spec 0: Bad credentials: a json object must be given',
+            'Spec 1: Bad credentials: the values must be strings',
+            'Spec 2: Bad quality', 'Spec 3: Bad width', 'Spec 3: Bad height',
+            'Spec 4: Bad wait_for', 'Spec 4: Bad selector', 'Spec 5: Bad url'])
+
+        serializer = BatchScreenshotSerializer([{'url': 'http://fake', 'width': '100'},
+                                                {'url': 'http://other'}])
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual([s.url for s in serializer.serializers],
+                         ['http://fake', 'http://other'])
+        self.assertEqual(serializer.serializers[0].data, {'width': 100})
+
+    @mock.patch('src.serializers.jsonify')
+    def test_serialize_errors(self, jsonify_mock):
+        jsonify_mock.side_effect = lambda a: a
+        response, code = BatchScreenshotSerializer([{}]).serialize()
+        self.assertEqual(code, 400)
+        self.assertEqual(response, {'errors': ['Spec 0: No url']})
+
+    @mock.patch('src.serializers.ScreenshotSerializer.get_object', autospec=True)
+    def test_serialize(self, get_object_mock):
+        def get_object(serializer):
+            if serializer.url == 'http://bad':
+                serializer.errors.append('url unknown: "http://bad"')
+            elif serializer.url == 'http://crash':
+                raise RuntimeError('Target closed')
+            else:
+                serializer.bytes_img = serializer.url.encode('utf-8')
+                serializer.cache_status = 'MISS'
+            return serializer.bytes_img
+        get_object_mock.side_effect = get_object
+
+        serializer = BatchScreenshotSerializer(
+            [{'url': 'http://fake'}, {'url': 'http://bad'}, {'url': 'http://crash'},
+             {'url': 'http://other'}], concurrency=2)
+        response = serializer.serialize()
+        self.assertEqual(response.mimetype, 'application/zip')
+        with ZipFile(BytesIO(b''.join(response.response))) as archive:
+            self.assertEqual(sorted(archive.namelist()),
+                             ['0000.png', '0003.png', 'manifest.json'])
+            self.assertEqual(archive.read('0003.png'), b'http://other')
+            manifest = loads(archive.read('manifest.json').decode('utf-8'))
+        self.assertEqual(manifest, [
+            {'index': 0, 'url': 'http://fake', 'file': '0000.png', 'cache': 'MISS'},
+            {'index': 1, 'url': 'http://bad', 'errors': ['url unknown: "http://bad"']},
+            {'index': 2, 'url': 'http://crash', 'errors': ['Target closed']},
+            {'index': 3, 'url': 'http://other', 'file': '0003.png', 'cache': 'MISS'},
+        ])
+
+    @mock.patch('src.serializers.ScreenshotSerializer.get_object', autospec=True)
+    def test_serialize_json_archive(self, get_object_mock):
+        viewports = b''.join(stream_zip([('0000-375x500.png', b'a'), ('0001-768x500.png', b'b')]))
+        def get_object(serializer):
+            serializer.bytes_img = viewports
+            serializer.cache_status = 'MISS'
+            return serializer.bytes_img
+        get_object_mock.side_effect = get_object
+
+        serializer = BatchScreenshotSerializer([{'url': 'http://fake', 'width': ['375', '768'],
+                                                 'height': '500', 'output': 'json'}])
+        response = serializer.serialize()
+        with ZipFile(BytesIO(b''.join(response.response))) as archive:
+            self.assertEqual(archive.namelist(), ['0000.json', 'manifest.json'])
+            entries = loads(archive.read('0000.json').decode('utf-8'))
+        self.assertEqual([entry['file'] for entry in entries],
+                         ['0000-375x500.png', '0001-768x500.png'])
+
+    @mock.patch('src.serializers.ScreenshotSerializer.get_object', autospec=True)
+    def test_get_objects_closed(self, get_object_mock):
+        release = Event()
+        started = []
+
+        def get_object(serializer):
+            started.append(serializer.url)
+            if serializer.url != 'http://fast':
+                release.wait(5)
+            serializer.bytes_img = b'img'
+            return serializer.bytes_img
+        get_object_mock.side_effect = get_object
+
+        serializer = BatchScreenshotSerializer(
+            [{'url': 'http://fast'}, {'url': 'http://slow'}, {'url': 'http://queued'},
+             {'url': 'http://other'}], concurrency=2)
+        self.assertTrue(serializer.is_valid())
+        objects = serializer.get_objects()
+        index, _ = next(objects)
+        self.assertEqual(index, 0)
+        closed_at = monotonic()
+        objects.close()
+        self.assertLess(monotonic() - closed_at, 1)
+        release.set()
+        self.assertNotIn('http://other', started)
@@ -0,0 +1,158 @@
+from asyncio import new_event_loop, run
+from unittest import TestCase, mock
+
+from src.browser_pool import BrowserPool
+from src.renderer import render_screenshot
+from src.sessions import SessionStore, credentials_key
+
+
+class Context():
+    def __init__(self):
+        self.closed = False
+    async def close(self):
+        self.closed = True
+
+
+class Process():
+    def poll(self):
+        return None
+
+
+class Browser():
+    def __init__(self):
+        self.process = Process()
+        self.contexts = []
+    async def createIncognitoBrowserContext(self):
+        context = Context()
+        self.contexts.append(context)
+        return context
+    async def version(self):
+        return 'HeadlessChrome'
+    async def close(self):
+        pass
+
+
+async def fake_launch(**kwargs):
+    return Browser()
+
+
+async def fake_render_screenshot(browser, url, session=None, **kwargs):
+    return browser, session
+
+
+class FakePage():
+    def __init__(self, cookies):
+        self.cookies_set = []
+        self.cache_enabled = None
+        self.credentials = None
+        self._cookies = cookies
+    async def authenticate(self, credentials):
+        self.credentials = credentials
+    async def setCacheEnabled(self, enabled=True):
+        self.cache_enabled = enabled
+    async def setCookie(self, *cookies):
+        self.cookies_set.extend(cookies)
+    async def cookies(self):
+        return self._cookies
+    def on(self, event, listener):
+        pass
+    async def goto(self, url, waitUntil=None):
+        pass
+    async def screenshot(self):
+        return b'img'
+    async def close(self):
+        pass
+
+
+class FakeContext():
+    def __init__(self, page):
+        self.page = page
+    async def newPage(self):
+        return self.page
+
+
+class TestSessionsUnit(TestCase):
+    def test_credentials_key(self):
+        self.assertEqual(credentials_key({'username': 'a', 'password': 'b'}),
+                         credentials_key({'password': 'b', 'username': 'a'}))
+        self.assertNotEqual(credentials_key({'username': 'a', 'password': 'b'}),
+                            credentials_key({'username': 'a', 'password': 'c'}))
+
+    def test_store(self):
+        store = SessionStore(idle_timeout=10, max_sessions=2)
+        first = store.get({'token': 'a', 'token_in_header': True})
+        self.assertIs(store.get({'token_in_header': True, 'token': 'a'}), first)
+        second = store.get({'token': 'b', 'token_in_header': True})
+        self.assertIsNot(second, first)
+        store.get({'token': 'a', 'token_in_header': True})
+        store.get({'token': 'c', 'token_in_header': True})
+        self.assertEqual(len(store), 2)
+        self.assertTrue(store.is_alive(first.key))
+        self.assertFalse(store.is_alive(second.key))
+
+        with mock.patch('src.sessions.monotonic', lambda: first.last_used + 10):
+            self.assertFalse(store.is_alive(first.key))
+        self.assertEqual(len(store), 1)
+
+    @mock.patch('src.browser_pool.render_screenshot', fake_render_screenshot)
+    @mock.patch('src.browser_pool.launch', fake_launch)
+    def test_pool(self):
+        pool = BrowserPool(size=1, session_idle_timeout=10)
+        credentials = {'username': 'makina', 'password': 'makina'}
+        async def main():
+            return [await pool.render('http://fake', credentials=credentials),
+                    await pool.render('http://fake', credentials=dict(credentials)),
+                    await pool.render('http://fake', credentials={'token': 'a',
+                                                                  'token_in_header': True}),
+                    await pool.render('http://fake')]
+        results = run(main())
+        self.assertIs(results[0][0], results[1][0])
+        self.assertIs(results[0][1], results[1][1])
+        self.assertIsNot(results[2][0], results[0][0])
+        self.assertIsInstance(results[3][0], Browser)
+        self.assertIsNone(results[3][1])
+        self.assertEqual(pool.stats()['session_count'], 2)
+        self.assertEqual(pool.stats()['session_reuse_count'], 1)
+
+        with mock.patch('src.sessions.monotonic', lambda: results[2][1].last_used + 10):
+            run(pool.render('http://fake'))
+        self.assertTrue(results[0][0].closed)
+        self.assertTrue(results[2][0].closed)
+        self.assertEqual(pool._idle[0].contexts, {})
+
+    @mock.patch('src.browser_pool.render_screenshot', fake_render_screenshot)
+    @mock.patch('src.browser_pool.launch', fake_launch)
+    def test_pool_disabled(self):
+        pool = BrowserPool(size=1, session_idle_timeout=0)
+        browser, session = run(pool.render('http://fake', credentials={'token': 'a',
+                                                                       'token_in_header': True}))
+        self.assertIsInstance(browser, Browser)
+        self.assertIsNone(session)
+
+    def test_render(self):
+        session = SessionStore().get({'username': 'makina', 'password': 'makina'})
+        session.cookies = [{'name': 'old', 'value': '1', 'domain': 'fake'}]
+        page = FakePage([{'name': 'new', 'value': '2', 'domain': 'fake'}])
+        loop = new_event_loop()
+        try:
+            loop.run_until_complete(render_screenshot(
+                FakeContext(page), 'http://fake', credentials={'username': 'makina',
+                                                               'password': 'makina'},
+                session=session))
+        finally:
+            loop.close()
+        self.assertEqual(page.credentials, {'username': 'makina', 'password': 'makina'})
+        self.assertTrue(page.cache_enabled)
+        self.assertEqual(page.cookies_set, [{'name': 'old', 'value': '1', 'domain': 'fake'}])
+        self.assertEqual(session.cookies, [{'name': 'new', 'value': '2', 'domain': 'fake'}])
+
+        page = FakePage([])
+        loop = new_event_loop()
+        try:
+            loop.run_until_complete(render_screenshot(
+                FakeContext(page), 'http://fake', credentials={'username': 'makina',
+                                                               'password': 'makina'}))
+        finally:
+            loop.close()
+        self.assertFalse(page.cache_enabled)
+        self.assertEqual(page.cookies_set, [])
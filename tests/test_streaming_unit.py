@@ -0,0 +1,84 @@
+from asyncio import run
+from json import loads
+from unittest import TestCase, mock
+
+from src.archive import stream_zip
+from src.asgi import ScreenshotApplication
+from src.conditional import content_etag
+from src.serializers import ScreenshotSerializer
+from src.streaming import SpooledBody
+
+
+def _failing_chunks():
+    yield b'abc'
+    raise RuntimeError('Target closed')
+
+
+class TestStreamingUnit(TestCase):
+    def test_spooled_body(self):
+        body = SpooledBody([b'abc', b'def'], max_size=10)
+        self.assertEqual(len(body), 6)
+        self.assertFalse(body.spilled)
+        self.assertEqual(content_etag(body), content_etag(b'abcdef'))
+        self.assertEqual(list(body.chunks(4)), [b'abcd', b'ef'])
+        self.assertTrue(body._file.closed)
+
+        body = SpooledBody([b'abc', b'def'], max_size=4)
+        self.assertTrue(body.spilled)
+        chunks = body.chunks(4)
+        self.assertEqual(next(chunks), b'abcd')
+        chunks.close()
+        self.assertTrue(body._file.closed)
+
+    @mock.patch('src.streaming.SpooledTemporaryFile')
+    def test_spooled_body_error(self, spooled_temporary_file_mock):
+        with self.assertRaises(RuntimeError):
+            SpooledBody(_failing_chunks(), max_size=4)
+        spooled_temporary_file_mock.return_value.close.assert_called_once_with()
+
+    @mock.patch('src.serializers.settings.STREAM_CHUNK_SIZE', 4)
+    def test_generic_serializer(self):
+        response = ScreenshotSerializer._generic_serializer(b'abcdefghij')
+        self.assertFalse(response.is_streamed)
+
+        body = SpooledBody([b'{"a": ', b'1}'], max_size=4)
+        response = ScreenshotSerializer._generic_serializer(body, 'application/json')
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.headers['Content-Length'], '8')
+        self.assertEqual(next(iter(response.response)), b'{"a"')
+        response.close()
+        self.assertTrue(body._file.closed)
+
+    @mock.patch('src.serializers.settings.SPOOL_MAX_SIZE', 16)
+    def test_serialize_json(self):
+        archive = b''.join(stream_zip([('0000.png', b'a' * 64)]))
+        serializer = ScreenshotSerializer('http://fake', raw_data={
+            'selector': ['#a', '#b'], 'output': 'json'})
+        self.assertTrue(serializer.is_valid())
+        response = serializer.serialize(bytes_obj=archive)
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(loads(response.get_data())[0]['file'], '0000.png')
+        etag = response.headers['ETag']
+
+        with mock.patch('src.serializers.SpooledBody.close') as close_mock:
+            response = serializer.serialize(bytes_obj=archive, if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        close_mock.assert_called_once_with()
+
+    @mock.patch('src.asgi.settings.STREAM_CHUNK_SIZE', 4)
+    def test_asgi_send(self):
+        sent = []
+        async def send(message):
+            sent.append(message)
+        run(ScreenshotApplication._send(send, 200, b'abcdefghij', 'image/png'))
+        self.assertEqual([message['body'] for message in sent[1:]], [b'abcdefghij'])
+
+        sent = []
+        body = SpooledBody([b'abcdefghij'], max_size=4)
+        run(ScreenshotApplication._send(send, 200, body, 'application/json'))
+        self.assertEqual(dict(sent[0]['headers'])[b'content-length'], b'10')
+        self.assertEqual([message['body'] for message in sent[1:]],
+                         [b'abcd', b'efgh', b'ij', b''])
+        self.assertEqual([message.get('more_body') for message in sent[1:]],
+                         [True, True, True, None])
+        self.assertTrue(body._file.closed)
@@ -0,0 +1,184 @@
+from asyncio import new_event_loop
+from io import BytesIO
+from json import loads
+from unittest import TestCase
+from zipfile import ZipFile
+
+from PIL import Image
+
+from pyppeteer.errors import ElementHandleError
+
+from src.renderer import render_screenshot
+from src.tiles import PNGStitcher, TileArchive, crop_tile
+
+
+def _png(width, height, color, mode='RGB'):
+    output = BytesIO()
+    Image.new(mode, (width, height), color).save(output, format='PNG')
+    return output.getvalue()
+
+
+class FakePage():
+    """
+    A 40x100 page whose rows are colored by their index, seen through a 40x30 viewport.
+    """
+    viewport = {'width': 40, 'height': 30}
+
+    def __init__(self):
+        self.scroll_y = 0
+        self.closed = False
+        self.navigations = 0
+        self.listeners = {}
+
+    def on(self, event, listener):
+        self.listeners.setdefault(event, []).append(listener)
+
+    async def setViewport(self, viewport):
+        self.viewport = dict(viewport)
+
+    async def goto(self, url, waitUntil=None):
+        self.navigations += 1
+
+    async def evaluate(self, function, *args):
+        if not args:
+            return 100
+        self.scroll_y = min(args[0], 100 - 30)
+        return self.scroll_y
+
+    async def screenshot(self):
+        img = Image.new('RGB', (self.viewport['width'], self.viewport['height']))
+        for row in range(self.viewport['height']):
+            img.paste((self.scroll_y + row, 0, 0), (0, row, img.width, row + 1))
+        output = BytesIO()
+        img.save(output, format='PNG')
+        return output.getvalue()
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeElement():
+    def __init__(self, box):
+        self.box = box
+
+    async def boundingBox(self):
+        return self.box
+
+    async def screenshot(self):
+        return _png(int(self.box['width']), int(self.box['height']), 'red')
+
+
+class FakeSelectorPage(FakePage):
+    elements = {'#title': FakeElement({'x': 0, 'y': 0, 'width': 40, 'height': 10}),
+                '#hidden': FakeElement(None)}
+
+    async def querySelector(self, selector):
+        if selector == '!!':
+            raise ElementHandleError('bad selector')
+        return self.elements.get(selector)
+
+
+class FakeBrowser():
+    def __init__(self, page_class=FakePage):
+        self.page = page_class()
+
+    async def newPage(self):
+        return self.page
+
+
+class TestTilesUnit(TestCase):
+    def test_crop_tile(self):
+        self.assertEqual(crop_tile(_png(10, 20, 'red')).size, (10, 20))
+        self.assertEqual(crop_tile(_png(10, 20, 'red'), top=5).size, (10, 15))
+        self.assertEqual(crop_tile(_png(10, 20, 'red'), top=5, height=10).size, (10, 10))
+        self.assertEqual(crop_tile(_png(10, 20, 'red'), top=5, height=50).size, (10, 15))
+
+    def test_stitcher(self):
+        stitcher = PNGStitcher(25)
+        stitcher.add(_png(10, 10, 'red'))
+        stitcher.add(_png(10, 10, 'blue', mode='RGBA'), top=2, height=5)
+        stitcher.add(_png(10, 10, 'green'))
+        img = Image.open(BytesIO(stitcher.close()))
+        self.assertEqual(img.size, (10, 25))
+        self.assertEqual(img.mode, 'RGB')
+        self.assertEqual(img.getpixel((5, 9)), (255, 0, 0))
+        self.assertEqual(img.getpixel((5, 10)), (0, 0, 255))
+        self.assertEqual(img.getpixel((5, 15)), (0, 128, 0))
+        self.assertEqual(img.getpixel((5, 24)), (0, 128, 0))
+
+    def test_stitcher_padding(self):
+        stitcher = PNGStitcher(15)
+        stitcher.add(_png(10, 10, 'red', mode='RGBA'))
+        img = Image.open(BytesIO(stitcher.close()))
+        self.assertEqual(img.size, (10, 15))
+        self.assertEqual(img.mode, 'RGBA')
+        self.assertEqual(img.getpixel((5, 14)), (255, 255, 255, 255))
+
+    def test_tile_archive(self):
+        archive = TileArchive()
+        tile = _png(10, 10, 'red')
+        archive.add(tile)
+        archive.add(tile, top=4, height=6)
+        with ZipFile(BytesIO(archive.close())) as zip_file:
+            self.assertEqual(zip_file.namelist(), ['tile-0000.png', 'tile-0001.png'])
+            self.assertEqual(zip_file.read('tile-0000.png'), tile)
+            self.assertEqual(Image.open(BytesIO(zip_file.read('tile-0001.png'))).size, (10, 6))
+
+    def test_full_page(self):
+        browser = FakeBrowser()
+        loop = new_event_loop()
+        try:
+            bytes_img = loop.run_until_complete(render_screenshot(
+                browser, 'http://fake', full_page=True, max_height=1000))
+            img = Image.open(BytesIO(bytes_img))
+            self.assertEqual(img.size, (40, 100))
+            self.assertEqual([img.getpixel((0, row))[0] for row in range(100)], list(range(100)))
+            self.assertTrue(browser.page.closed)
+
+            bytes_img = loop.run_until_complete(render_screenshot(
+                browser, 'http://fake', full_page=True, max_height=50))
+            self.assertEqual(Image.open(BytesIO(bytes_img)).size, (40, 50))
+
+            archive = loop.run_until_complete(render_screenshot(
+                browser, 'http://fake', tiles=True, max_height=1000))
+            with ZipFile(BytesIO(archive)) as zip_file:
+                sizes = [Image.open(BytesIO(zip_file.read(name))).size
+                         for name in zip_file.namelist()]
+                last = Image.open(BytesIO(zip_file.read('tile-0003.png')))
+            self.assertEqual(sizes, [(40, 30), (40, 30), (40, 30), (40, 10)])
+            self.assertEqual(last.getpixel((0, 0))[0], 90)
+        finally:
+            loop.close()
+
+    def test_viewports(self):
+        browser = FakeBrowser()
+        loop = new_event_loop()
+        try:
+            archive = loop.run_until_complete(render_screenshot(
+                browser, 'http://fake', width=1000, viewports=[
+                    {'width': 20, 'height': 10}, {'width': 40, 'height': 30}]))
+        finally:
+            loop.close()
+        self.assertEqual(browser.page.navigations, 1)
+        with ZipFile(BytesIO(archive)) as zip_file:
+            self.assertEqual(zip_file.namelist(), ['0000-20x10.png', '0001-40x30.png'])
+            self.assertEqual(Image.open(BytesIO(zip_file.read('0000-20x10.png'))).size, (20, 10))
+            self.assertEqual(Image.open(BytesIO(zip_file.read('0001-40x30.png'))).size, (40, 30))
+
+    def test_selectors(self):
+        browser = FakeBrowser(FakeSelectorPage)
+        loop = new_event_loop()
+        try:
+            archive = loop.run_until_complete(render_screenshot(
+                browser, 'http://fake', selectors=['#title', '#missing', '#hidden', '!!']))
+        finally:
+            loop.close()
+        self.assertEqual(browser.page.navigations, 1)
+        with ZipFile(BytesIO(archive)) as zip_file:
+            self.assertEqual(zip_file.namelist(), ['0000.png', 'manifest.json'])
+            self.assertEqual(loads(zip_file.read('manifest.json')), [
+                {'selector': '#title', 'file': '0000.png',
+                 'box': {'x': 0, 'y': 0, 'width': 40, 'height': 10}},
+                {'selector': '#missing', 'errors': ['selector unknown: "#missing"']},
+                {'selector': '#hidden', 'errors': ['selector not visible: "#hidden"']},
+                {'selector': '!!', 'errors': ['bad selector']}])
@@ -0,0 +1,43 @@
+from io import BytesIO
+from unittest import TestCase
+
+from PIL import Image
+
+from src.transforms import resize_image, transform_image
+
+
+def _png(size=(400, 200), mode='RGBA'):
+    output = BytesIO()
+    Image.new(mode, size, (255, 0, 0, 128) if mode == 'RGBA' else (255, 0, 0)).save(output,
+                                                                                     'PNG')
+    return output.getvalue()
+
+
+class TestTransformsUnit(TestCase):
+    def test_resize_image(self):
+        img = Image.new('RGB', (400, 200))
+        self.assertIs(resize_image(img), img)
+        self.assertEqual(resize_image(img, width=100).size, (100, 50))
+        self.assertEqual(resize_image(img, height=100).size, (200, 100))
+        self.assertEqual(resize_image(img, width=100, height=100).size, (100, 50))
+        self.assertEqual(resize_image(img, width=100, height=100, fit='contain').size, (100, 50))
+        self.assertEqual(resize_image(img, width=100, height=100, fit='cover').size, (100, 100))
+        self.assertEqual(resize_image(img, width=100, height=100, fit='fill').size, (100, 100))
+        self.assertEqual(resize_image(img, width=100000).size, (400, 200))
+        self.assertEqual(resize_image(img, height=1000).size, (400, 200))
+        self.assertEqual(resize_image(img, width=800, height=100, fit='fill').size, (400, 50))
+        self.assertEqual(resize_image(img, width=1000, height=1000, fit='cover').size,
+                         (200, 200))
+
+    def test_transform_image(self):
+        img = Image.open(BytesIO(transform_image(_png(), image_format='jpeg', quality=50)))
+        self.assertEqual((img.format, img.mode, img.size), ('JPEG', 'RGB', (400, 200)))
+        red, green, blue = img.getpixel((10, 10))
+        self.assertGreater(green, 100)
+
+        img = Image.open(BytesIO(transform_image(_png(), image_format='webp', width=100)))
+        self.assertEqual((img.format, img.size), ('WEBP', (100, 50)))
+
+        img = Image.open(BytesIO(transform_image(_png(mode='RGB'), compress_level=9,
+                                                 width=40, height=40, fit='cover')))
+        self.assertEqual((img.format, img.size), ('PNG', (40, 40)))
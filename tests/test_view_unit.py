@@ -1,36 +1,108 @@
 from unittest import TestCase, mock
 from unittest.mock import MagicMock
 
-from src.views import take_screenshot_view
+from src.admission import AdmissionError, RateLimiter
+from src.jobs import QueueFullError
+from src.prewarm import Prewarmer
+from src.views import (admission_error_view, compare_view, create_job_view, prewarm_entry_view,
+                       prewarm_view, take_screenshot_view, take_screenshots_view)
 
 
 class Form():
-    def to_dict(self):
-        return {'wait_until': 'load'}
+    def to_dict(self, flat=True):
+        return {'wait_until': 'load' if flat else ['load']}
 class GetRequest():
     def __init__(self):
         self.args = {'url': 'http://fake'}
         self.method = 'GET'
         self.form = Form()
+        self.headers = {}
 class PostRequest():
     def __init__(self):
         self.args = {'url': 'http://fake'}
         self.method = 'POST'
         self.form = Form()
+        self.headers = {}
 class NoUrlRequest():
     def __init__(self):
         self.args = {}
         self.method = 'POST'
         self.form = Form()
+        self.headers = {}
+
+class JsonRequest():
+    def __init__(self, json):
+        self.json = json
+    def get_json(self, silent=False):
+        return self.json
+
+class JobPostRequest():
+    def __init__(self, form, headers=None):
+        self.args = {'url': 'http://fake'}
+        self.method = 'POST'
+        self.headers = headers if headers else {}
+        self.form = mock.Mock(to_dict=lambda flat=True: {
+            key: value if flat else [value] for key, value in form.items()})
+
+
+class CompareRequest():
+    def __init__(self, args, files):
+        self.args = args
+        self.method = 'POST'
+        self.form = Form()
+        self.files = files
+
+
+class CompareSerializer():
+    def __init__(self, url, raw_data=None, baseline=None):
+        self.url = url
+        self.raw_data = raw_data
+        self.baseline = baseline
+    def serialize(self):
+        return self.url, self.raw_data, self.baseline
+
+
+class JsonResponse():
+    def __init__(self, json):
+        self.json = json
+        self.status_code = 200
+        self.headers = {}
+
+
+class Job():
+    id = 'job_id'
+    def to_dict(self):
+        return {'id': self.id}
+
+
+class JobManager():
+    def __init__(self, full=False):
+        self.full = full
+        self.submitted = []
+    def submit(self, url, raw_data=None, callback_url=None):
+        if self.full:
+            raise QueueFullError(3)
+        self.submitted.append((url, raw_data, callback_url))
+        return Job()
 
 
 class ScreenshotSerializer():
     def __init__(self, url, raw_data=None):
         self.url = url
         self.raw_data = raw_data
-    def serialize(self):
+        self.errors = ['Bad width'] if raw_data and 'width' in raw_data else []
+        self.valid = None
+    def is_valid(self):
+        return not self.errors
+    def serialize(self, if_none_match=None):
         return self.url, self.raw_data
 
+class BatchScreenshotSerializer():
+    def __init__(self, raw_data):
+        self.raw_data = raw_data
+    def serialize(self):
+        return self.raw_data
+
 
 class TestViewUnit(TestCase):
     @mock.patch('src.views.jsonify')
@@ -59,3 +131,165 @@ class TestViewUnit(TestCase):
         errors, status_code = take_screenshot_view()
         self.assertEqual(errors, {'errors': ['No url']})
         self.assertEqual(status_code, 400)
+
+    @mock.patch('src.serializers.jsonify')
+    def test_view_repeated_int_options(self, jsonify_mock):
+        jsonify_mock.side_effect = lambda a: a
+        for form, errors in (
+                ({'quality': ['80', '90'], 'format': 'jpeg'}, ['Bad quality']),
+                ({'compress_level': ['1', '2']}, ['Bad compress_level']),
+                ({'thumbnail_width': ['1', '2']}, ['Bad thumbnail_width']),
+                ({'thumbnail_height': ['1', '2']}, ['Bad thumbnail_height']),
+                ({'max_height': ['1', '2'], 'full_page': '1'}, ['Bad max_height']),
+                ({'perceptual_threshold': ['1', '2']}, ['Bad perceptual_threshold'])):
+            with mock.patch('src.views.request', JobPostRequest(form)):
+                self.assertEqual(take_screenshot_view(), ({'errors': errors}, 400))
+
+    @mock.patch('src.views.BatchScreenshotSerializer', BatchScreenshotSerializer)
+    def test_batch_view(self):
+        specs = [{'url': 'http://fake'}]
+        with mock.patch('src.views.request', JsonRequest(specs)):
+            self.assertEqual(take_screenshots_view(), specs)
+        with mock.patch('src.views.request', JsonRequest({'specs': specs})):
+            self.assertEqual(take_screenshots_view(), specs)
+        with mock.patch('src.views.request', JsonRequest(None)):
+            self.assertIsNone(take_screenshots_view())
+
+    @mock.patch('src.views.jsonify', JsonResponse)
+    @mock.patch('src.views.url_for', lambda endpoint, job_id: '/api/jobs/' + job_id)
+    @mock.patch('src.views.ScreenshotSerializer', ScreenshotSerializer)
+    def test_create_job_view(self):
+        manager = JobManager()
+        with mock.patch('src.views.get_job_manager', lambda: manager):
+            with mock.patch('src.views.request', JobPostRequest(
+                    {'wait_until': 'load', 'callback_url': 'http://callback'})):
+                response = create_job_view()
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.json, {'id': 'job_id'})
+            self.assertEqual(response.headers['Location'], '/api/jobs/job_id')
+            self.assertEqual(manager.submitted,
+                             [('http://fake', {'wait_until': 'load'}, 'http://callback')])
+
+            with mock.patch('src.views.request', JobPostRequest({'width': 'coucou'})):
+                response, status_code = create_job_view()
+            self.assertEqual(status_code, 400)
+            self.assertEqual(response.json, {'errors': ['Bad width']})
+
+            with mock.patch('src.views.request', JobPostRequest({'callback_url': 'file:///'})):
+                response, status_code = create_job_view()
+            self.assertEqual(status_code, 400)
+            self.assertEqual(response.json, {'errors': ['Bad callback_url']})
+
+        with mock.patch('src.views.get_job_manager', lambda: JobManager(full=True)):
+            with mock.patch('src.views.request', JobPostRequest({})):
+                response = create_job_view()
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers['Retry-After'], '3')
+
+    @mock.patch('src.views.jsonify', JsonResponse)
+    def test_admission_error_view(self):
+        response = admission_error_view(AdmissionError('Too many requests', 429, 7))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json, {'errors': ['Too many requests']})
+        self.assertEqual(response.headers['Retry-After'], '7')
+
+    @mock.patch('src.views.jsonify')
+    @mock.patch('src.views.ScreenshotSerializer', ScreenshotSerializer)
+    @mock.patch('src.admission.settings.API_KEYS', frozenset(['key']))
+    def test_rate_limit(self, jsonify_mock):
+        jsonify_mock.side_effect = lambda a: a
+        rate_limiter = RateLimiter(rate=0.1, burst=1)
+        request = GetRequest()
+        request.headers = {'X-API-Key': 'key'}
+        request.remote_addr = '1.2.3.4'
+        with mock.patch('src.views.get_rate_limiter', lambda: rate_limiter), \
+                mock.patch('src.views.request', request):
+            take_screenshot_view()
+            with self.assertRaises(AdmissionError):
+                take_screenshot_view()
+        self.assertEqual(list(rate_limiter._buckets), ['key'])
+
+    @mock.patch('src.views.jsonify')
+    @mock.patch('src.views.ScreenshotSerializer', ScreenshotSerializer)
+    @mock.patch('src.admission.settings.API_KEYS', frozenset(['key']))
+    def test_rate_limit_rotated_key(self, jsonify_mock):
+        jsonify_mock.side_effect = lambda a: a
+        rate_limiter = RateLimiter(rate=0.1, burst=1)
+        request = GetRequest()
+        request.remote_addr = '1.2.3.4'
+        with mock.patch('src.views.get_rate_limiter', lambda: rate_limiter), \
+                mock.patch('src.views.request', request):
+            request.headers = {'X-API-Key': 'random-1'}
+            take_screenshot_view()
+            request.headers = {'X-API-Key': 'random-2'}
+            with self.assertRaises(AdmissionError):
+                take_screenshot_view()
+        self.assertEqual(list(rate_limiter._buckets), ['1.2.3.4'])
+
+    @mock.patch('src.views.jsonify')
+    @mock.patch('src.views.CompareSerializer', CompareSerializer)
+    def test_compare_view(self, jsonify_mock):
+        jsonify_mock.side_effect = lambda a: a
+        baseline = mock.Mock(read=lambda: b'img')
+        with mock.patch('src.views.request', CompareRequest({'url': 'http://fake'},
+                                                            {'baseline': baseline})):
+            self.assertEqual(compare_view(), ('http://fake', {'wait_until': 'load'}, b'img'))
+        with mock.patch('src.views.request', CompareRequest({'url': 'http://fake'}, {})):
+            self.assertEqual(compare_view(), ('http://fake', {'wait_until': 'load'}, None))
+        with mock.patch('src.views.request', CompareRequest({}, {})):
+            self.assertEqual(compare_view(), ({'errors': ['No url']}, 400))
+
+    @mock.patch('src.views.jsonify', JsonResponse)
+    @mock.patch('src.views.settings.PREWARM_ADMIN_KEY', 'admin')
+    def test_prewarm_view(self):
+        prewarmer = Prewarmer()
+        admin = {'X-Admin-Key': 'admin'}
+        with mock.patch('src.views.get_prewarmer', lambda: prewarmer):
+            with mock.patch('src.views.request', JobPostRequest({'width': '100'}, admin)):
+                response, status_code = prewarm_view()
+            self.assertEqual(status_code, 201)
+            self.assertTrue(response.json['pinned'])
+            self.assertEqual(response.json['data'], {'width': '100'})
+            key = response.json['key']
+
+            with mock.patch('src.views.request', JobPostRequest({
+                    'credentials': '{"token": "a", "token_in_header": true}'}, admin)):
+                response, status_code = prewarm_view()
+            self.assertEqual(status_code, 400)
+            with mock.patch('src.views.request', JobPostRequest({'width': 'a'}, admin)):
+                response, status_code = prewarm_view()
+            self.assertEqual(response.json, {'errors': ['Bad width']})
+
+            request = GetRequest()
+            request.headers = admin
+            with mock.patch('src.views.request', request):
+                response = prewarm_view()
+                self.assertEqual([entry['key'] for entry in response.json['entries']], [key])
+
+                self.assertEqual(prewarm_entry_view(key).status_code, 204)
+                response, status_code = prewarm_entry_view(key)
+            self.assertEqual(status_code, 404)
+            self.assertEqual(prewarmer.entries(), [])
+
+    @mock.patch('src.views.jsonify', JsonResponse)
+    def test_prewarm_view_admin_key(self):
+        prewarmer = Prewarmer()
+        with mock.patch('src.views.get_prewarmer', lambda: prewarmer):
+            for admin_key, headers in (('', {}), ('', {'X-Admin-Key': ''}),
+                                       ('admin', {}), ('admin', {'X-Admin-Key': 'other'})):
+                with mock.patch('src.views.settings.PREWARM_ADMIN_KEY', admin_key), \
+                        mock.patch('src.views.request', JobPostRequest({}, headers)):
+                    response, status_code = prewarm_view()
+                    self.assertEqual(status_code, 403)
+                    self.assertEqual(response.json, {'errors': ['Bad admin key']})
+                    self.assertEqual(prewarm_entry_view('key')[1], 403)
+        self.assertEqual(prewarmer.entries(), [])
+
+        rate_limiter = RateLimiter(rate=0.1, burst=1)
+        request = GetRequest()
+        request.remote_addr = '1.2.3.4'
+        with mock.patch('src.views.get_rate_limiter', lambda: rate_limiter), \
+                mock.patch('src.views.request', request):
+            prewarm_view()
+            with self.assertRaises(AdmissionError):
+                prewarm_entry_view('key')